@@ -1,19 +1,27 @@
 # app/main.py
+import asyncio
+import json
 import logging
 import os
-from typing import Dict
-from fastapi import FastAPI, HTTPException, Depends, Request
-from fastapi.responses import JSONResponse
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBasic, HTTPBasicCredentials, HTTPBearer
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from app.utils.loader import discover_documents
-from scripts.ingest import build_docs_for_vectorstore
-from app.services.vectorstore import VectorStore
-from app.services.rag import answer_query_with_rag, allowed_departments
+from app.services.rag import (CHAT_BATCH_MAX_ITEMS, aanswer_query_with_rag, abatch_answer_queries,
+                              astream_query_with_rag, allowed_departments)
+from app.services.jobs import jobs, rollback
+from app.services.admission import DEADLINE_HEADER, AdmissionRejected, admission
+from app.services.cache import cache_stats, index_generation
+from app.services import registry
+from app.services.auth import InvalidToken, issue_token, verify_basic, verify_token
+from app.services.sessions import end_session, get_session, peek_session
+from app.services.metrics import TRACE_HEADER, profiler, render_prometheus, request_context, server_timing, trace_dict
 
 # -------------------------
 # Logging
@@ -25,29 +33,59 @@ logger = logging.getLogger("finbot")
 # -------------------------
 # App & Auth
 # -------------------------
-app = FastAPI(title="FinSolve RBAC Chatbot - Production-ready")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the embedding model and open the store before (or while) serving traffic
+    if registry.WARMUP_MODE == "blocking":
+        state = registry.warm_up()
+        logger.info("Warm-up %s: %s", state["status"], state["stages_ms"])
+    elif registry.WARMUP_MODE == "background":
+        registry.start_background_warm_up()
+    yield
 
-security = HTTPBasic()
+app = FastAPI(title="FinSolve RBAC Chatbot - Production-ready", lifespan=lifespan)
 
-# Dummy user DB (demo only)
+basic_security = HTTPBasic(auto_error=False)
+bearer_security = HTTPBearer(auto_error=False)
+
+# Dummy user DB (demo only). PBKDF2 hashes of the demo passwords listed in the README;
+# create new ones with app.services.auth.hash_password
 users_db: Dict[str, Dict[str, str]] = {
-    "Tony": {"password": "password123", "role": "engineering"},
-    "Bruce": {"password": "securepass", "role": "marketing"},
-    "Sam": {"password": "financepass", "role": "finance"},
-    "Peter": {"password": "pete123", "role": "engineering"},
-    "Sid": {"password": "sidpass123", "role": "marketing"},
-    "Natasha": {"password": "hrpass123", "role": "hr"},
-    "Admin": {"password": "adminpw", "role": "c_level"}
+    "Tony": {"password_hash": "pbkdf2_sha256$200000$9XMpIK_-FjmYU4-k9vAqow$Ckf9zqkZstxPnRP5VGLrpmZbWlMqoehSy6YfjcNiZ2g", "role": "engineering"},
+    "Bruce": {"password_hash": "pbkdf2_sha256$200000$p9K4KfOVhPmE1XT1CPHZqQ$bMPIehi1I3adlKV4Y4SSh9qbPWpdPF42-x3dzOeDAbs", "role": "marketing"},
+    "Sam": {"password_hash": "pbkdf2_sha256$200000$8eMXFLVlRlOl_7o42sk7fQ$5t5KW7DAarTqxSt3Vsy_vMbKMoIPdZfTMbanqofrP48", "role": "finance"},
+    "Peter": {"password_hash": "pbkdf2_sha256$200000$0XP4eIRxgv5IOdElT4vwyQ$iBvjYq8ZlqdGayBamcaNwOsyW0LnRop0ylRhnS9JgrA", "role": "engineering"},
+    "Sid": {"password_hash": "pbkdf2_sha256$200000$Dqkh-32tm7sFCrXMwQKDyA$wA-vNKbpSDX6WzQt2GU7ZD7xW_A3DD3t2ZMv6JgPa-E", "role": "marketing"},
+    "Natasha": {"password_hash": "pbkdf2_sha256$200000$aL6Ez9iBF35kwOgojZoi5g$EipyOuC0FrYkr1owxjWGldYUK8wkA9igowobC062gkk", "role": "hr"},
+    "Admin": {"password_hash": "pbkdf2_sha256$200000$SWMB2GtvLVQwDB3GQG9ClA$rGUSpZ5IsG985Tk2jYaTOcyi2m0cQQVOXIH1MxkF8ow", "role": "c_level"}
 }
 
-def authenticate(credentials: HTTPBasicCredentials = Depends(security)):
-    username = credentials.username
-    password = credentials.password
-    user = users_db.get(username)
-    if not user or user["password"] != password:
-        logger.warning("Authentication failed for user=%s", username)
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-    return {"username": username, "role": user["role"]}
+def _unauthorized(detail: str):
+    return HTTPException(status_code=401, detail=detail, headers={"WWW-Authenticate": "Bearer, Basic"})
+
+def authenticate_basic(credentials: Optional[HTTPBasicCredentials] = Depends(basic_security)):
+    """Username/password only: used by /login to issue a token."""
+    if credentials is None:
+        raise _unauthorized("Missing credentials")
+    user = verify_basic(credentials.username, credentials.password, users_db)
+    if user is None:
+        logger.warning("Authentication failed for user=%s", credentials.username)
+        raise _unauthorized("Invalid credentials")
+    return user
+
+def authenticate(bearer: Optional[HTTPAuthorizationCredentials] = Depends(bearer_security),
+                 credentials: Optional[HTTPBasicCredentials] = Depends(basic_security)):
+    """
+    Bearer token from /login (HMAC check, no lookup) or, for older clients, HTTP Basic
+    (PBKDF2, with successful verifications cached for AUTH_CACHE_TTL seconds).
+    """
+    if bearer is not None:
+        try:
+            return verify_token(bearer.credentials)
+        except InvalidToken as e:
+            logger.warning("Rejected bearer token: %s", e)
+            raise _unauthorized(str(e))
+    return authenticate_basic(credentials)
 
 # -------------------------
 # Request/Response Models
@@ -57,6 +95,28 @@ class ChatRequest(BaseModel):
     top_k: int = 5
     max_new_tokens: int = 300
     temperature: float = 0.2
+    # Treat the message as a turn in the user's server-side conversation (follow-ups reuse retrieval)
+    session: bool = False
+
+class BatchChatRequest(BaseModel):
+    messages: List[str]
+    top_k: int = 5
+    max_new_tokens: int = 300
+    temperature: float = 0.2
+
+def chat_body(user: Dict[str, str], question: str, res: Dict) -> Dict:
+    body = {
+        "user": user["username"],
+        "role": user["role"],
+        "question": question,
+        "answer": res["answer"],
+        "sources": res["sources"],
+        "retrieved_count": len(res.get("retrieved", []))
+    }
+    for key in ("structured", "context", "cached", "session"):
+        if key in res:
+            body[key] = res[key]
+    return body
 
 # -------------------------
 # Health & Root
@@ -67,53 +127,263 @@ def root():
 
 @app.get("/health")
 def health():
+    # Liveness only: the process is up, models may still be loading
     return {"status": "ok"}
 
+@app.get("/ready")
+def ready():
+    # Readiness: route traffic here only once the model and store are loaded
+    state = registry.readiness()
+    return JSONResponse(status_code=200 if registry.is_ready() else 503, content=state)
+
+# -------------------------
+# Login: verify the password once, then use the token as "Authorization: Bearer <token>"
+# -------------------------
+@app.api_route("/login", methods=["GET", "POST"])
+def login(user=Depends(authenticate_basic)):
+    logger.info("Issued token for user=%s role=%s", user["username"], user["role"])
+    return {"username": user["username"], "role": user["role"], **issue_token(user["username"], user["role"])}
+
+@app.get("/stats/cache")
+def get_cache_stats(user=Depends(authenticate)):
+    return {"index_generation": index_generation.value, "caches": cache_stats()}
+
+@app.get("/metrics")
+def metrics():
+    # Prometheus scrape target: stage/request latency histograms plus cache counters
+    extra = ["# TYPE finbot_index_generation gauge", f"finbot_index_generation {index_generation.value}"]
+    queue = admission.stats()
+    extra += ["# TYPE finbot_llm_queue_depth gauge"]
+    extra += [f'finbot_llm_queue_depth{{priority="{p}"}} {n}' for p, n in queue["queued_by_priority"].items()]
+    extra += ["# TYPE finbot_llm_slots_in_use gauge", f"finbot_llm_slots_in_use {queue['in_use']}",
+              "# TYPE finbot_admission_total counter"]
+    extra += [f'finbot_admission_total{{outcome="{k}"}} {queue[k]}'
+              for k in ("admitted", "rate_limited", "queue_full", "deadline_exceeded")]
+    for field, kind in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"), ("size", "gauge")):
+        name = f"finbot_cache_{field}" + ("_total" if kind == "counter" else "")
+        extra.append(f"# TYPE {name} {kind}")
+        extra.extend(f'{name}{{cache="{cache}"}} {stats[field]}' for cache, stats in cache_stats().items())
+    return PlainTextResponse(render_prometheus(extra), media_type="text/plain; version=0.0.4")
+
+def admit(user: Dict[str, str], request: Request) -> float:
+    """Apply the user's and role's rate limits (429) and return the request's generation deadline."""
+    try:
+        admission.check(user["username"], user["role"])
+    except AdmissionRejected as e:
+        logger.warning("Rejected chat from user=%s role=%s: %s", user["username"], user["role"], e.detail)
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=e.headers())
+    return admission.deadline(request.headers.get(DEADLINE_HEADER))
+
+def wants_trace(request: Request) -> bool:
+    return request.headers.get(TRACE_HEADER, "").lower() in ("1", "true", "yes")
+
+@app.get("/stats/profile")
+def get_profile(limit: int = 30, sort: str = "cumulative", user=Depends(authenticate)):
+    if user["role"] != "c_level":
+        raise HTTPException(status_code=403, detail="Only c_level can read profiles.")
+    return PlainTextResponse(profiler.report(limit=limit, sort=sort))
+
+@app.post("/stats/profile")
+def set_profile(rate: float, reset: bool = False, user=Depends(authenticate)):
+    # Toggle the sampling profiler at runtime, e.g. rate=0.05 to profile 5% of chats, rate=0 to stop
+    if user["role"] != "c_level":
+        raise HTTPException(status_code=403, detail="Only c_level can change profiling.")
+    profiler.rate = max(0.0, min(rate, 1.0))
+    if reset:
+        profiler.reset()
+    return {"rate": profiler.rate, "profiled_calls": profiler.calls}
+
+@app.get("/stats/batching")
+def get_batching_stats(user=Depends(authenticate)):
+    batcher = registry.get_vector_store().batcher
+    return {"enabled": batcher is not None, **(batcher.stats() if batcher else {})}
+
+@app.get("/stats/admission")
+def get_admission_stats(user=Depends(authenticate)):
+    return admission.stats()
+
 # -------------------------
 # Ingest endpoint (admin-only)
 # -------------------------
-@app.post("/ingest")
-def run_ingest(user=Depends(authenticate)):
+def require_c_level(user, action: str):
     if user["role"] != "c_level":
-        logger.warning("Unauthorized ingest attempt by %s", user["username"])
-        raise HTTPException(status_code=403, detail="Only c_level can run ingest.")
+        logger.warning("Unauthorized %s attempt by %s", action, user["username"])
+        raise HTTPException(status_code=403, detail=f"Only c_level can {action}.")
+
+
+@app.post("/ingest", status_code=202)
+async def run_ingest(full: bool = False, wait: bool = False, user=Depends(authenticate)):
+    """
+    Start a background ingest job into a new collection; readers switch to it only when it
+    completes. Returns the job id at once, or with wait=true blocks until the job finishes.
+    """
+    require_c_level(user, "run ingest")
+    with request_context("ingest", user["role"]):
+        job = jobs.submit(full=full, requested_by=user["username"])
+    if not wait:
+        return job.to_dict()
+    await asyncio.get_running_loop().run_in_executor(None, job.done.wait)
+    if job.status != "succeeded":
+        raise HTTPException(status_code=500, detail=job.error or f"Ingest {job.status}")
+    report = job.report
+    logger.info("Ingestion completed: %d chunks embedded, %d skipped, %d deleted",
+                report["chunks_embedded"], report["chunks_skipped"], report["chunks_deleted"])
+    return JSONResponse({"status": "ingested", "job_id": job.id, "chunks_indexed": report["chunks_embedded"],
+                         "report": report})
+
+@app.get("/ingest/jobs")
+def list_ingest_jobs(user=Depends(authenticate)):
+    require_c_level(user, "view ingest jobs")
+    return {"collections": registry.collection_pointer(), "jobs": [j.to_dict() for j in reversed(jobs.list())]}
+
+@app.get("/ingest/jobs/{job_id}")
+def get_ingest_job(job_id: str, user=Depends(authenticate)):
+    require_c_level(user, "view ingest jobs")
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown ingest job")
+    return job.to_dict()
+
+@app.delete("/ingest/jobs/{job_id}")
+def cancel_ingest_job(job_id: str, user=Depends(authenticate)):
+    require_c_level(user, "cancel ingest jobs")
+    job = jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown ingest job")
+    return job.to_dict()
+
+@app.post("/ingest/rollback")
+def rollback_ingest(user=Depends(authenticate)):
+    require_c_level(user, "roll back the index")
+    if any(not j.finished for j in jobs.list()):
+        raise HTTPException(status_code=409, detail="An ingest job is still running")
     try:
-        docs = discover_documents()
-        prepared = build_docs_for_vectorstore(docs)
-        vs = VectorStore()
-        BATCH = 64
-        import math
-        for i in range(0, len(prepared), BATCH):
-            batch = prepared[i:i+BATCH]
-            vs.add_documents(batch)
-            logger.info("Indexed batch %d/%d", i//BATCH + 1, math.ceil(len(prepared)/BATCH))
-        logger.info("Ingestion completed: %d chunks", len(prepared))
-        return {"status": "ingested", "chunks_indexed": len(prepared)}
-    except Exception as e:
-        logger.exception("Ingest failed")
-        raise HTTPException(status_code=500, detail=str(e))
+        return {"status": "rolled_back", "collections": rollback()}
+    except LookupError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
 # -------------------------
 # Chat endpoint (RBAC + RAG + LLM)
 # -------------------------
 @app.post("/chat")
-def chat_endpoint(req: ChatRequest, user=Depends(authenticate)):
+async def chat_endpoint(req: ChatRequest, request: Request, response: Response, user=Depends(authenticate)):
     logger.info("Chat request by user=%s role=%s q=%s", user["username"], user["role"], req.message[:50])
+    deadline = admit(user, request)
     try:
-        res = answer_query_with_rag(req.message, user["role"], top_k=req.top_k,
-                                    max_new_tokens=req.max_new_tokens, temperature=req.temperature)
-        return {
-            "user": user["username"],
-            "role": user["role"],
-            "question": req.message,
-            "answer": res["answer"],
-            "sources": res["sources"],
-            "retrieved_count": len(res.get("retrieved", []))
-        }
+        session = get_session(user["username"], user["role"]) if req.session else None
+        with request_context("chat", user["role"], trace=wants_trace(request)) as ctx, \
+                admission.ticket(user["username"], user["role"], "interactive", deadline):
+            res = await aanswer_query_with_rag(req.message, user["role"], top_k=req.top_k,
+                                               max_new_tokens=req.max_new_tokens, temperature=req.temperature,
+                                               session=session)
+        body = chat_body(user, req.message, res)
+        if ctx.trace is not None:
+            # Opt-in per request with "X-Finbot-Trace: 1"
+            body["trace_ms"] = trace_dict(ctx)
+            response.headers["Server-Timing"] = server_timing(ctx)
+        return body
+    except AdmissionRejected as e:
+        logger.warning("Dropped chat from user=%s: %s", user["username"], e.detail)
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=e.headers())
+    except asyncio.TimeoutError:
+        logger.warning("LLM timed out for user=%s", user["username"])
+        raise HTTPException(status_code=504, detail="LLM generation timed out")
     except Exception as e:
         logger.exception("Chat failed")
         raise HTTPException(status_code=500, detail=str(e))
 
+# -------------------------
+# Streaming chat endpoint (NDJSON: sources first, then tokens)
+# -------------------------
+@app.post("/chat/stream")
+async def chat_stream_endpoint(req: ChatRequest, request: Request, user=Depends(authenticate)):
+    logger.info("Chat stream by user=%s role=%s q=%s", user["username"], user["role"], req.message[:50])
+    deadline = admit(user, request)
+    trace = wants_trace(request)
+    session = get_session(user["username"], user["role"]) if req.session else None
+
+    async def event_lines():
+        try:
+            with request_context("chat_stream", user["role"], trace=trace) as ctx, \
+                    admission.ticket(user["username"], user["role"], "interactive", deadline):
+                async for event in astream_query_with_rag(req.message, user["role"], top_k=req.top_k,
+                                                          max_new_tokens=req.max_new_tokens, temperature=req.temperature,
+                                                          session=session):
+                    if event["event"] == "done" and ctx.trace is not None:
+                        # Headers are long gone, so the trace travels as its own event
+                        yield json.dumps({"event": "trace", "trace_ms": trace_dict(ctx)}) + "\n"
+                    yield json.dumps(event) + "\n"
+        except AdmissionRejected as e:
+            logger.warning("Dropped chat stream from user=%s: %s", user["username"], e.detail)
+            yield json.dumps({"event": "error", "status": e.status_code, "detail": e.detail}) + "\n"
+        except asyncio.TimeoutError:
+            logger.warning("LLM stream timed out for user=%s", user["username"])
+            yield json.dumps({"event": "error", "detail": "LLM generation timed out"}) + "\n"
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            logger.exception("Chat stream failed")
+            yield json.dumps({"event": "error", "detail": str(e)}) + "\n"
+
+    return StreamingResponse(event_lines(), media_type="application/x-ndjson")
+
+# -------------------------
+# Conversation session (opt-in with "session": true on /chat and /chat/stream)
+# -------------------------
+@app.get("/session")
+def get_session_info(user=Depends(authenticate)):
+    session = peek_session(user["username"])
+    return {"active": session is not None, **(session.stats() if session else {})}
+
+@app.delete("/session")
+def delete_session(user=Depends(authenticate)):
+    # Start the next message as a fresh conversation
+    return {"ended": end_session(user["username"])}
+
+# -------------------------
+# Batch chat endpoint (NDJSON: one result per question, in completion order)
+# -------------------------
+@app.post("/chat/batch")
+async def chat_batch_endpoint(req: BatchChatRequest, request: Request, user=Depends(authenticate)):
+    if not req.messages:
+        raise HTTPException(status_code=400, detail="messages must not be empty")
+    if len(req.messages) > CHAT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {CHAT_BATCH_MAX_ITEMS} messages per batch")
+    logger.info("Chat batch by user=%s role=%s n=%d", user["username"], user["role"], len(req.messages))
+    # One charge per batch: its generations are already capped by CHAT_BATCH_PARALLELISM and queue last
+    admit(user, request)
+    # Each question waits up to ADMISSION_MAX_WAIT from when it asks for a slot; only an
+    # explicit client timeout bounds the batch as a whole
+    timeout = request.headers.get(DEADLINE_HEADER)
+    deadline = admission.deadline(timeout) if timeout else None
+
+    async def event_lines():
+        errors = 0
+        try:
+            with request_context("chat_batch", user["role"]), \
+                    admission.ticket(user["username"], user["role"], "batch", deadline):
+                async for i, res in abatch_answer_queries(req.messages, user["role"], top_k=req.top_k,
+                                                          max_new_tokens=req.max_new_tokens,
+                                                          temperature=req.temperature):
+                    if isinstance(res, Exception):
+                        errors += 1
+                        if isinstance(res, asyncio.TimeoutError):
+                            detail = "LLM generation timed out"
+                        elif isinstance(res, AdmissionRejected):
+                            detail = res.detail
+                        else:
+                            logger.error("Batch item %d failed: %s", i, res)
+                            detail = str(res)
+                        yield json.dumps({"event": "error", "index": i, "question": req.messages[i],
+                                          "detail": detail}) + "\n"
+                        continue
+                    yield json.dumps({"event": "result", "index": i, **chat_body(user, req.messages[i], res)}) + "\n"
+            yield json.dumps({"event": "done", "count": len(req.messages), "errors": errors}) + "\n"
+        except Exception as e:
+            logger.exception("Chat batch failed")
+            yield json.dumps({"event": "error", "detail": str(e)}) + "\n"
+
+    return StreamingResponse(event_lines(), media_type="application/x-ndjson")
+
 # -------------------------
 # Global exception handler (clean JSON)
 # -------------------------
@@ -0,0 +1,284 @@
+# app/services/admission.py
+# Admission control in front of LLM generation: per-user and per-role token buckets checked
+# when a chat arrives, then a bounded priority queue for the LLM_MAX_CONCURRENCY generation
+# slots. Requests whose deadline passes while they wait are dropped before the LLM is called.
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+from app.services.concurrency import LLM_MAX_CONCURRENCY
+from app.services.metrics import Histogram
+
+load_dotenv()
+
+# Chat requests per second (sustained) and burst allowed per user; 0 disables the limit
+ADMISSION_USER_RATE = float(os.getenv("ADMISSION_USER_RATE", "2"))
+ADMISSION_USER_BURST = float(os.getenv("ADMISSION_USER_BURST", "10"))
+# Default per-role limit, shared by every user of the role; 0 disables it
+ADMISSION_ROLE_RATE = float(os.getenv("ADMISSION_ROLE_RATE", "20"))
+ADMISSION_ROLE_BURST = float(os.getenv("ADMISSION_ROLE_BURST", "60"))
+# Per-role overrides, "role=rate[:burst],..." e.g. "c_level=0,engineering=5:15"
+ADMISSION_ROLE_LIMITS = os.getenv("ADMISSION_ROLE_LIMITS", "")
+# Requests allowed to wait for a generation slot; more are turned away (503)
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "64"))
+# Share of the queue batch questions may hold; the rest stays free for interactive chats
+ADMISSION_BATCH_QUEUE_SHARE = float(os.getenv("ADMISSION_BATCH_QUEUE_SHARE", "0.5"))
+# Longest a request (or each question of a batch) may wait for a slot when the client sends no deadline (seconds)
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "30"))
+# Roles whose interactive chats are served ahead of everyone else's
+ADMISSION_PRIORITY_ROLES = {r.strip() for r in os.getenv("ADMISSION_PRIORITY_ROLES", "c_level").split(",") if r.strip()}
+# Client timeout in seconds, measured from arrival; queued work past it is dropped
+DEADLINE_HEADER = "X-Request-Timeout"
+
+# Served in this order; within a class, first come first served
+PRIORITIES = ("high", "interactive", "batch")
+
+wait_seconds = Histogram("finbot_llm_queue_wait_seconds", "Time spent waiting for an LLM generation slot.",
+                         ("priority",))
+
+
+class AdmissionRejected(Exception):
+    status_code = 503
+
+    def __init__(self, detail: str, retry_after: Optional[float] = None):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(1, int(self.retry_after + 0.999)))} if self.retry_after is not None else {}
+
+
+class RateLimited(AdmissionRejected):
+    status_code = 429
+
+
+class QueueFull(AdmissionRejected):
+    status_code = 503
+
+
+class DeadlineExceeded(AdmissionRejected):
+    status_code = 504
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second up to `burst`. rate <= 0 never limits."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, cost: float = 1.0) -> float:
+        """Take `cost` tokens if available and return 0, else return seconds until they would be."""
+        return take_all([self], cost)[1]
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+def take_all(buckets: Sequence[TokenBucket], cost: float = 1.0) -> Tuple[int, float]:
+    """
+    Take `cost` tokens from every bucket, or from none of them. Returns (-1, 0) when all had
+    enough, else (index of the first short bucket, seconds until it would have them).
+    Callers must pass buckets in a consistent order (user before role) so the locks cannot deadlock.
+    """
+    limited = [b for b in buckets if b.rate > 0]
+    with ExitStack() as stack:
+        for bucket in limited:
+            stack.enter_context(bucket._lock)
+        now = time.monotonic()
+        for bucket in limited:
+            bucket._refill(now)
+        for i, bucket in enumerate(buckets):
+            if bucket.rate > 0 and bucket.tokens < cost:
+                return i, (cost - bucket.tokens) / bucket.rate
+        for bucket in limited:
+            bucket.tokens -= cost
+    return -1, 0.0
+
+
+def parse_role_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    limits = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        role, _, value = item.partition("=")
+        rate, _, burst = value.partition(":")
+        limits[role.strip()] = (float(rate), float(burst) if burst else max(float(rate) * 3, 1.0))
+    return limits
+
+
+class Ticket:
+    """
+    Who a generation is for: set per request, read when the LLM slot is requested.
+    deadline None gives every generation under the ticket its own max_wait from when it asks.
+    """
+    __slots__ = ("user", "role", "priority", "deadline")
+
+    def __init__(self, user: str, role: str, priority: str, deadline: Optional[float]):
+        self.user = user
+        self.role = role
+        self.priority = priority
+        self.deadline = deadline
+
+
+_ticket: contextvars.ContextVar[Optional[Ticket]] = contextvars.ContextVar("finbot_admission", default=None)
+
+
+class AdmissionController:
+    def __init__(self, user_rate: float = ADMISSION_USER_RATE, user_burst: float = ADMISSION_USER_BURST,
+                 role_rate: float = ADMISSION_ROLE_RATE, role_burst: float = ADMISSION_ROLE_BURST,
+                 role_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 slots: int = LLM_MAX_CONCURRENCY, queue_size: int = ADMISSION_QUEUE_SIZE,
+                 max_wait: float = ADMISSION_MAX_WAIT, batch_queue_share: float = ADMISSION_BATCH_QUEUE_SHARE):
+        self.user_limit = (user_rate, user_burst)
+        self.role_limit = (role_rate, role_burst)
+        self.role_limits = parse_role_limits(ADMISSION_ROLE_LIMITS) if role_limits is None else role_limits
+        self.slots = slots
+        self.queue_size = queue_size
+        self.batch_queue_size = int(queue_size * batch_queue_share)
+        self.max_wait = max_wait
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+        # Generation slots belong to one event loop (like the semaphore they replace)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._in_use = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self.counters = {"admitted": 0, "rate_limited": 0, "queue_full": 0, "deadline_exceeded": 0}
+
+    def _bucket(self, kind: str, key: str) -> TokenBucket:
+        with self._buckets_lock:
+            bucket = self._buckets.get((kind, key))
+            if bucket is None:
+                rate, burst = self.user_limit if kind == "user" else self.role_limits.get(key, self.role_limit)
+                bucket = self._buckets[(kind, key)] = TokenBucket(rate, burst)
+            return bucket
+
+    def priority_for(self, role: str, kind: str = "interactive") -> str:
+        # Priority roles jump ahead only with interactive traffic; their batches still queue last
+        return "high" if kind == "interactive" and role in ADMISSION_PRIORITY_ROLES else kind
+
+    def check(self, user: str, role: str):
+        """
+        Charge one request to the user's and the role's buckets; RateLimited if either is empty,
+        in which case neither is charged.
+        """
+        keys = (("user", user), ("role", role))
+        short, retry_after = take_all([self._bucket(kind, key) for kind, key in keys])
+        if short >= 0:
+            self.counters["rate_limited"] += 1
+            raise RateLimited(f"Rate limit exceeded for {keys[short][0]} {keys[short][1]}", retry_after)
+
+    def deadline(self, timeout: Optional[str] = None) -> float:
+        """Monotonic deadline for a request arriving now with the client's timeout (seconds), if any."""
+        try:
+            seconds = float(timeout) if timeout else self.max_wait
+        except ValueError:
+            seconds = self.max_wait
+        return time.monotonic() + seconds
+
+    @contextmanager
+    def ticket(self, user: str, role: str, kind: str = "interactive",
+               deadline: Optional[float] = None) -> Iterator[Ticket]:
+        """Tag LLM generation inside the block with the request's priority and deadline (see Ticket)."""
+        ticket = Ticket(user, role, self.priority_for(role, kind), deadline)
+        token = _ticket.set(ticket)
+        try:
+            yield ticket
+        finally:
+            try:
+                _ticket.reset(token)
+            except ValueError:
+                # Closed from another context (e.g. a streaming generator finalised elsewhere)
+                _ticket.set(None)
+
+    def _bind_loop(self):
+        """Bind the slots to the running loop; they may only move to another one while idle."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        busy = self._in_use or any(not fut.done() for _, _, fut in self._waiters)
+        if busy and self._loop is not None and not self._loop.is_closed():
+            raise RuntimeError("Generation slots are in use on another event loop")
+        # Idle, or the old loop is closed and can never release what it held
+        self._loop, self._in_use, self._waiters = loop, 0, []
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        Hold one of `slots` generation slots. Waiters are served by priority, then arrival;
+        a request still waiting at its deadline (or arriving past it) is dropped. Batch
+        waiters may hold at most batch_queue_size places of the queue.
+        """
+        self._bind_loop()
+        ticket = _ticket.get()
+        priority = ticket.priority if ticket else "interactive"
+        t0 = time.monotonic()
+        deadline = ticket.deadline if ticket and ticket.deadline is not None else t0 + self.max_wait
+        if t0 >= deadline:
+            self.counters["deadline_exceeded"] += 1
+            raise DeadlineExceeded("Request deadline passed before generation started")
+        if self._in_use < self.slots and not self._waiters:
+            self._in_use += 1
+        else:
+            if len(self._waiters) >= self.queue_size:
+                self.counters["queue_full"] += 1
+                raise QueueFull("Too many requests waiting for the LLM", retry_after=1.0)
+            if priority == "batch" and self._queued(priority) >= self.batch_queue_size:
+                self.counters["queue_full"] += 1
+                raise QueueFull("Too many batch questions waiting for the LLM", retry_after=1.0)
+            fut = self._loop.create_future()
+            entry = (PRIORITIES.index(priority), next(self._seq), fut)
+            heapq.heappush(self._waiters, entry)
+            try:
+                await asyncio.wait_for(asyncio.shield(fut), timeout=deadline - t0)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if fut.done() and not fut.cancelled():
+                    self._release()  # granted in the same instant: pass the slot on
+                else:
+                    fut.cancel()
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self.counters["deadline_exceeded"] += 1
+                raise DeadlineExceeded("Request deadline passed while waiting for the LLM") from None
+        wait_seconds.observe(time.monotonic() - t0, priority)
+        self.counters["admitted"] += 1
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        # Hand the slot straight to the best waiter, so a new arrival cannot jump the queue
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._in_use -= 1
+
+    def _queued(self, priority: str) -> int:
+        rank = PRIORITIES.index(priority)
+        return sum(1 for r, _, fut in self._waiters if r == rank and not fut.done())
+
+    def stats(self) -> Dict:
+        by_priority = {p: self._queued(p) for p in PRIORITIES}
+        return {"slots": self.slots, "in_use": self._in_use, "queue_depth": sum(by_priority.values()),
+                "queue_size": self.queue_size, "batch_queue_size": self.batch_queue_size,
+                "queued_by_priority": by_priority, **self.counters}
+
+
+admission = AdmissionController()
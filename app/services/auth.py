@@ -0,0 +1,123 @@
+# app/services/auth.py
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from functools import lru_cache
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from app.services.cache import TTLCache
+
+load_dotenv()
+
+logger = logging.getLogger("finbot.auth")
+
+# Signing key for session tokens. Set it explicitly when running several workers or when
+# tokens must survive a restart; otherwise a random per-process key is used.
+AUTH_SECRET = os.getenv("AUTH_SECRET") or ""
+if not AUTH_SECRET:
+    logger.warning("AUTH_SECRET not set; using a random key, tokens are valid for this process only")
+    AUTH_SECRET = secrets.token_urlsafe(32)
+AUTH_TOKEN_TTL = int(os.getenv("AUTH_TOKEN_TTL", "3600"))
+# Iterations for newly created password hashes; stored hashes carry their own count
+AUTH_PBKDF2_ITERATIONS = int(os.getenv("AUTH_PBKDF2_ITERATIONS", "200000"))
+
+# Successful Basic-auth verifications, so repeated Basic requests skip the KDF
+basic_auth_cache = TTLCache(
+    "basic_auth",
+    maxsize=int(os.getenv("AUTH_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("AUTH_CACHE_TTL", "60")),
+)
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+# -------------------------
+# Password hashing
+# -------------------------
+def hash_password(password: str, iterations: int = AUTH_PBKDF2_ITERATIONS, salt: Optional[bytes] = None) -> str:
+    """PBKDF2-HMAC-SHA256, encoded as pbkdf2_sha256$<iterations>$<salt>$<hash>."""
+    salt = salt or secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"pbkdf2_sha256${iterations}${_b64encode(salt)}${_b64encode(digest)}"
+
+
+def verify_password(password: str, stored: str) -> bool:
+    try:
+        scheme, iterations, salt, expected = stored.split("$")
+    except ValueError:
+        return False
+    if scheme != "pbkdf2_sha256":
+        return False
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), _b64decode(salt), int(iterations))
+    return hmac.compare_digest(digest, _b64decode(expected))
+
+
+@lru_cache(maxsize=1)
+def _dummy_hash() -> str:
+    return hash_password(secrets.token_urlsafe(16))
+
+
+def verify_basic(username: str, password: str, users: Dict[str, Dict[str, str]]) -> Optional[Dict[str, str]]:
+    """
+    Check a username/password against `users` ({name: {"password_hash", "role"}}).
+    Only successes are cached, keyed by an HMAC of the credentials, never the password itself;
+    failed attempts always pay the full KDF.
+    """
+    key = hmac.new(AUTH_SECRET.encode(), f"{username}\0{password}".encode(), hashlib.sha256).digest()
+    role = basic_auth_cache.get(key)
+    if role is None:
+        user = users.get(username)
+        # Unknown users still pay one KDF so response time does not reveal which names exist
+        if not verify_password(password, user["password_hash"] if user else _dummy_hash()) or not user:
+            return None
+        role = user["role"]
+        basic_auth_cache.set(key, role)
+    return {"username": username, "role": role}
+
+
+# -------------------------
+# Session tokens
+# -------------------------
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(AUTH_SECRET.encode(), payload.encode(), hashlib.sha256).digest())
+
+
+def issue_token(username: str, role: str, ttl: int = AUTH_TOKEN_TTL) -> Dict:
+    """Stateless token: base64url(JSON {sub, role, exp}) + "." + base64url(HMAC-SHA256)."""
+    expires = int(time.time()) + ttl
+    payload = _b64encode(json.dumps({"sub": username, "role": role, "exp": expires},
+                                    separators=(",", ":")).encode())
+    return {"access_token": f"{payload}.{_sign(payload)}", "token_type": "bearer",
+            "expires_in": ttl, "expires_at": expires}
+
+
+def verify_token(token: str) -> Dict[str, str]:
+    """Returns {"username", "role"}; raises InvalidToken if malformed, tampered with or expired."""
+    payload, _, signature = token.partition(".")
+    if not payload or not signature or not hmac.compare_digest(signature.encode(), _sign(payload).encode()):
+        raise InvalidToken("Invalid token signature")
+    try:
+        claims = json.loads(_b64decode(payload))
+        username, role, expires = claims["sub"], claims["role"], claims["exp"]
+    except (ValueError, TypeError, KeyError):
+        raise InvalidToken("Malformed token")
+    if expires < time.time():
+        raise InvalidToken("Token expired")
+    return {"username": username, "role": role}
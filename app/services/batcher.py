@@ -0,0 +1,143 @@
+# app/services/batcher.py
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("finbot.batcher")
+
+# Collect concurrent queries for up to this long before encoding them together (0 disables)
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", "0"))
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+
+
+class _Pending:
+    __slots__ = ("text", "n_results", "where", "future", "enqueued_at")
+
+    def __init__(self, text: str, n_results: int, where: Optional[Dict]):
+        self.text = text
+        self.n_results = n_results
+        self.where = where
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class QueryBatcher:
+    """
+    Coalesces VectorStore queries that arrive within `window_ms` of each other (up to
+    `max_batch`) into one batched encode and one multi-embedding collection query per
+    distinct (n_results, where), then hands each caller its own result list.
+    `store` must provide embed_queries(texts) and query_embeddings(embs, n_results, where).
+    """
+
+    def __init__(self, store, window_ms: float = QUERY_BATCH_WINDOW_MS, max_batch: int = QUERY_BATCH_MAX_SIZE):
+        self.store = store
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Optional[_Pending]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._closed = False
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+        self.batch_sizes: Dict[int, int] = defaultdict(int)
+        self.queue_delay_total = 0.0
+        self.queue_delay_max = 0.0
+
+    def submit(self, text: str, n_results: int = 5, where: Optional[Dict] = None) -> List[Dict]:
+        """Blocks the calling thread until the batch containing this query has been served."""
+        pending = _Pending(text, n_results, where)
+        with self._start_lock:
+            closed = self._closed
+            if not closed:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="finbot-query-batcher", daemon=True)
+                    self._worker.start()
+                self._queue.put(pending)
+        if closed:
+            # The store was swapped out; requests still holding it are served inline
+            return self.store.query_embeddings(self.store.embed_queries([text]), n_results, where)[0]
+        return pending.future.result()
+
+    def close(self):
+        """Stop the worker thread once it has served every query already submitted."""
+        with self._start_lock:
+            if not self._closed:
+                self._closed = True
+                if self._worker is not None:
+                    self._queue.put(None)
+
+    def _collect(self) -> Tuple[List[_Pending], bool]:
+        """(batch, closed): closed once the sentinel from close() has been taken."""
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = first.enqueued_at + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                pending = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if pending is None:
+                return batch, True
+            batch.append(pending)
+        return batch, False
+
+    def _run(self):
+        closed = False
+        while not closed:
+            batch, closed = self._collect()
+            if not batch:
+                break
+            started = time.perf_counter()
+            self._record(batch, started)
+            try:
+                embs = self.store.embed_queries([p.text for p in batch])
+            except Exception as e:
+                for p in batch:
+                    p.future.set_exception(e)
+                continue
+            groups: Dict[tuple, List[int]] = defaultdict(list)
+            for i, p in enumerate(batch):
+                groups[(p.n_results, json.dumps(p.where, sort_keys=True))].append(i)
+            for idxs in groups.values():
+                first = batch[idxs[0]]
+                try:
+                    results = self.store.query_embeddings(embs[idxs], first.n_results, first.where)
+                    for i, res in zip(idxs, results):
+                        batch[i].future.set_result(res)
+                except Exception as e:
+                    logger.exception("Batched query failed")
+                    for i in idxs:
+                        batch[i].future.set_exception(e)
+
+    def _record(self, batch: List[_Pending], started: float):
+        with self._stats_lock:
+            self.batches += 1
+            self.queries += len(batch)
+            self.batch_sizes[len(batch)] += 1
+            for p in batch:
+                delay = started - p.enqueued_at
+                self.queue_delay_total += delay
+                self.queue_delay_max = max(self.queue_delay_max, delay)
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                "window_ms": self.window * 1000,
+                "max_batch": self.max_batch,
+                "batches": self.batches,
+                "queries": self.queries,
+                "mean_batch_size": round(self.queries / self.batches, 3) if self.batches else 0.0,
+                "batch_size_counts": dict(sorted(self.batch_sizes.items())),
+                "mean_queue_delay_ms": round(self.queue_delay_total / self.queries * 1000, 3) if self.queries else 0.0,
+                "max_queue_delay_ms": round(self.queue_delay_max * 1000, 3),
+            }
@@ -0,0 +1,247 @@
+# app/services/cache.py
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+def normalize_query(text: str) -> str:
+    """Cache key for free text: case-folded with whitespace collapsed."""
+    return " ".join(text.lower().split())
+
+
+class IndexGeneration:
+    """
+    Monotonic counter bumped whenever the index changes (see run_incremental_ingest).
+    Cache entries remember the generation they were computed under and are
+    treated as misses once it moves on.
+    """
+
+    def __init__(self):
+        self._value = 0
+        self._all_changed = 0
+        self._source_changed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def bump(self, sources: Optional[Iterable[str]] = None) -> int:
+        """
+        sources: keys ("department/source") whose content changed, so caches that track
+        what an entry was built from can invalidate selectively. None means anything may have.
+        """
+        with self._lock:
+            self._value += 1
+            if sources is None:
+                self._all_changed = self._value
+            else:
+                for key in sources:
+                    self._source_changed[key] = self._value
+            return self._value
+
+    def changed_since(self, generation: int, sources: Iterable[str]) -> bool:
+        """True if any of `sources` (or everything) changed after `generation`."""
+        if self._all_changed > generation:
+            return True
+        return any(self._source_changed.get(key, 0) > generation for key in sources)
+
+
+index_generation = IndexGeneration()
+
+_registry: List[Any] = []
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with per-entry TTL and optional generation invalidation.
+    maxsize <= 0 disables the cache (every get is a miss, set is a no-op).
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 300.0,
+                 generation: Optional[IndexGeneration] = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = generation
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _gen(self) -> int:
+        return self.generation.value if self.generation is not None else 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                gen, expires, value = entry
+                if gen == self._gen() and expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (self._gen(), time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[2] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class SemanticCache:
+    """
+    Nearest-neighbour cache keyed by (partition, embedding): a lookup hits when an entry in
+    the same partition has cosine similarity >= threshold. Partitions never share entries.
+    Entries expire after ttl, are evicted LRU beyond maxsize, and are dropped once the
+    generation reports a change to any source they were built from.
+    maxsize <= 0 disables the cache.
+    """
+
+    def __init__(self, name: str, maxsize: int = 512, ttl: float = 900.0, threshold: float = 0.92,
+                 generation: Optional[IndexGeneration] = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.generation = generation
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # entry id -> (partition, unit vector, expires, generation, sources, value), in LRU order
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        # partition -> (entry ids, stacked vectors); rebuilt lazily after writes
+        self._index: Dict[Hashable, Tuple[List[int], np.ndarray]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def _partition_index(self, partition: Hashable) -> Tuple[List[int], np.ndarray]:
+        index = self._index.get(partition)
+        if index is None:
+            ids = [i for i, e in self._entries.items() if e[0] == partition]
+            vectors = np.stack([self._entries[i][1] for i in ids]) if ids else np.empty((0, 0), dtype=np.float32)
+            index = self._index[partition] = (ids, vectors)
+        return index
+
+    def _drop(self, entry_id: int):
+        partition = self._entries.pop(entry_id)[0]
+        self._index.pop(partition, None)
+
+    def get(self, partition: Hashable, embedding: np.ndarray) -> Optional[Tuple[Any, float]]:
+        """Returns (value, similarity) of the closest live entry above threshold, else None."""
+        if not self.enabled:
+            return None
+        q = np.asarray(embedding, dtype=np.float32)
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        with self._lock:
+            now = time.monotonic()
+            while True:
+                ids, vectors = self._partition_index(partition)
+                if not ids:
+                    break
+                scores = vectors @ q
+                best = int(np.argmax(scores))
+                if scores[best] < self.threshold:
+                    break
+                entry_id = ids[best]
+                _, _, expires, gen, sources, value = self._entries[entry_id]
+                stale = self.generation is not None and self.generation.changed_since(gen, sources)
+                if expires > now and not stale:
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return value, float(scores[best])
+                # Expired or built from a changed source: drop it and look again
+                self.invalidations += int(stale)
+                self._drop(entry_id)
+            self.misses += 1
+            return None
+
+    def set(self, partition: Hashable, embedding: np.ndarray, value: Any, sources: Iterable[str] = (),
+            generation: Optional[int] = None):
+        """
+        generation: index generation the value was computed under (read it before retrieval,
+        so an ingest racing with generation still invalidates the entry).
+        """
+        if not self.enabled:
+            return
+        v = np.asarray(embedding, dtype=np.float32)
+        v = v / max(float(np.linalg.norm(v)), 1e-12)
+        if generation is None:
+            generation = self.generation.value if self.generation is not None else 0
+        with self._lock:
+            self._entries[self._next_id] = (partition, v, time.monotonic() + self.ttl, generation,
+                                            frozenset(sources), value)
+            self._next_id += 1
+            self._index.pop(partition, None)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Counters for every cache created in this process, keyed by cache name."""
+    return {c.name: c.stats() for c in _registry}
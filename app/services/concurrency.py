@@ -0,0 +1,33 @@
+# app/services/concurrency.py
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from dotenv import load_dotenv
+
+from app.services.metrics import profiler
+
+load_dotenv()
+
+# Threads for CPU-bound stages (query embedding, vector search). Kept separate from the
+# event loop and from starlette's default pool so a burst of chats cannot starve either.
+RAG_CPU_WORKERS = int(os.getenv("RAG_CPU_WORKERS", str(min(8, os.cpu_count() or 2))))
+# Max outbound LLM calls in flight per process (slots handed out by app.services.admission)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Per-request timeout (seconds) for one LLM call, excluding time spent waiting for a slot
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+cpu_executor = ThreadPoolExecutor(max_workers=RAG_CPU_WORKERS, thread_name_prefix="finbot-cpu")
+# Ingest runs one at a time and never competes with chat for cpu_executor threads
+ingest_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="finbot-ingest")
+
+
+async def run_cpu(fn: Callable, *args, **kwargs) -> Any:
+    loop = asyncio.get_running_loop()
+    # Carry the request context (metric labels, trace, profiling flag) into the worker thread
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(cpu_executor, ctx.run, functools.partial(profiler.call, fn, *args, **kwargs))
+
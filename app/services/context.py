@@ -0,0 +1,293 @@
+# app/services/context.py
+import logging
+import math
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.llm import HF_MODEL, HF_TOKEN
+from app.services.metrics import stage
+from app.utils.dedup import source_refs
+
+logger = logging.getLogger("finbot.context")
+
+# Budget for the CONTEXT block of the prompt in generation-model tokens (0 = legacy verbatim join)
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1500"))
+# Maximal marginal relevance trade-off: 1.0 = pure relevance, 0.0 = pure diversity
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+# A chunk at least this cosine-similar to one already selected is dropped as a near-duplicate
+CONTEXT_DUP_THRESHOLD = float(os.getenv("CONTEXT_DUP_THRESHOLD", "0.95"))
+# Tokenizer used to measure the budget; defaults to the generation model
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", HF_MODEL)
+# Seconds between background retries of a tokenizer that failed to load (~4 chars/token meanwhile)
+CONTEXT_TOKENIZER_RETRY = float(os.getenv("CONTEXT_TOKENIZER_RETRY", "300"))
+
+SEPARATOR = "\n---\n"
+# Longest suffix/prefix overlap looked for when merging neighbouring chunks
+MAX_OVERLAP_CHARS = 1000
+MIN_OVERLAP_CHARS = 16
+
+TokenCounter = Callable[[List[str]], List[int]]
+
+
+def approx_token_count(texts: List[str]) -> List[int]:
+    # ~4 characters per token for English prose with Llama/Mistral-style BPE vocabularies
+    return [math.ceil(len(t) / 4) for t in texts]
+
+
+# model name -> loaded counter; model name -> monotonic time of the last failed load
+_counters: Dict[str, TokenCounter] = {}
+_failed_at: Dict[str, float] = {}
+_loading = set()
+_counters_lock = threading.Lock()
+
+
+def load_generation_token_counter(model_name: str = CONTEXT_TOKENIZER) -> TokenCounter:
+    """
+    Load the generation model's tokenizer now (warm_up calls this). Gated or unreachable
+    tokenizers fall back to approx_token_count, and get_generation_token_counter retries later.
+    """
+    counter = _counters.get(model_name)
+    if counter is not None:
+        return counter
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(model_name, token=HF_TOKEN)
+    except Exception as e:
+        _failed_at[model_name] = time.monotonic()
+        logger.warning("Tokenizer for %s unavailable (%s); context budgets use the ~4 chars/token estimate "
+                       "until it loads (retrying every %gs)", model_name, e, CONTEXT_TOKENIZER_RETRY)
+        return approx_token_count
+
+    def count(texts: List[str]) -> List[int]:
+        if not texts:
+            return []
+        enc = tokenizer(list(texts), add_special_tokens=False, truncation=False,
+                        return_attention_mask=False, return_token_type_ids=False)
+        return [len(ids) for ids in enc["input_ids"]]
+
+    _counters[model_name] = count
+    _failed_at.pop(model_name, None)
+    logger.info("Context budgets use the %s tokenizer", model_name)
+    return count
+
+
+def _load_in_background(model_name: str):
+    try:
+        load_generation_token_counter(model_name)
+    finally:
+        with _counters_lock:
+            _loading.discard(model_name)
+
+
+def get_generation_token_counter(model_name: str = CONTEXT_TOKENIZER) -> TokenCounter:
+    """
+    Batch token counter for the generation model. Requests never wait for a download: until
+    the tokenizer has loaded they get approx_token_count while a background thread loads it
+    (again at most every CONTEXT_TOKENIZER_RETRY seconds after a failure).
+    """
+    counter = _counters.get(model_name)
+    if counter is not None:
+        return counter
+    with _counters_lock:
+        failed = _failed_at.get(model_name)
+        if model_name not in _loading and (failed is None or time.monotonic() - failed >= CONTEXT_TOKENIZER_RETRY):
+            _loading.add(model_name)
+            threading.Thread(target=_load_in_background, args=(model_name,), name="finbot-tokenizer",
+                             daemon=True).start()
+    return approx_token_count
+
+
+def format_piece(dept: str, src: str, label: str, text: str) -> str:
+    return f"[{dept} | {src} | chunk-{label}]\n{text}\n"
+
+
+def legacy_context(results: List[Dict]) -> str:
+    """The original verbatim join of every retrieved chunk; kept as the baseline for tokens saved."""
+    pieces = []
+    for r in results:
+        meta = r.get("metadata", {})
+        pieces.append(format_piece(meta.get("department", "unknown"), meta.get("source", "unknown"),
+                                   str(meta.get("chunk_id", "0")), r.get("document", "")))
+    return SEPARATOR.join(pieces)
+
+
+def _relevance(results: List[Dict]) -> np.ndarray:
+    """Relevance in [0, 1] from distances, scaled per request so it works for any distance metric."""
+    distances = [r.get("distance") for r in results]
+    if any(d is None for d in distances):
+        return 1.0 - np.arange(len(results)) / max(len(results), 1)
+    d = np.asarray(distances, dtype=np.float32)
+    span = float(d.max() - d.min())
+    return np.ones(len(d), dtype=np.float32) if span <= 1e-9 else 1.0 - (d - d.min()) / span
+
+
+def _similarities(results: List[Dict]) -> Optional[np.ndarray]:
+    embs = [r.get("embedding") for r in results]
+    if not embs or any(e is None for e in embs):
+        return None
+    m = np.asarray(np.stack(embs), dtype=np.float32)
+    m = m / np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+    return m @ m.T
+
+
+def mmr_order(results: List[Dict], lam: float = CONTEXT_MMR_LAMBDA,
+              dup_threshold: float = CONTEXT_DUP_THRESHOLD) -> Tuple[List[int], int]:
+    """
+    Greedy maximal-marginal-relevance ordering of result indices. Exact-duplicate texts and
+    chunks above dup_threshold similarity to an earlier pick are dropped.
+    Without result embeddings only exact duplicates are removed and rank order is kept.
+    Returns (ordered indices, number dropped).
+    """
+    seen, candidates = set(), []
+    for i, r in enumerate(results):
+        key = re.sub(r"\s+", " ", r.get("document", "")).strip()
+        if key and key not in seen:
+            seen.add(key)
+            candidates.append(i)
+    rel = _relevance(results)
+    sims = _similarities(results)
+    if sims is None:
+        return candidates, len(results) - len(candidates)
+
+    order: List[int] = []
+    remaining = list(candidates)
+    while remaining:
+        if order:
+            redundancy = sims[np.ix_(remaining, order)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining), dtype=np.float32)
+        keep = redundancy < dup_threshold
+        remaining = [i for i, k in zip(remaining, keep) if k]
+        if not remaining:
+            break
+        scores = lam * rel[remaining] - (1 - lam) * redundancy[keep]
+        order.append(remaining.pop(int(np.argmax(scores))))
+    return order, len(results) - len(order)
+
+
+def _trim_overlap(prev: str, nxt: str) -> str:
+    """Drop the longest prefix of nxt that repeats the end of prev (chunk overlap)."""
+    limit = min(len(prev), len(nxt), MAX_OVERLAP_CHARS)
+    for k in range(limit, MIN_OVERLAP_CHARS - 1, -1):
+        if prev.endswith(nxt[:k]):
+            return nxt[k:].lstrip()
+    return nxt
+
+
+def _chunk_number(meta: Dict) -> Optional[int]:
+    try:
+        return int(str(meta.get("chunk_id")).rsplit("-", 1)[-1])
+    except (TypeError, ValueError):
+        return None
+
+
+def _merge_adjacent(results: List[Dict], picked: List[int]) -> List[Dict]:
+    """
+    Merge picked chunks that are consecutive in the same source into one piece, removing
+    overlapping spans. Pieces keep the rank of their best member.
+    """
+    groups: Dict[Tuple[str, str], List[Tuple[int, int]]] = {}
+    for rank, i in enumerate(picked):
+        meta = results[i].get("metadata", {})
+        groups.setdefault((meta.get("department", "unknown"), meta.get("source", "unknown")), []).append((rank, i))
+
+    pieces = []
+    for (dept, src), members in groups.items():
+        members.sort(key=lambda m: (_chunk_number(results[m[1]].get("metadata", {})) is None,
+                                    _chunk_number(results[m[1]].get("metadata", {})) or 0))
+        run: List[Tuple[int, int]] = []
+
+        def close_run():
+            if not run:
+                return
+            ids = [str(results[i].get("metadata", {}).get("chunk_id", "0")) for _, i in run]
+            text = results[run[0][1]].get("document", "")
+            for _, i in run[1:]:
+                text = text.rstrip() + "\n" + _trim_overlap(text, results[i].get("document", ""))
+            label = ids[0] if len(ids) == 1 else f"{ids[0]}..{ids[-1]}"
+            # Chunks collapsed at ingest stand for the same text in other files too
+            refs = [ref for _, i in run for ref in source_refs(results[i].get("metadata", {}))]
+            others = [s for s in dict.fromkeys(ref.rsplit("#", 1)[0] for ref in refs) if s != src]
+            shown = f"{src} (also in {', '.join(others)})" if others else src
+            pieces.append({"rank": min(r for r, _ in run), "dept": dept, "src": src, "ids": ids, "refs": refs,
+                           "text": format_piece(dept, shown, label, text)})
+
+        prev_n = None
+        for rank, i in members:
+            n = _chunk_number(results[i].get("metadata", {}))
+            if run and (n is None or prev_n is None or n != prev_n + 1):
+                close_run()
+                run = []
+            run.append((rank, i))
+            prev_n = n
+        close_run()
+    pieces.sort(key=lambda p: p["rank"])
+    return pieces
+
+
+def assemble_context(results: List[Dict], max_tokens: int = CONTEXT_MAX_TOKENS,
+                     count: Optional[TokenCounter] = None) -> Tuple[str, List[str], Dict]:
+    """
+    Build the prompt context from retrieved chunks:
+      1. drop exact and near-duplicate chunks and order the rest by MMR,
+      2. greedily keep chunks in that order while they fit max_tokens,
+      3. merge kept chunks that are adjacent in the same source, removing overlap.
+    Returns (context_text, sources, report) where report includes tokens_saved against
+    the legacy verbatim join of all results.
+    """
+    with stage("context"):
+        return _assemble(results, max_tokens, count or get_generation_token_counter())
+
+
+def _assemble(results: List[Dict], max_tokens: int, count: TokenCounter) -> Tuple[str, List[str], Dict]:
+    baseline = legacy_context(results)
+    if max_tokens <= 0 or not results:
+        sources = [ref for r in results for ref in source_refs(r.get("metadata", {}))]
+        n = count([baseline])[0] if results else 0
+        return baseline, list(dict.fromkeys(sources)), {
+            "candidates": len(results), "selected": len(results), "dropped": 0, "pieces": len(results),
+            "context_tokens": n, "baseline_tokens": n, "tokens_saved": 0, "budget": max_tokens}
+
+    order, dropped = mmr_order(results)
+    formatted = [legacy_context([results[i]]) for i in order]
+    sizes = count(formatted + [SEPARATOR, baseline])
+    sep_tokens, baseline_tokens = sizes[-2], sizes[-1]
+
+    picked, used = [], 0
+    if order and sizes[0] > max_tokens:
+        # Even the best chunk is over budget: keep a proportional prefix of it and nothing else
+        top = dict(results[order[0]])
+        keep = max(1, int(len(top.get("document", "")) * max_tokens / sizes[0]))
+        top["document"] = top.get("document", "")[:keep]
+        results = list(results)
+        results[order[0]] = top
+        picked = [order[0]]
+    else:
+        for i, n in zip(order, sizes):
+            cost = n + (sep_tokens if picked else 0)
+            if used + cost <= max_tokens:
+                picked.append(i)
+                used += cost
+
+    pieces = _merge_adjacent(results, picked)
+    context = SEPARATOR.join(p["text"] for p in pieces)
+    sources = [ref for p in pieces for ref in p["refs"]]
+    context_tokens = count([context])[0]
+    report = {
+        "candidates": len(results),
+        "selected": len(picked),
+        "dropped": dropped + (len(order) - len(picked)),
+        "pieces": len(pieces),
+        "context_tokens": context_tokens,
+        "baseline_tokens": baseline_tokens,
+        "tokens_saved": baseline_tokens - context_tokens,
+        "budget": max_tokens,
+    }
+    logger.info("Context: %d chunks -> %d pieces, %d tokens (saved %d of %d)", len(results), len(pieces),
+                context_tokens, report["tokens_saved"], baseline_tokens)
+    return context, list(dict.fromkeys(sources)), report
@@ -1,25 +1,202 @@
-from sentence_transformers import SentenceTransformer
+# app/services/embedding.py
+import atexit
+import json
+import logging
+import os
+import threading
+from functools import lru_cache
+from typing import Callable, List, Optional, Sequence
+
 import numpy as np
-import chromadb
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("finbot.embedding")
+
+EMBED_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_DEVICE = os.getenv("EMBED_DEVICE") or None
+# Worker processes for the sentence-transformers multi-process pool (0 = encode in-process)
+EMBED_POOL_WORKERS = int(os.getenv("EMBED_POOL_WORKERS", "0"))
+# Below this many texts the IPC overhead of the pool outweighs the parallelism
+EMBED_POOL_MIN_TEXTS = int(os.getenv("EMBED_POOL_MIN_TEXTS", "256"))
+EMBED_NORMALIZE = os.getenv("EMBED_NORMALIZE", "false").lower() in ("1", "true", "yes")
+# Encoder input window in tokens including [CLS]/[SEP]; longer inputs are silently truncated
+EMBED_MAX_SEQ_LENGTH = int(os.getenv("EMBED_MAX_SEQ_LENGTH", "256"))
+# sentence-transformers (PyTorch) | onnx (ONNX Runtime over an export made by scripts.export_onnx)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers").lower()
+EMBED_ONNX_DIR = os.getenv("EMBED_ONNX_DIR") or os.path.join("onnx_models", EMBED_MODEL.replace("/", "__"))
+# Use the dynamically int8-quantized graph (model.int8.onnx) instead of model.onnx
+EMBED_ONNX_QUANTIZED = os.getenv("EMBED_ONNX_QUANTIZED", "false").lower() in ("1", "true", "yes")
+# ONNX Runtime intra-op threads (0 = one per physical core)
+EMBED_ONNX_THREADS = int(os.getenv("EMBED_ONNX_THREADS", "0"))
+ONNX_EXPORT_CONFIG = "finbot_onnx.json"
+
+
+class EmbeddingEngine:
+    """
+    Batched sentence-transformers encoder shared by ingest and query paths.
+    Always returns C-contiguous float32 arrays of shape (n, dim).
+    """
+
+    def __init__(self, model_name: str = EMBED_MODEL, batch_size: int = EMBED_BATCH_SIZE,
+                 device: Optional[str] = EMBED_DEVICE, pool_workers: int = EMBED_POOL_WORKERS,
+                 normalize: bool = EMBED_NORMALIZE):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.pool_workers = pool_workers
+        self.normalize = normalize
+        # Imported here so that importing the app does not pull in torch
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device=device)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = self.model.start_multi_process_pool(target_devices=["cpu"] * self.pool_workers)
+                atexit.register(self.close)
+            return self._pool
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+        if self.pool_workers > 1 and len(texts) >= EMBED_POOL_MIN_TEXTS:
+            vectors = self.model.encode_multi_process(texts, self._get_pool(), batch_size=self.batch_size)
+            if self.normalize:
+                vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        else:
+            vectors = self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                        show_progress_bar=False, normalize_embeddings=self.normalize)
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.encode([text])[0]
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self.model.stop_multi_process_pool(self._pool)
+                self._pool = None
+
+
+class OnnxEmbeddingEngine:
+    """
+    EmbeddingEngine drop-in that runs an exported transformer under ONNX Runtime, with the
+    pooling and normalisation of the original sentence-transformers pipeline re-done in numpy.
+    Needs only onnxruntime and tokenizers at runtime (no torch, no transformers).
+    """
+
+    def __init__(self, export_dir: str = EMBED_ONNX_DIR, quantized: bool = EMBED_ONNX_QUANTIZED,
+                 batch_size: int = EMBED_BATCH_SIZE, normalize: bool = EMBED_NORMALIZE,
+                 max_seq_length: int = EMBED_MAX_SEQ_LENGTH, threads: int = EMBED_ONNX_THREADS):
+        config_path = os.path.join(export_dir, ONNX_EXPORT_CONFIG)
+        if not os.path.exists(config_path):
+            raise RuntimeError(f"No ONNX export in {export_dir}; run `python -m scripts.export_onnx` first")
+        with open(config_path, "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        graph = "model.int8.onnx" if quantized else "model.onnx"
+        if not os.path.exists(os.path.join(export_dir, graph)):
+            raise RuntimeError(f"{graph} missing in {export_dir}; re-run the export"
+                               + (" with --quantize" if quantized else ""))
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_name = self.config["model"]
+        self.batch_size = batch_size
+        self.dim = int(self.config["dim"])
+        self.pooling = self.config["pooling"]
+        # The model's own Normalize layer is part of the pipeline being reproduced
+        self.normalize = normalize or self.config["normalize"]
+        self.pool_workers = 0
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(os.path.join(export_dir, graph), options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(export_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(min(max_seq_length, int(self.config["max_seq_length"])))
+        self.tokenizer.enable_padding(pad_id=int(self.config["pad_token_id"]), pad_token=self.config["pad_token"])
+        logger.info("ONNX embedding backend: %s (%s)", self.model_name, graph)
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        hidden = self.session.run(None, feeds)[0]  # (batch, seq, dim)
+        if self.pooling == "cls":
+            return hidden[:, 0]
+        weights = mask[:, :, None].astype(np.float32)
+        if self.pooling == "max":
+            return np.where(weights > 0, hidden, -1e9).max(axis=1)
+        return (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+        # Longest first, as sentence-transformers does, so each batch pads to similar lengths
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), self.batch_size):
+            idx = order[start:start + self.batch_size]
+            vectors[idx] = self._encode_batch([texts[i] for i in idx])
+        if self.normalize:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.encode([text])[0]
+
+    def close(self):
+        pass
+
+
+_engine: Optional[EmbeddingEngine] = None
+_engine_lock = threading.Lock()
+
+
+def create_embedding_engine(backend: str = EMBEDDING_BACKEND):
+    if backend == "onnx":
+        return OnnxEmbeddingEngine()
+    if backend in ("sentence-transformers", "torch"):
+        return EmbeddingEngine()
+    raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r} (expected sentence-transformers or onnx)")
 
-def init_vector_store(documents):
-    client = chromadb.Client()
-    collection = client.get_or_create_collection("company_docs")
 
-    model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+def get_embedding_engine() -> EmbeddingEngine:
+    """Process-wide embedding engine for EMBEDDING_BACKEND, created on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_embedding_engine()
+    return _engine
 
-    for dept, docs in documents.items():
-        for doc in docs:
-            content = doc["content"]
-            source = doc["source"]
 
-            embedding = model.encode(content).tolist()
+@lru_cache(maxsize=4)
+def get_token_counter(model_name: str = EMBED_MODEL) -> Callable[[List[str]], List[int]]:
+    """
+    Batch token counter using the embedding model's own tokenizer (no special tokens).
+    Loads only the tokenizer, not the model weights.
+    """
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
 
-            collection.add(
-                documents=[content],
-                ids=[f"{dept}_{source}"],
-                metadatas=[{"department": dept, "source": source}]
-            )
+    def count(texts: List[str]) -> List[int]:
+        if not texts:
+            return []
+        enc = tokenizer(list(texts), add_special_tokens=False, truncation=False,
+                        return_attention_mask=False, return_token_type_ids=False)
+        return [len(ids) for ids in enc["input_ids"]]
 
-    print("Vector store initialized.")
-    return collection
+    return count
@@ -0,0 +1,239 @@
+# app/services/ingest.py
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from app.utils.loader import iter_documents, read_document
+from app.services.cache import index_generation
+from app.services.manifest import IngestManifest, chunk_hash, content_hash, file_hash
+from app.services.vectorstore import BaseVectorStore
+from app.services.registry import get_vector_store
+from app.services.metrics import stage
+from app.services.pipeline import Stage, peak_rss_mb, run_pipeline
+from scripts.ingest import build_docs_for_vectorstore, iter_docs_for_vectorstore, CHUNKER_VERSION, CHUNK_DEDUP_THRESHOLD
+
+logger = logging.getLogger("finbot.ingest")
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+# Items buffered between pipeline stages; bounds memory and applies backpressure
+INGEST_QUEUE_DEPTH = int(os.getenv("INGEST_QUEUE_DEPTH", "4"))
+
+
+def file_key(doc: Dict) -> str:
+    return f"{doc['department']}/{doc['source']}"
+
+
+def document_hash(doc: Dict) -> str:
+    # Hash the bytes on disk when we have them (CSV content is never loaded whole)
+    return file_hash(doc["path"]) if doc.get("path") else content_hash(doc["content"])
+
+
+def run_incremental_ingest(vs: Optional[BaseVectorStore] = None, documents: Optional[Iterable[Dict]] = None,
+                           manifest_path: Optional[str] = None, full: bool = False,
+                           batch_size: int = INGEST_BATCH_SIZE, queue_depth: int = INGEST_QUEUE_DEPTH,
+                           cancel: Optional[threading.Event] = None, progress: Optional[Dict] = None,
+                           invalidate: bool = True, dedup_threshold: float = CHUNK_DEDUP_THRESHOLD) -> Dict:
+    """
+    Bring the index in line with `documents` (default: everything under resources/data).
+    Only new or changed chunks are embedded and upserted; ids belonging to removed files
+    or to the tail of a shrunken document are deleted. The manifest is saved only after
+    all writes succeed, so an interrupted run is simply redone next time.
+
+    Runs as a pipeline of threaded stages joined by bounded queues
+    (discover -> read -> chunk -> embed -> write), so file I/O, tokenization, encoding
+    and index writes overlap. Returns a report of what was embedded, skipped and
+    deleted, per-stage throughput and peak RSS.
+
+    Background jobs pass `cancel` (raises PipelineCancelled once set; nothing is saved),
+    `progress` (a dict updated in place with the running counters) and invalidate=False,
+    in which case caches are left alone and report["changed_sources"] lists the sources
+    to invalidate once the caller makes the new index visible.
+
+    With dedup_threshold > 0, near-duplicate markdown chunks of a department are stored once
+    (see build_docs_for_vectorstore). A department's markdown files are then read and chunked
+    together, and all of them are re-chunked when any one changes or is removed, so every
+    collapsed chunk keeps an up-to-date list of the files it stands for. Only one department
+    is held at a time, so `documents` should list each department's files together.
+    """
+    started = time.perf_counter()
+    vs = vs or get_vector_store()
+    if vs.read_only:
+        raise RuntimeError(f"{type(vs).__name__} is read-only; ingest into a writable backend and export a new snapshot")
+    source = iter_documents() if documents is None else documents
+    # Each store keeps its own manifest, so switching backends never skips a fresh index
+    manifest = IngestManifest.load(manifest_path or vs.manifest_path)
+    # A chunker change means every file must be re-chunked; `full` also re-embeds every chunk
+    rechunk_all = full or manifest.chunker != CHUNKER_VERSION
+
+    # Each counter is only ever written by one stage thread: files_* by read, chunks_skipped and
+    # chunks_collapsed by chunk, chunks_embedded by write (the rest after the pipeline has finished)
+    report = progress if progress is not None else {}
+    report.update({
+        "files_total": 0, "files_new": 0, "files_changed": 0, "files_unchanged": 0,
+        "files_removed": 0, "chunks_embedded": 0, "chunks_skipped": 0, "chunks_deleted": 0,
+        "chunks_collapsed": 0,
+    })
+    unchanged_chunks = 0
+    stale_ids: List[str] = []
+    changed_sources: Set[str] = set()
+    files: Dict[str, Dict] = {}
+    batch: List[Dict] = []
+    seen: Set[str] = set()
+
+    # discover: pass files through; with dedup, gather a department's markdown and emit it as one
+    # bundle as soon as the source moves on to the next department (iter_documents groups them)
+    def discover():
+        dept, bundle = None, []
+        for doc in source:
+            if bundle and doc["department"] != dept:
+                yield {"department": dept, "bundle": bundle}
+                bundle = []
+            dept = doc["department"]
+            seen.add(file_key(doc))
+            if dedup_threshold > 0 and doc.get("kind") != "csv":
+                bundle.append(doc)
+            else:
+                yield doc
+        if bundle:
+            yield {"department": dept, "bundle": bundle}
+
+    def skip_unchanged(key, prev):
+        nonlocal unchanged_chunks
+        files[key] = prev
+        unchanged_chunks += len(prev["chunks"])
+
+    def classify(prev, fhash) -> bool:
+        """Count the file as new, changed or unchanged; True if its chunks must be rebuilt."""
+        report["files_total"] += 1
+        if not prev:
+            report["files_new"] += 1
+        elif prev["file_hash"] != fhash or rechunk_all:
+            report["files_changed"] += 1
+        else:
+            report["files_unchanged"] += 1
+            return False
+        return True
+
+    # read: hash the file, drop it if unchanged, otherwise load markdown content
+    def read(doc, emit):
+        if "bundle" in doc:
+            return read_bundle(doc, emit)
+        key = file_key(doc)
+        prev = manifest.files.get(key)
+        fhash = document_hash(doc)
+        if not classify(prev, fhash):
+            skip_unchanged(key, prev)
+            return
+        emit((read_document(doc) if doc.get("path") else doc, fhash, prev))
+
+    # a department's markdown is re-chunked as a whole if any file in it is new, changed or removed
+    def read_bundle(item, emit):
+        prefix = item["department"] + "/"
+        entries = []
+        dirty = rechunk_all or any(k.startswith(prefix) and k not in seen for k in manifest.files)
+        for doc in item["bundle"]:
+            prev = manifest.files.get(file_key(doc))
+            fhash = document_hash(doc)
+            dirty = classify(prev, fhash) or dirty
+            entries.append((doc, fhash, prev))
+        if not dirty:
+            for doc, _, prev in entries:
+                skip_unchanged(file_key(doc), prev)
+            return
+        emit([(read_document(doc) if doc.get("path") else doc, fhash, prev) for doc, fhash, prev in entries])
+
+    # diff one file's chunks against the manifest, emitting those to embed
+    def diff_file(key, fhash, prev, file_chunks, emit):
+        prev_chunks = prev["chunks"] if prev else {}
+        chunks: Dict[str, str] = {}
+        for c in file_chunks:
+            h = chunk_hash(c)
+            chunks[c["id"]] = h
+            if not full and prev_chunks.get(c["id"]) == h:
+                report["chunks_skipped"] += 1
+                continue
+            changed_sources.add(key)
+            emit(c)
+        # Document shrank, chunking moved or a chunk became a duplicate: drop ids that no longer exist
+        gone = [i for i in prev_chunks if i not in chunks]
+        if gone:
+            stale_ids.extend(gone)
+            changed_sources.add(key)
+        files[key] = {"file_hash": fhash, "chunks": chunks}
+
+    # chunk: split the file (or a department's markdown, collapsing near-duplicates) and diff
+    def chunk(item, emit):
+        if isinstance(item, list):
+            return chunk_bundle(item, emit)
+        doc, fhash, prev = item
+        diff_file(file_key(doc), fhash, prev, iter_docs_for_vectorstore([doc]), emit)
+
+    def chunk_bundle(entries, emit):
+        by_file: Dict[str, List[Dict]] = {file_key(doc): [] for doc, _, _ in entries}
+        for c in build_docs_for_vectorstore([doc for doc, _, _ in entries], dedup_threshold=dedup_threshold):
+            by_file[file_key(c["metadata"])].append(c)
+            report["chunks_collapsed"] += c["metadata"].get("duplicates", 0)
+        for doc, fhash, prev in entries:
+            key = file_key(doc)
+            diff_file(key, fhash, prev, by_file[key], emit)
+
+    # embed: collect batch_size chunks and encode them in one call
+    def embed(c, emit):
+        batch.append(c)
+        if len(batch) >= batch_size:
+            embed_finish(emit)
+
+    def embed_finish(emit):
+        if batch:
+            docs = list(batch)
+            batch.clear()
+            with stage("ingest_embed_batch"):
+                embeddings = vs.embed_texts([d["content"] for d in docs])
+            emit((docs, embeddings))
+
+    # write: upsert pre-computed embeddings into the store
+    def write(item, emit):
+        docs, embeddings = item
+        with stage("ingest_write_batch"):
+            vs.upsert_embedded(docs, embeddings)
+        report["chunks_embedded"] += len(docs)
+        logger.info("Upserted %d chunks (%d so far)", len(docs), report["chunks_embedded"])
+
+    stages = run_pipeline(discover(), [
+        Stage("read", read),
+        Stage("chunk", chunk),
+        Stage("embed", embed, finish=embed_finish),
+        Stage("write", write, count=lambda item: len(item[0])),
+    ], queue_depth=queue_depth, cancel=cancel)
+    report["chunks_skipped"] += unchanged_chunks
+
+    for key, entry in manifest.files.items():
+        if key not in files:
+            report["files_removed"] += 1
+            stale_ids.extend(entry["chunks"])
+            changed_sources.add(key)
+
+    if stale_ids:
+        vs.delete_ids(stale_ids)
+    report["chunks_deleted"] = len(stale_ids)
+    report["sources_changed"] = len(changed_sources)
+
+    if report["chunks_embedded"] or stale_ids:
+        vs.persist()
+        if invalidate:
+            # Invalidate cached query embeddings and retrieval results, and answers citing changed sources
+            report["index_generation"] = index_generation.bump(changed_sources)
+    if not invalidate:
+        report["changed_sources"] = sorted(changed_sources)
+    manifest.files = files
+    manifest.chunker = CHUNKER_VERSION
+    manifest.save()
+
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    report["chunks_per_second"] = round(report["chunks_embedded"] / report["seconds"], 1) if report["seconds"] else None
+    report["stages"] = stages
+    report["peak_rss_mb"] = peak_rss_mb()
+    logger.info("Ingest report: %s", {k: v for k, v in report.items() if k != "stages"})
+    return report
@@ -0,0 +1,196 @@
+# app/services/jobs.py
+# Background ingest jobs with a blue/green collection swap: each job writes into a fresh,
+# versioned collection while readers keep using the active one, and only a finished,
+# persisted collection is switched in. Cancelled or failed jobs drop what they wrote.
+import contextvars
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from app.services import registry
+from app.services.cache import index_generation
+from app.services.concurrency import ingest_executor
+from app.services.ingest import run_incremental_ingest
+from app.services.pipeline import PipelineCancelled
+from app.services.vectorstore import COLLECTION_NAME
+
+logger = logging.getLogger("finbot.jobs")
+
+# Finished jobs remembered for GET /ingest/jobs
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "20"))
+# Rows per batch when copying the active collection into a new one before an incremental ingest
+INGEST_SEED_BATCH = int(os.getenv("INGEST_SEED_BATCH", "1024"))
+
+FINISHED = ("succeeded", "failed", "cancelled")
+
+
+class IngestJob:
+    def __init__(self, full: bool, requested_by: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.full = full
+        self.requested_by = requested_by
+        self.status = "queued"
+        self.phase = "queued"
+        self.collection: Optional[str] = None
+        self.progress: Dict = {}
+        self.report: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_event = threading.Event()
+        self.done = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def to_dict(self) -> Dict:
+        end = self.finished_at or time.time()
+        elapsed = round(end - self.started_at, 3) if self.started_at else None
+        embedded = self.progress.get("chunks_embedded", 0)
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "phase": self.phase,
+            "full": self.full,
+            "requested_by": self.requested_by,
+            "collection": self.collection,
+            "progress": dict(self.progress),
+            "elapsed_seconds": elapsed,
+            "chunks_per_second": round(embedded / elapsed, 1) if elapsed else None,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.created_at)),
+            "report": self.report,
+            "error": self.error,
+        }
+
+
+def _seed(job: IngestJob, current, target):
+    """
+    Copy the active collection (rows, embeddings and manifest) so the job only embeds what
+    changed. Pages of INGEST_SEED_BATCH rows are read and written in turn, never the whole store.
+    """
+    from app.services.snapshot import iter_store
+
+    job.progress["chunks_seeded"] = 0
+    for ids, docs, metas, embeddings in iter_store(current, INGEST_SEED_BATCH):
+        if job.cancel_event.is_set():
+            raise PipelineCancelled()
+        target.upsert_embedded([{"id": i, "content": d, "metadata": m} for i, d, m in zip(ids, docs, metas)],
+                               embeddings)
+        job.progress["chunks_seeded"] += len(ids)
+    if os.path.exists(current.manifest_path):
+        shutil.copyfile(current.manifest_path, target.manifest_path)
+
+
+def run_blue_green_ingest(job: IngestJob, backend: str = registry.VECTOR_BACKEND) -> Dict:
+    """
+    Ingest into a new collection and make it active only once complete. Readers see either
+    the old index or the new one, never a partial one. Returns the ingest report.
+    """
+    current = registry.get_vector_store()
+    if current.read_only:
+        raise RuntimeError(f"{type(current).__name__} is read-only; ingest into a writable backend")
+    job.collection = f"{COLLECTION_NAME}_{time.strftime('%Y%m%d_%H%M%S')}_{job.id[:6]}"
+    target = registry.create_vector_store(backend, collection_name=job.collection)
+    try:
+        if not job.full:
+            job.phase = "seeding"
+            _seed(job, current, target)
+        job.phase = "ingesting"
+        report = run_incremental_ingest(vs=target, full=job.full, cancel=job.cancel_event,
+                                        progress=job.progress, invalidate=False)
+        if job.cancel_event.is_set():
+            raise PipelineCancelled()
+        if not job.full and not report["changed_sources"]:
+            # Nothing changed: keep serving the active collection rather than swapping in a copy
+            target.drop()
+            report.pop("changed_sources")
+            report["collection"] = job.collection = current.collection_name
+            return report
+        job.phase = "activating"
+        target.persist()
+        report["collection"] = job.collection
+        report["pointer"] = registry.activate_collection(target, backend)
+    except BaseException:
+        logger.info("Dropping unfinished collection %s", job.collection)
+        try:
+            target.drop()
+        except Exception:
+            logger.exception("Could not drop collection %s", job.collection)
+        raise
+    # Only now can cached answers citing changed sources be stale
+    report["index_generation"] = index_generation.bump(report.pop("changed_sources"))
+    report["dropped_collections"] = registry.prune_collections(backend)
+    return report
+
+
+def rollback(backend: str = registry.VECTOR_BACKEND) -> Dict:
+    """Switch readers back to the previous collection and invalidate every cache built on the current one."""
+    pointer = registry.rollback_collection(backend)
+    index_generation.bump()
+    return pointer
+
+
+class JobManager:
+    """Runs ingest jobs one at a time on the ingest executor and remembers recent ones."""
+
+    def __init__(self, history: int = INGEST_JOB_HISTORY):
+        self.history = history
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, full: bool = False, requested_by: str = "") -> IngestJob:
+        job = IngestJob(full, requested_by)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+        ctx = contextvars.copy_context()
+        ingest_executor.submit(ctx.run, self._run, job)
+        return job
+
+    def _run(self, job: IngestJob):
+        if job.cancel_event.is_set():
+            job.status = job.phase = "cancelled"
+        else:
+            job.status, job.started_at = "running", time.time()
+            try:
+                job.report = run_blue_green_ingest(job)
+                job.status = job.phase = "succeeded"
+            except PipelineCancelled:
+                job.status = job.phase = "cancelled"
+            except Exception as e:
+                logger.exception("Ingest job %s failed", job.id)
+                job.status = job.phase = "failed"
+                job.error = str(e)
+        job.finished_at = time.time()
+        logger.info("Ingest job %s %s", job.id, job.status)
+        job.done.set()
+
+    def _trim(self):
+        finished = [i for i, j in self._jobs.items() if j.finished]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[IngestJob]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> Optional[IngestJob]:
+        """Ask a queued or running job to stop; it drops its collection. None if the id is unknown."""
+        job = self.get(job_id)
+        if job is not None and not job.finished:
+            job.cancel_event.set()
+        return job
+
+
+jobs = JobManager()
@@ -1,13 +1,23 @@
 # app/services/llm.py
+import asyncio
 import os
+import re
+import threading
+from typing import AsyncIterator, List
 from dotenv import load_dotenv
 from langchain import PromptTemplate
-from langchain.llms import HuggingFaceHub
+
+from app.services.admission import admission
+from app.services.concurrency import LLM_TIMEOUT
 
 load_dotenv()
 
 HF_TOKEN = os.getenv("HF_API_TOKEN")
 HF_MODEL = os.getenv("HF_MODEL", "mistralai/Mistral-7B-Instruct-v0.3")
+# hf: Hugging Face Inference API; stub: deterministic offline answers (benchmarks, tests)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "hf").lower()
+# Simulated generation time per stub call, so benchmarks still exercise LLM concurrency limits
+LLM_STUB_LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", "0"))
 
 # Prompt template: system + context + user question
 SYSTEM_PROMPT = """
@@ -19,25 +29,83 @@ Provide a concise helpful answer and at the end include "Sources:" followed by s
 PROMPT_TMPL = SYSTEM_PROMPT + "\n\nCONTEXT:\n{context}\n\nUser Question:\n{question}\n\nAnswer:"
 prompt = PromptTemplate(input_variables=["context", "question"], template=PROMPT_TMPL)
 
-def get_hf_llm(max_new_tokens: int = 300, temperature: float = 0.2):
+def _stub_tokens(prompt: str, max_new_tokens: int) -> List[str]:
+    # Echo the opening words of the context so answers are deterministic but prompt-dependent
+    context = prompt.split("CONTEXT:", 1)[-1].split("User Question:", 1)[0]
+    words = re.sub(r"\[[^\]]*\]", " ", context).split()[:max(1, min(max_new_tokens, 48))]
+    return ["Based on the context: "] + [w + " " for w in words]
+
+
+class AsyncStubInferenceClient:
+    """Offline stand-in for AsyncInferenceClient.text_generation (LLM_BACKEND=stub)."""
+
+    async def text_generation(self, prompt: str, max_new_tokens: int = 300, temperature: float = 0.2,
+                              stream: bool = False):
+        if LLM_STUB_LATENCY_MS:
+            await asyncio.sleep(LLM_STUB_LATENCY_MS / 1000.0)
+        tokens = _stub_tokens(prompt, max_new_tokens)
+        if not stream:
+            return "".join(tokens).strip()
+
+        async def fragments():
+            for token in tokens:
+                yield token
+        return fragments()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_async_hf_client():
     """
-    Returns a LangChain HuggingFaceHub LLM wrapper that calls the Inference API.
+    Returns the shared huggingface_hub AsyncInferenceClient for the configured model: one per
+    process, reused across requests so connections (and TLS sessions) are pooled.
     """
+    global _client
+    if LLM_BACKEND == "stub":
+        return AsyncStubInferenceClient()
     if not HF_TOKEN:
         raise ValueError("HF_API_TOKEN not found in environment. Set it in .env")
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from huggingface_hub import AsyncInferenceClient
+                _client = AsyncInferenceClient(model=HF_MODEL, token=HF_TOKEN, timeout=LLM_TIMEOUT)
+    return _client
 
-    llm = HuggingFaceHub(
-        repo_id=HF_MODEL,
-        huggingfacehub_api_token=HF_TOKEN,
-        model_kwargs={"temperature": temperature, "max_new_tokens": max_new_tokens}
-    )
-    return llm
+async def agenerate_answer(context_chunks: str, question: str, max_new_tokens: int = 300, temperature: float = 0.2,
+                           timeout: float = LLM_TIMEOUT) -> str:
+    """
+    Calls the Inference API with the RAG prompt and returns the text. Waits in the admission
+    queue for one of LLM_MAX_CONCURRENCY slots, then awaits the call with a per-request
+    timeout (asyncio.TimeoutError on expiry).
+    """
+    final_prompt = prompt.format(context=context_chunks, question=question)
+    client = get_async_hf_client()
+    async with admission.slot():
+        return await asyncio.wait_for(
+            client.text_generation(final_prompt, max_new_tokens=max_new_tokens, temperature=temperature),
+            timeout=timeout
+        )
 
-def generate_answer(context_chunks: str, question: str, max_new_tokens: int = 300, temperature: float = 0.2):
+async def astream_answer(context_chunks: str, question: str, max_new_tokens: int = 300, temperature: float = 0.2,
+                         timeout: float = LLM_TIMEOUT) -> AsyncIterator[str]:
     """
-    Calls the HuggingFaceHub LLM via LangChain and returns text response.
+    Same prompt as agenerate_answer, but yields text fragments as the Inference API produces them.
+    Holds an LLM slot for the whole stream; `timeout` bounds the wait for each fragment.
     """
-    llm = get_hf_llm(max_new_tokens=max_new_tokens, temperature=temperature)
     final_prompt = prompt.format(context=context_chunks, question=question)
-    output = llm(final_prompt)
-    return output
+    client = get_async_hf_client()
+    async with admission.slot():
+        stream = await asyncio.wait_for(
+            client.text_generation(final_prompt, max_new_tokens=max_new_tokens,
+                                   temperature=temperature, stream=True),
+            timeout=timeout
+        )
+        iterator = stream.__aiter__()
+        while True:
+            try:
+                token = await asyncio.wait_for(iterator.__anext__(), timeout=timeout)
+            except StopAsyncIteration:
+                break
+            yield token
@@ -0,0 +1,60 @@
+# app/services/manifest.py
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+MANIFEST_VERSION = 1
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    """sha256 of a file's bytes, read in blocks so large files never sit in memory."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def chunk_hash(doc: Dict) -> str:
+    """Hash of everything that ends up in the index for one chunk (text + metadata)."""
+    payload = doc["content"] + "\x00" + json.dumps(doc.get("metadata", {}), sort_keys=True, default=str)
+    return content_hash(payload)
+
+
+class IngestManifest:
+    """
+    Persisted record of what is currently indexed:
+    {"files": {"<dept>/<source>": {"file_hash": str, "chunks": {chunk_id: chunk_hash}}}}
+    """
+
+    def __init__(self, path: str, chunker: str = "", files: Optional[Dict[str, Dict]] = None):
+        self.path = path
+        self.chunker = chunker
+        self.files: Dict[str, Dict] = files or {}
+
+    @classmethod
+    def load(cls, path: str) -> "IngestManifest":
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != MANIFEST_VERSION:
+            # Unknown layout: start from scratch, every file is treated as new
+            return cls(path)
+        return cls(path, chunker=data.get("chunker", ""), files=data.get("files", {}))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "chunker": self.chunker, "files": self.files}, f)
+        os.replace(tmp, self.path)  # atomic: readers never see a half-written manifest
+
+    def chunk_ids(self, key: str) -> List[str]:
+        entry = self.files.get(key)
+        return list(entry["chunks"]) if entry else []
@@ -0,0 +1,224 @@
+# app/services/metrics.py
+# Latency histograms in Prometheus text format, per-request stage traces and a sampling
+# profiler. No client library: one lock-protected bucket array per label set is cheaper
+# than what we are measuring by several orders of magnitude.
+import contextvars
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("finbot.metrics")
+
+# Fraction of chat requests whose CPU stages run under cProfile (0 = off); see /stats/profile
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+TRACE_HEADER = "X-Finbot-Trace"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values, rendered in Prometheus text format."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str], buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, *labels: str):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self) -> Dict[Tuple[str, ...], Dict]:
+        with self._lock:
+            return {k: {"counts": list(v[0]), "sum": v[1], "count": v[2]} for k, v in self._series.items()}
+
+    def quantile(self, q: float, *labels: str) -> Optional[float]:
+        """Upper bucket bound containing quantile q (as histogram_quantile would, without interpolation)."""
+        s = self.snapshot().get(labels)
+        if not s or not s["count"]:
+            return None
+        rank, seen = q * s["count"], 0
+        for bound, n in zip(self.buckets + (float("inf"),), s["counts"]):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, s in sorted(self.snapshot().items()):
+            base = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, labels))
+            sep = "," if base else ""
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), s["counts"]):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{base}}} {s['sum']:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {s['count']}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_registry: List[Histogram] = []
+
+stage_seconds = Histogram("finbot_stage_seconds", "Time spent in one pipeline stage.",
+                          ("stage", "endpoint", "role"))
+request_seconds = Histogram("finbot_request_seconds", "End-to-end request latency.", ("endpoint", "role"))
+
+
+# -------------------------
+# Request context (labels, trace, profiling) carried in contextvars
+# -------------------------
+class RequestContext:
+    __slots__ = ("endpoint", "role", "trace", "profile")
+
+    def __init__(self, endpoint: str, role: str, trace: bool = False, profile: bool = False):
+        self.endpoint = endpoint
+        self.role = role
+        self.trace: Optional[List[Tuple[str, float]]] = [] if trace else None
+        self.profile = profile
+
+
+_current: contextvars.ContextVar[Optional[RequestContext]] = contextvars.ContextVar("finbot_request", default=None)
+
+
+def current_request() -> Optional[RequestContext]:
+    return _current.get()
+
+
+@contextmanager
+def request_context(endpoint: str, role: str = "-", trace: bool = False) -> Iterator[RequestContext]:
+    """
+    Label every stage timed inside this block with endpoint/role, optionally collect a trace
+    and, for a PROFILE_SAMPLE_RATE fraction of requests, profile CPU stages.
+    """
+    ctx = RequestContext(endpoint, role, trace, profile=profiler.should_sample())
+    token = _current.set(ctx)
+    t0 = time.perf_counter()
+    try:
+        yield ctx
+    finally:
+        request_seconds.observe(time.perf_counter() - t0, endpoint, role)
+        try:
+            _current.reset(token)
+        except ValueError:
+            # Closed from another context (e.g. a streaming generator finalised elsewhere)
+            _current.set(None)
+
+
+def record(name: str, elapsed: float):
+    """Add one stage duration (seconds) under the current request's labels."""
+    ctx = _current.get()
+    if ctx is None:
+        stage_seconds.observe(elapsed, name, "-", "-")
+    else:
+        stage_seconds.observe(elapsed, name, ctx.endpoint, ctx.role)
+        if ctx.trace is not None:
+            ctx.trace.append((name, elapsed))
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block into finbot_stage_seconds (and the request trace, if one is being collected)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - t0)
+
+
+def server_timing(ctx: RequestContext) -> str:
+    """Trace as a Server-Timing header value (durations in ms), shown by browser dev tools."""
+    return ", ".join(f"{name};dur={elapsed * 1000:.2f}" for name, elapsed in ctx.trace or [])
+
+
+def trace_dict(ctx: RequestContext) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for name, elapsed in ctx.trace or []:
+        out[name] = round(out.get(name, 0.0) + elapsed * 1000, 3)
+    return out
+
+
+# -------------------------
+# Sampling profiler
+# -------------------------
+class SamplingProfiler:
+    """
+    Runs CPU-stage calls of sampled requests under cProfile and accumulates the stats.
+    Only one call is profiled at a time (cProfile is not re-entrant across threads on
+    newer Pythons); concurrent sampled calls simply run unprofiled.
+    """
+
+    def __init__(self, rate: float = PROFILE_SAMPLE_RATE):
+        self.rate = rate
+        self.calls = 0
+        self._stats: Optional[pstats.Stats] = None
+        self._active = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def should_sample(self) -> bool:
+        return self.rate > 0 and random.random() < self.rate
+
+    def call(self, fn: Callable, *args, **kwargs):
+        ctx = _current.get()
+        if ctx is None or not ctx.profile or not self._active.acquire(blocking=False):
+            return fn(*args, **kwargs)
+        prof = cProfile.Profile()
+        try:
+            return prof.runcall(fn, *args, **kwargs)
+        finally:
+            self._active.release()
+            with self._stats_lock:
+                self.calls += 1
+                if self._stats is None:
+                    self._stats = pstats.Stats(prof)
+                else:
+                    self._stats.add(prof)
+
+    def report(self, limit: int = 30, sort: str = "cumulative") -> str:
+        with self._stats_lock:
+            if self._stats is None:
+                return "No profiles collected (set PROFILE_SAMPLE_RATE > 0)."
+            out = io.StringIO()
+            self._stats.stream = out
+            self._stats.sort_stats(sort).print_stats(limit)
+            return f"{self.calls} profiled calls\n" + out.getvalue()
+
+    def reset(self):
+        with self._stats_lock:
+            self._stats = None
+            self.calls = 0
+
+
+profiler = SamplingProfiler()
+
+
+def render_prometheus(extra: Sequence[str] = ()) -> str:
+    lines: List[str] = []
+    for h in _registry:
+        lines.extend(h.render())
+    lines.extend(extra)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,379 @@
+# app/services/numpy_store.py
+import heapq
+import json
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from app.services.embedding import EmbeddingEngine
+from app.services.vectorstore import (BaseVectorStore, COLLECTION_NAME, INGEST_MANIFEST_PATH, PERSIST_DIR,
+                                      manifest_path_for)
+
+load_dotenv()
+
+NUMPY_INDEX_DIR = os.getenv("NUMPY_INDEX_DIR", os.path.join(PERSIST_DIR, "numpy_index"))
+# Memory-map partition matrices read-only instead of loading them into the heap
+NUMPY_INDEX_MMAP = os.getenv("NUMPY_INDEX_MMAP", "false").lower() in ("1", "true", "yes")
+# none | float16 | int8: scan a compact copy in RAM, re-rank candidates against the float32
+# matrix, which is then always memory-mapped so only candidate rows are paged in
+NUMPY_INDEX_QUANTIZATION = os.getenv("NUMPY_INDEX_QUANTIZATION", "none").lower()
+# Candidates re-ranked at full precision per requested result when quantized
+NUMPY_RERANK_FACTOR = int(os.getenv("NUMPY_RERANK_FACTOR", "4"))
+QUANTIZATION_MODES = ("none", "float16", "int8")
+# Rows converted to float32 at a time while scanning a compact matrix (bounds temporary memory)
+SCAN_BLOCK_ROWS = 65536
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.ascontiguousarray(vectors / np.maximum(norms, 1e-12), dtype=np.float32)
+
+
+def quantize(matrix: np.ndarray, mode: str) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """
+    Compact copy of a (n, dim) float32 matrix: float16 values, or int8 codes with one
+    float32 scale per row (max |x| / 127). Returns (compact, scales); both None for "none".
+    """
+    if mode == "none":
+        return None, None
+    if mode == "float16":
+        return np.ascontiguousarray(matrix, dtype=np.float16), None
+    if mode != "int8":
+        raise ValueError(f"Unknown quantization {mode!r} (expected one of {QUANTIZATION_MODES})")
+    n = len(matrix)
+    codes = np.empty(matrix.shape, dtype=np.int8)
+    scales = np.empty(n, dtype=np.float32)
+    for start in range(0, n, SCAN_BLOCK_ROWS):
+        block = np.asarray(matrix[start:start + SCAN_BLOCK_ROWS], dtype=np.float32)
+        s = np.abs(block).max(axis=1) / 127.0
+        s[s == 0] = 1.0
+        codes[start:start + len(block)] = np.clip(np.rint(block / s[:, None]), -127, 127)
+        scales[start:start + len(block)] = s
+    return codes, scales
+
+
+def departments_from_where(where: Optional[Dict], available: Sequence[str]) -> List[str]:
+    """
+    Translate the Chroma-style department filter used by rag.py into partition names.
+    Supports None, {"department": "x"} and {"department": {"$in": [...]}}.
+    """
+    if not where:
+        return list(available)
+    if set(where) != {"department"}:
+        raise ValueError(f"NumpyVectorStore only filters on department, got {where}")
+    cond = where["department"]
+    if isinstance(cond, str):
+        wanted = [cond]
+    elif isinstance(cond, dict) and set(cond) == {"$in"}:
+        wanted = list(cond["$in"])
+    elif isinstance(cond, dict) and set(cond) == {"$eq"}:
+        wanted = [cond["$eq"]]
+    else:
+        raise ValueError(f"Unsupported department filter: {cond}")
+    return [d for d in wanted if d in available]
+
+
+class Partition:
+    """
+    One department's rows: a contiguous (n, dim) float32 matrix of unit vectors plus
+    parallel id/document/metadata lists, and optionally a quantized copy of the matrix
+    (see quantize). Treated as immutable; writers build a new one and swap it in, so
+    readers never need a lock.
+    """
+
+    def __init__(self, matrix: np.ndarray, ids: List[str], documents: List[str], metadatas: List[Dict],
+                 quantization: str = "none", compact: Optional[np.ndarray] = None,
+                 scales: Optional[np.ndarray] = None):
+        self.matrix = matrix
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self._row_of: Optional[Dict[str, int]] = None
+        self.quantization = quantization
+        if compact is None:
+            compact, scales = quantize(matrix, quantization)
+        self.compact = compact
+        self.scales = scales
+
+    @property
+    def row_of(self) -> Dict[str, int]:
+        # Built on first write, so read-only partitions never walk every id
+        if self._row_of is None:
+            self._row_of = {i: r for r, i in enumerate(self.ids)}
+        return self._row_of
+
+    @classmethod
+    def empty(cls, dim: int, quantization: str = "none") -> "Partition":
+        return cls(np.empty((0, dim), dtype=np.float32), [], [], [], quantization)
+
+    def _approx_scores(self, q_embs: np.ndarray) -> np.ndarray:
+        if self.compact is None:
+            return self.matrix @ q_embs.T  # (n, n_queries)
+        n = len(self.ids)
+        scores = np.empty((n, len(q_embs)), dtype=np.float32)
+        for start in range(0, n, SCAN_BLOCK_ROWS):
+            block = self.compact[start:start + SCAN_BLOCK_ROWS].astype(np.float32) @ q_embs.T
+            if self.scales is not None:
+                block *= self.scales[start:start + SCAN_BLOCK_ROWS, None]
+            scores[start:start + len(block)] = block
+        return scores
+
+    def top_k(self, q_embs: np.ndarray, k: int, rerank_factor: int = NUMPY_RERANK_FACTOR) -> List[List[tuple]]:
+        """
+        Per query: up to k (score, row) pairs, best first. Quantized partitions take the
+        k * rerank_factor best approximate rows and re-score them at full precision.
+        """
+        n = len(self.ids)
+        if n == 0:
+            return [[] for _ in range(len(q_embs))]
+        scores = self._approx_scores(q_embs)
+        k = min(k, n)
+        pool = k if self.compact is None else min(n, k * max(1, rerank_factor))
+        out = []
+        for q in range(scores.shape[1]):
+            col = scores[:, q]
+            rows = np.argpartition(-col, pool - 1)[:pool] if pool < n else np.arange(n)
+            if self.compact is not None:
+                rows = np.sort(rows)  # ascending offsets read the memory-mapped matrix sequentially
+                col = np.full(n, -np.inf, dtype=np.float32)
+                col[rows] = np.asarray(self.matrix[rows], dtype=np.float32) @ q_embs[q]
+                rows = rows[np.argpartition(-col[rows], k - 1)[:k]] if k < len(rows) else rows
+            rows = rows[np.argsort(-col[rows])]
+            out.append([(float(col[r]), int(r)) for r in rows])
+        return out
+
+    def memory_bytes(self) -> Dict[str, int]:
+        """Bytes of the scanned representation vs the full-precision matrix."""
+        compact = 0 if self.compact is None else self.compact.nbytes + (0 if self.scales is None else self.scales.nbytes)
+        return {"scan": compact or int(self.matrix.nbytes), "full_precision": int(self.matrix.nbytes),
+                "full_precision_mmapped": isinstance(self.matrix, np.memmap)}
+
+    def upsert(self, ids: List[str], documents: List[str], metadatas: List[Dict], vectors: np.ndarray) -> "Partition":
+        matrix = np.array(self.matrix, dtype=np.float32)  # writable copy (source may be a read-only mmap)
+        all_ids, all_docs, all_metas = list(self.ids), list(self.documents), list(self.metadatas)
+        row_of = dict(self.row_of)
+        new_rows, updated = [], set()
+        for _id, doc, meta, vec in zip(ids, documents, metadatas, vectors):
+            r = row_of.get(_id)
+            if r is None:
+                row_of[_id] = len(all_ids)
+                all_ids.append(_id)
+                all_docs.append(doc)
+                all_metas.append(meta)
+                new_rows.append(vec)
+            elif r < len(matrix):
+                matrix[r] = vec
+                updated.add(r)
+                all_docs[r], all_metas[r] = doc, meta
+            else:
+                # id repeated within this call: overwrite the row queued above
+                new_rows[r - len(matrix)] = vec
+                all_docs[r], all_metas[r] = doc, meta
+        old_n = len(matrix)
+        if new_rows:
+            matrix = np.vstack([matrix, np.stack(new_rows)])
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        compact, scales = self._requantize(matrix, sorted(updated) + list(range(old_n, len(matrix))))
+        return Partition(matrix, all_ids, all_docs, all_metas, self.quantization, compact, scales)
+
+    def _requantize(self, matrix: np.ndarray, rows: List[int]) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """Compact copy of `matrix` reusing this partition's codes, quantizing only `rows` afresh."""
+        if self.compact is None:
+            return quantize(matrix, self.quantization)
+        old_n = len(self.compact)
+        compact = np.empty(matrix.shape, dtype=self.compact.dtype)
+        compact[:old_n] = self.compact
+        scales = None
+        if self.scales is not None:
+            scales = np.empty(len(matrix), dtype=np.float32)
+            scales[:old_n] = self.scales
+        if rows:
+            codes, row_scales = quantize(matrix[rows], self.quantization)
+            compact[rows] = codes
+            if scales is not None:
+                scales[rows] = row_scales
+        return compact, scales
+
+    def delete(self, ids: Sequence[str]) -> "Partition":
+        drop = {self.row_of[i] for i in ids if i in self.row_of}
+        if not drop:
+            return self
+        keep = [r for r in range(len(self.ids)) if r not in drop]
+        return Partition(
+            np.ascontiguousarray(self.matrix[keep], dtype=np.float32),
+            [self.ids[r] for r in keep], [self.documents[r] for r in keep], [self.metadatas[r] for r in keep],
+            self.quantization
+        )
+
+
+class NumpyVectorStore(BaseVectorStore):
+    """
+    Exact cosine search over one float32 matrix per department. A role's query only
+    touches the partitions it may see; per-partition top-k lists are merged with a heap.
+    Layout on disk: <index_dir>/<collection>/<department>/{vectors.npy, records.json},
+    plus compact.npy (and scales.npy for int8) when quantized.
+    Reported distances are cosine distances (1 - cosine similarity).
+    """
+
+    def __init__(self, index_dir: str = NUMPY_INDEX_DIR, collection_name: str = COLLECTION_NAME,
+                 engine: Optional[EmbeddingEngine] = None, mmap: bool = NUMPY_INDEX_MMAP,
+                 quantization: str = NUMPY_INDEX_QUANTIZATION, rerank_factor: int = NUMPY_RERANK_FACTOR):
+        super().__init__(engine)
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization {quantization!r} (expected one of {QUANTIZATION_MODES})")
+        self.root = os.path.join(index_dir, collection_name)
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        # Quantized search only reads candidate rows at full precision, so keep them on disk
+        self.mmap = mmap or quantization != "none"
+        self.collection_name = collection_name
+        if INGEST_MANIFEST_PATH:
+            self.manifest_path = manifest_path_for(self.root, collection_name)
+        else:
+            self.manifest_path = os.path.join(self.root, "ingest_manifest.json")
+        self.partitions: Dict[str, Partition] = {}
+        self._dirty = set()
+        self._write_lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self._load()
+
+    # -------------------------
+    # Persistence
+    # -------------------------
+    def _load(self):
+        for dept in sorted(os.listdir(self.root)):
+            part = self._load_partition(dept)
+            if part is not None:
+                self.partitions[dept] = part
+
+    def _load_partition(self, dept: str) -> Optional[Partition]:
+        path = os.path.join(self.root, dept)
+        vec_path = os.path.join(path, "vectors.npy")
+        rec_path = os.path.join(path, "records.json")
+        if not (os.path.isdir(path) and os.path.exists(vec_path) and os.path.exists(rec_path)):
+            return None
+        matrix = np.load(vec_path, mmap_mode="r" if self.mmap else None)
+        with open(rec_path, "r", encoding="utf-8") as f:
+            rec = json.load(f)
+        compact = scales = None
+        if rec.get("quantization", "none") == self.quantization != "none":
+            # Stored compact arrays are read into RAM: they are what every query scans
+            compact = np.load(os.path.join(path, "compact.npy"))
+            if self.quantization == "int8":
+                scales = np.load(os.path.join(path, "scales.npy"))
+            if len(compact) != len(matrix):
+                compact = scales = None
+        return Partition(matrix, rec["ids"], rec["documents"], rec["metadatas"],
+                         self.quantization, compact, scales)
+
+    def persist(self):
+        with self._write_lock:
+            for dept in sorted(self._dirty):
+                part = self.partitions.get(dept)
+                path = os.path.join(self.root, dept)
+                os.makedirs(path, exist_ok=True)
+                # Write-then-rename so a concurrent reader or crash never sees half a file
+                np.save(os.path.join(path, "vectors.tmp.npy"), np.asarray(part.matrix))
+                if part.compact is not None:
+                    np.save(os.path.join(path, "compact.tmp.npy"), part.compact)
+                if part.scales is not None:
+                    np.save(os.path.join(path, "scales.tmp.npy"), part.scales)
+                with open(os.path.join(path, "records.tmp.json"), "w", encoding="utf-8") as f:
+                    json.dump({"ids": part.ids, "documents": part.documents, "metadatas": part.metadatas,
+                               "quantization": part.quantization}, f)
+                for name in ("vectors", "compact", "scales"):
+                    if os.path.exists(os.path.join(path, f"{name}.tmp.npy")):
+                        os.replace(os.path.join(path, f"{name}.tmp.npy"), os.path.join(path, f"{name}.npy"))
+                os.replace(os.path.join(path, "records.tmp.json"), os.path.join(path, "records.json"))
+                if self.mmap:
+                    # Swap the heap copy built by upsert for a read-only map of the file just written
+                    self.partitions[dept] = self._load_partition(dept)
+            self._dirty.clear()
+
+    # -------------------------
+    # Writes
+    # -------------------------
+    def upsert_embedded(self, docs: List[Dict], embeddings: np.ndarray):
+        if not docs:
+            return
+        vectors = normalize_rows(embeddings)
+        by_dept: Dict[str, List[int]] = {}
+        for i, d in enumerate(docs):
+            by_dept.setdefault(d.get("metadata", {}).get("department", "unknown"), []).append(i)
+        with self._write_lock:
+            # An id may move between departments; drop it from its old partition first
+            self._delete_locked([d["id"] for d in docs], keep_in=by_dept)
+            for dept, idxs in by_dept.items():
+                part = self.partitions.get(dept) or Partition.empty(vectors.shape[1], self.quantization)
+                self.partitions[dept] = part.upsert(
+                    [docs[i]["id"] for i in idxs], [docs[i]["content"] for i in idxs],
+                    [docs[i].get("metadata", {}) for i in idxs], vectors[idxs]
+                )
+                self._dirty.add(dept)
+
+    def delete_ids(self, ids: List[str]):
+        if ids:
+            with self._write_lock:
+                self._delete_locked(list(ids))
+
+    def _delete_locked(self, ids: List[str], keep_in: Optional[Dict[str, List[int]]] = None):
+        for dept, part in list(self.partitions.items()):
+            targets = ids
+            if keep_in and dept in keep_in:
+                own = set(ids[i] for i in keep_in[dept])
+                targets = [i for i in ids if i not in own]
+            updated = part.delete(targets)
+            if updated is not part:
+                self.partitions[dept] = updated
+                self._dirty.add(dept)
+
+    # -------------------------
+    # Reads
+    # -------------------------
+    def query_embeddings(self, q_embs: np.ndarray, n_results: int = 5, where: Dict = None) -> List[List[Dict]]:
+        partitions = self.partitions  # snapshot; writers swap whole Partition objects
+        depts = departments_from_where(where, list(partitions))
+        q_embs = normalize_rows(np.atleast_2d(q_embs))
+        per_dept = {d: partitions[d].top_k(q_embs, n_results, self.rerank_factor) for d in depts}
+        outputs = []
+        for q in range(len(q_embs)):
+            candidates = (
+                (score, dept, row) for dept in depts for score, row in per_dept[dept][q]
+            )
+            best = heapq.nlargest(n_results, candidates, key=lambda c: c[0])
+            outputs.append([{
+                "id": partitions[dept].ids[row],
+                "document": partitions[dept].documents[row],
+                "metadata": partitions[dept].metadatas[row],
+                "distance": 1.0 - score,
+                "embedding": np.array(partitions[dept].matrix[row]),
+            } for score, dept, row in best])
+        return outputs
+
+    def count(self) -> int:
+        return sum(len(p.ids) for p in self.partitions.values())
+
+    def drop(self):
+        with self._write_lock:
+            self.partitions = {}
+            self._dirty.clear()
+            shutil.rmtree(self.root, ignore_errors=True)
+            if INGEST_MANIFEST_PATH and os.path.exists(self.manifest_path):
+                os.remove(self.manifest_path)
+
+    def memory_stats(self) -> Dict:
+        """Index footprint: bytes scanned per query (held in RAM) vs the float32 matrices."""
+        parts = {dept: p.memory_bytes() for dept, p in self.partitions.items()}
+        return {
+            "quantization": self.quantization,
+            "rows": self.count(),
+            "scan_bytes": sum(p["scan"] for p in parts.values()),
+            "full_precision_bytes": sum(p["full_precision"] for p in parts.values()),
+            "full_precision_mmapped": all(p["full_precision_mmapped"] for p in parts.values()) if parts else self.mmap,
+            "partitions": parts,
+        }
@@ -0,0 +1,171 @@
+# app/services/pipeline.py
+import contextvars
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+try:
+    import resource  # not available on Windows
+except ImportError:  # pragma: no cover
+    resource = None
+
+_END = object()
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MB (None where unsupported)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024) if peak > 1 << 32 else peak / 1024, 1)
+
+
+class Stage:
+    """
+    One pipeline step running in its own thread. `process(item, emit)` may call emit()
+    any number of times; `finish(emit)` runs once after the last input (e.g. to flush a
+    partial batch). `count(item)` says how many units an input represents for throughput.
+    """
+
+    def __init__(self, name: str, process: Callable[[Any, Callable], None],
+                 finish: Optional[Callable[[Callable], None]] = None,
+                 count: Callable[[Any], int] = lambda item: 1):
+        self.name = name
+        self.process = process
+        self.finish = finish
+        self.count = count
+        self.items = 0
+        self.units = 0
+        self.busy = 0.0      # seconds doing work, excluding time blocked on a full downstream queue
+        self.blocked = 0.0   # seconds waiting for downstream (backpressure)
+        self.started = 0.0
+        self.ended = 0.0
+
+    def stats(self) -> Dict:
+        wall = max(self.ended - self.started, 1e-9)
+        return {
+            "items": self.items,
+            "units": self.units,
+            "busy_seconds": round(self.busy, 3),
+            "blocked_seconds": round(self.blocked, 3),
+            "wall_seconds": round(wall, 3),
+            "units_per_busy_second": round(self.units / self.busy, 1) if self.busy > 0 else None,
+            "utilization": round(self.busy / wall, 3),
+        }
+
+
+def run_pipeline(source: Iterable, stages: List[Stage], queue_depth: int = 4,
+                 source_name: str = "discover", cancel: Optional[threading.Event] = None) -> Dict[str, Dict]:
+    """
+    Feed `source` through `stages`, each in its own thread, connected by bounded queues
+    so a slow stage throttles the ones before it. Iterating `source` is timed as its own
+    stage. Re-raises the first stage error; raises PipelineCancelled if `cancel` is set.
+    Returns per-stage stats keyed by stage name.
+    """
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    queues = [queue.Queue(maxsize=queue_depth) for _ in stages]
+
+    def put(q: queue.Queue, item, owner: Stage):
+        t0 = time.perf_counter()
+        while True:
+            if stop.is_set() or (cancel is not None and cancel.is_set()):
+                stop.set()
+                raise PipelineCancelled()
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        owner.blocked += time.perf_counter() - t0
+
+    def get(q: queue.Queue):
+        while True:
+            if stop.is_set():
+                raise PipelineCancelled()
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    src = Stage(source_name, process=None)
+
+    def feed():
+        src.started = time.perf_counter()
+        try:
+            it = iter(source)
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    src.busy += time.perf_counter() - t0
+                    break
+                src.busy += time.perf_counter() - t0
+                src.items += 1
+                src.units += 1
+                put(queues[0], item, src)
+            put(queues[0], _END, src)
+        except PipelineCancelled:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            src.ended = time.perf_counter()
+
+    def work(i: int, stage: Stage):
+        downstream = queues[i + 1] if i + 1 < len(queues) else None
+
+        def emit(item):
+            if downstream is not None:
+                put(downstream, item, stage)
+
+        def timed(fn, *args):
+            # Busy time excludes time blocked in emit() on a full downstream queue
+            t0, b0 = time.perf_counter(), stage.blocked
+            fn(*args)
+            stage.busy += (time.perf_counter() - t0) - (stage.blocked - b0)
+
+        stage.started = time.perf_counter()
+        try:
+            while True:
+                item = get(queues[i])
+                if item is _END:
+                    if stage.finish is not None:
+                        timed(stage.finish, emit)
+                    emit(_END)
+                    break
+                timed(stage.process, item, emit)
+                stage.items += 1
+                stage.units += stage.count(item)
+        except PipelineCancelled:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            stage.ended = time.perf_counter()
+
+    # Each thread runs in a copy of the caller's context so metric labels carry over
+    threads = [threading.Thread(target=contextvars.copy_context().run, args=(feed,),
+                                name=f"pipeline-{source_name}", daemon=True)]
+    threads += [threading.Thread(target=contextvars.copy_context().run, args=(work, i, s),
+                                 name=f"pipeline-{s.name}", daemon=True)
+                for i, s in enumerate(stages)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if errors:
+        raise errors[0]
+    if cancel is not None and cancel.is_set():
+        raise PipelineCancelled()
+    return {s.name: s.stats() for s in [src] + stages}
@@ -1,7 +1,17 @@
 # app/services/rag.py
-from typing import List
-from app.services.vectorstore import VectorStore
-from app.services.llm import generate_answer
+import asyncio
+import os
+import time
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
+from app.services.registry import get_vector_store
+from app.services.cache import SemanticCache, TTLCache, index_generation, normalize_query
+from app.services.concurrency import run_cpu
+from app.services.context import assemble_context
+from app.services.llm import agenerate_answer, astream_answer
+from app.services.metrics import record, stage
+from app.services.sessions import SESSION_REUSE_THRESHOLD, ConversationSession
+from app.services.tabular import try_structured_answer
+from app.utils.dedup import origin_sources
 
 # RBAC mapping (simple single-role metadata)
 ROLE_ACCESS = {
@@ -13,51 +23,286 @@ ROLE_ACCESS = {
     "c_level": ["finance", "marketing", "hr", "engineering", "general"]
 }
 
-vs = VectorStore()
+# (normalized query, allowed departments, top_k) -> retrieved chunks
+retrieval_cache = TTLCache(
+    "retrieval",
+    maxsize=int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("RETRIEVAL_CACHE_TTL", "300")),
+    generation=index_generation,
+)
+
+# (allowed departments, generation params) + question embedding -> generated answer
+answer_cache = SemanticCache(
+    "answer",
+    maxsize=int(os.getenv("ANSWER_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "900")),
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92")),
+    generation=index_generation,
+)
+
+# Questions accepted by one /chat/batch request
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "256"))
+# Generations in flight per batch; each also takes one of the process-wide LLM_MAX_CONCURRENCY slots
+CHAT_BATCH_PARALLELISM = int(os.getenv("CHAT_BATCH_PARALLELISM", "4"))
 
 def allowed_departments(role: str):
     return ROLE_ACCESS.get(role, ["general"])
 
 def retrieve_for_role(query: str, role: str, top_k: int = 5):
     allowed = allowed_departments(role)
-    where = {"department": {"$in": allowed}}
-    results = vs.query(query_text=query, n_results=top_k, where=where)
-    return results
+    # Keyed by the department set, not the role, so roles with identical access share entries
+    key = (normalize_query(query), tuple(sorted(allowed)), top_k)
+    with stage("retrieve"):
+        results = retrieval_cache.get(key)
+        if results is None:
+            where = {"department": {"$in": allowed}}
+            results = get_vector_store().query(query_text=query, n_results=top_k, where=where)
+            retrieval_cache.set(key, results)
+    return list(results)
+
+def retrieve_many_for_role(questions: List[str], role: str, top_k: int = 5) -> List[List[dict]]:
+    """
+    retrieve_for_role for several questions: cached ones come from the retrieval cache,
+    the rest go to the store as one embedding pass and one multi-embedding query.
+    """
+    allowed = allowed_departments(role)
+    keys = [(normalize_query(q), tuple(sorted(allowed)), top_k) for q in questions]
+    with stage("retrieve"):
+        found = [retrieval_cache.get(k) for k in keys]
+        missing = [i for i, r in enumerate(found) if r is None]
+        if missing:
+            where = {"department": {"$in": allowed}}
+            fetched = get_vector_store().query(query_text=[questions[i] for i in missing], n_results=top_k, where=where)
+            for i, results in zip(missing, fetched):
+                found[i] = results
+                retrieval_cache.set(keys[i], results)
+    return [list(r) for r in found]
+
+def retrieve_in_session(session: ConversationSession, question: str, role: str, top_k: int = 5):
+    """
+    Retrieval for one conversation turn. The question, prefixed with the earlier ones, is
+    scored against the session's working set first; the store is queried only when the best
+    cached chunks average below SESSION_REUSE_THRESHOLD.
+    Returns (results, question for the prompt, {"turn", "reused", "score"}).
+    """
+    text = session.retrieval_text(question)
+    prompt_question = session.prompt_question(question)
+    with stage("session"):
+        cached, score = session.candidates(get_vector_store().embed_query(text), top_k)
+    reused = bool(cached) and score >= SESSION_REUSE_THRESHOLD
+    results = cached if reused else retrieve_for_role(text, role, top_k=top_k)
+    session.remember(results)
+    session.record_turn(question, reused)
+    return results, prompt_question, {"turn": session.turns, "reused": reused, "score": round(score, 4)}
 
 def build_context_from_results(results: List[dict]):
     """
     Combine retrieved chunks into a context block, and produce a sources summary.
+    Duplicates are dropped, the rest MMR-ordered, packed to CONTEXT_MAX_TOKENS and
+    adjacent chunks merged (see app.services.context.assemble_context).
     Returns (context_text, sources_list)
     """
-    pieces = []
-    sources = []
-    for r in results:
-        meta = r.get("metadata", {})
-        dept = meta.get("department", "unknown")
-        src = meta.get("source", "unknown")
-        chunk_id = meta.get("chunk_id", "0")
-        text = r.get("document", "")
-        # Add small header and text
-        header = f"[{dept} | {src} | chunk-{chunk_id}]"
-        pieces.append(header + "\n" + text + "\n")
-        sources.append(f"{src}#chunk-{chunk_id}")
-    context = "\n---\n".join(pieces)
-    return context, list(dict.fromkeys(sources))  # dedupe preserving order
-
-def answer_query_with_rag(question: str, role: str, top_k: int = 5, max_new_tokens: int = 300, temperature: float = 0.2):
-    # retrieve
-    results = retrieve_for_role(question, role, top_k=top_k)
+    context, sources, _ = assemble_context(results)
+    return context, sources
+
+NO_RESULTS_ANSWER = "No relevant documents found for your role."
+
+def structured_response(structured: Dict) -> Dict:
+    # Same shape as a RAG answer; "structured" carries the computed result
+    return {"answer": structured["answer"], "sources": structured["sources"], "retrieved": [],
+            "structured": structured["result"]}
+
+def structured_events(structured: Dict) -> Iterator[Dict]:
+    yield {"event": "sources", "sources": structured["sources"], "retrieved_count": 0, "structured": True}
+    yield {"event": "token", "text": structured["answer"]}
+    yield {"event": "done"}
+
+def lookup_answer(question: str, role: str, top_k: int, max_new_tokens: int, temperature: float):
+    """
+    Probe the semantic answer cache. Entries are partitioned by the allowed-department set
+    (and generation params), so a role only ever gets answers built from what it can see.
+    Returns None when the cache is disabled, else {"partition", "embedding", "generation", "hit"}.
+    """
+    if not answer_cache.enabled:
+        return None
+    partition = (tuple(sorted(allowed_departments(role))), top_k, max_new_tokens, temperature)
+    # Read before retrieval so an ingest that lands mid-request still invalidates what we store
+    generation = index_generation.value
+    with stage("answer_cache"):
+        # Shares the query embedding cache, so retrieval does not encode the question again
+        embedding = get_vector_store().embed_query(question)
+        hit = answer_cache.get(partition, embedding)
+    return {"partition": partition, "embedding": embedding, "generation": generation, "hit": hit}
+
+def remember_answer(probe, results: List[dict], answer: str, sources: List[str]):
+    if probe is None or not answer:
+        return
+    # Collapsed chunks cite every file they stand for, so a change to any of them invalidates the answer
+    cited = {f"{r.get('metadata', {}).get('department', 'unknown')}/{src}"
+             for r in results for src in origin_sources(r.get("metadata", {}))}
+    answer_cache.set(probe["partition"], probe["embedding"], {"answer": answer, "sources": sources},
+                     sources=cited, generation=probe["generation"])
+
+def cached_response(hit) -> Dict:
+    value, similarity = hit
+    return {"answer": value["answer"], "sources": value["sources"], "retrieved": [],
+            "cached": {"similarity": round(similarity, 4)}}
+
+def cached_events(hit) -> Iterator[Dict]:
+    value, similarity = hit
+    yield {"event": "sources", "sources": value["sources"], "retrieved_count": 0,
+           "cached": {"similarity": round(similarity, 4)}}
+    yield {"event": "token", "text": value["answer"]}
+    yield {"event": "done"}
+
+async def _aretrieve(question: str, role: str, top_k: int, session: Optional[ConversationSession]):
+    """(results, question for the prompt, session info or None)"""
+    if session is None:
+        return await run_cpu(retrieve_for_role, question, role, top_k=top_k), question, None
+    return await run_cpu(retrieve_in_session, session, question, role, top_k)
+
+async def aanswer_query_with_rag(question: str, role: str, top_k: int = 5, max_new_tokens: int = 300, temperature: float = 0.2,
+                                 session: Optional[ConversationSession] = None):
+    """
+    Answer one question: retrieval runs on the CPU executor, generation is awaited
+    under the LLM concurrency limit, so the event loop never blocks.
+    Returns {"answer", "sources", "retrieved", "context"}.
+    With a session, follow-ups are retrieved through retrieve_in_session (and bypass the
+    answer cache, since their meaning depends on the conversation).
+    """
+    structured = await run_cpu(try_structured_answer, question, allowed_departments(role))
+    if structured:
+        if session is not None:
+            session.record_turn(question)
+        return structured_response(structured)
+    probe = None
+    if session is None or session.is_new:
+        probe = await run_cpu(lookup_answer, question, role, top_k, max_new_tokens, temperature)
+        if probe and probe["hit"]:
+            if session is not None:
+                session.record_turn(question)
+            return cached_response(probe["hit"])
+    results, prompt_question, session_info = await _aretrieve(question, role, top_k, session)
+    extra = {"session": session_info} if session_info else {}
     if not results:
-        return {
-            "answer": "No relevant documents found for your role.",
-            "sources": [],
-            "retrieved": []
-        }
-    context, sources = build_context_from_results(results)
-    # generate
-    answer_text = generate_answer(context, question, max_new_tokens=max_new_tokens, temperature=temperature)
-    return {
-        "answer": answer_text,
-        "sources": sources,
-        "retrieved": results
-    }
+        return {"answer": NO_RESULTS_ANSWER, "sources": [], "retrieved": [], **extra}
+    context, sources, report = await run_cpu(assemble_context, results)
+    with stage("generate"):
+        answer_text = await agenerate_answer(context, prompt_question, max_new_tokens=max_new_tokens, temperature=temperature)
+    remember_answer(probe, results, answer_text, sources)
+    return {"answer": answer_text, "sources": sources, "retrieved": results, "context": report, **extra}
+
+async def astream_query_with_rag(question: str, role: str, top_k: int = 5, max_new_tokens: int = 300, temperature: float = 0.2,
+                                 session: Optional[ConversationSession] = None) -> AsyncIterator[Dict]:
+    """
+    Streaming variant of aanswer_query_with_rag. Yields events:
+      {"event": "sources", "sources": [...], "retrieved_count": n}  as soon as retrieval finishes
+      {"event": "token", "text": "..."}                              for each generated fragment
+      {"event": "done"}
+    With a session, the sources event carries {"session": {"turn", "reused", "score"}}.
+    """
+    structured = await run_cpu(try_structured_answer, question, allowed_departments(role))
+    if structured:
+        if session is not None:
+            session.record_turn(question)
+        for event in structured_events(structured):
+            yield event
+        return
+    probe = None
+    if session is None or session.is_new:
+        probe = await run_cpu(lookup_answer, question, role, top_k, max_new_tokens, temperature)
+        if probe and probe["hit"]:
+            if session is not None:
+                session.record_turn(question)
+            for event in cached_events(probe["hit"]):
+                yield event
+            return
+    results, prompt_question, session_info = await _aretrieve(question, role, top_k, session)
+    extra = {"session": session_info} if session_info else {}
+    if not results:
+        yield {"event": "sources", "sources": [], "retrieved_count": 0, **extra}
+        yield {"event": "token", "text": NO_RESULTS_ANSWER}
+        yield {"event": "done"}
+        return
+    context, sources, report = await run_cpu(assemble_context, results)
+    yield {"event": "sources", "sources": sources, "retrieved_count": len(results), "context": report, **extra}
+    tokens = []
+    started = time.perf_counter()
+    async for token in astream_answer(context, prompt_question, max_new_tokens=max_new_tokens, temperature=temperature):
+        if not tokens:
+            record("first_token", time.perf_counter() - started)
+        tokens.append(token)
+        yield {"event": "token", "text": token}
+    record("generate", time.perf_counter() - started)
+    remember_answer(probe, results, "".join(tokens), sources)
+    yield {"event": "done"}
+
+def _prepare_batch(questions: List[str], role: str, top_k: int, max_new_tokens: int, temperature: float):
+    """
+    CPU half of a batch in one executor call: structured answers, one embedding pass for
+    the remaining questions, answer-cache probes, one multi-query retrieval for the misses.
+    Returns ({index: finished response}, [(index, probe, results) still to generate]).
+    """
+    allowed = allowed_departments(role)
+    ready: Dict[int, Dict] = {}
+    rest = []
+    for i, question in enumerate(questions):
+        structured = try_structured_answer(question, allowed)
+        if structured:
+            ready[i] = structured_response(structured)
+        else:
+            rest.append(i)
+    if rest and answer_cache.enabled:
+        with stage("embed_query"):
+            # Fills the query embedding cache, so the per-question probes below do not encode again
+            get_vector_store().embed_queries([questions[i] for i in rest])
+    probes, misses = {}, []
+    for i in rest:
+        probe = lookup_answer(questions[i], role, top_k, max_new_tokens, temperature)
+        if probe and probe["hit"]:
+            ready[i] = cached_response(probe["hit"])
+        else:
+            probes[i] = probe
+            misses.append(i)
+    pending = []
+    for i, results in zip(misses, retrieve_many_for_role([questions[i] for i in misses], role, top_k)):
+        if results:
+            pending.append((i, probes[i], results))
+        else:
+            ready[i] = {"answer": NO_RESULTS_ANSWER, "sources": [], "retrieved": []}
+    return ready, pending
+
+async def abatch_answer_queries(questions: List[str], role: str, top_k: int = 5, max_new_tokens: int = 300,
+                                temperature: float = 0.2, parallelism: int = CHAT_BATCH_PARALLELISM
+                                ) -> AsyncIterator[Tuple[int, Union[Dict, Exception]]]:
+    """
+    Answer several questions for one role. Embedding and retrieval are batched (see
+    _prepare_batch); generations run at most `parallelism` at a time. Yields
+    (index, response) as each item finishes, or (index, exception) for an item that
+    failed, so one bad question does not sink the rest.
+    """
+    ready, pending = await run_cpu(_prepare_batch, questions, role, top_k, max_new_tokens, temperature)
+    for i in sorted(ready):
+        yield i, ready[i]
+    sem = asyncio.Semaphore(max(1, parallelism))
+
+    async def one(i: int, probe: Optional[Dict], results: List[dict]):
+        async with sem:
+            try:
+                context, sources, report = await run_cpu(assemble_context, results)
+                with stage("generate"):
+                    answer_text = await agenerate_answer(context, questions[i], max_new_tokens=max_new_tokens,
+                                                         temperature=temperature)
+            except Exception as e:
+                return i, e
+        remember_answer(probe, results, answer_text, sources)
+        return i, {"answer": answer_text, "sources": sources, "retrieved": results, "context": report}
+
+    tasks = [asyncio.ensure_future(one(*p)) for p in pending]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        # Client went away mid-batch: stop the generations nobody will read
+        for task in tasks:
+            task.cancel()
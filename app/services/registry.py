@@ -0,0 +1,248 @@
+# app/services/registry.py
+# Process-wide, lazily created services shared by chat and ingest.
+# Nothing heavy happens at import time; the first caller (or warm_up) pays for it.
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from app.services.embedding import EmbeddingEngine, get_embedding_engine
+from app.services.vectorstore import BaseVectorStore, COLLECTION_NAME, PERSIST_DIR, VectorStore
+
+logger = logging.getLogger("finbot.registry")
+
+# blocking: warm up before serving; background: serve immediately, /ready is 503 until warm;
+# lazy: no warm-up, the first request loads everything
+WARMUP_MODE = os.getenv("WARMUP_MODE", "blocking").lower()
+# chroma: VectorStore (Chroma collection); numpy: NumpyVectorStore (per-department matrices);
+# snapshot: SnapshotVectorStore (read-only, memory-mapped export shared by all workers)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+
+# Collections written by background ingest jobs (blue/green): a small pointer file per backend
+# names the one readers use and the ones before it, for rollback. Every worker follows it.
+COLLECTION_POINTER_DIR = os.getenv("COLLECTION_POINTER_DIR", PERSIST_DIR)
+# Collections kept around for rollback, besides the active one
+COLLECTION_KEEP_PREVIOUS = int(os.getenv("COLLECTION_KEEP_PREVIOUS", "1"))
+# Seconds between checks of the pointer file, so workers pick up swaps and rollbacks made by
+# another process (0: read it only at start-up)
+COLLECTION_POINTER_POLL = float(os.getenv("COLLECTION_POINTER_POLL", "2"))
+# Seconds an old collection stays on disk after leaving the pointer, so every worker has
+# switched away from it and finished its requests before it is dropped
+COLLECTION_DROP_GRACE = float(os.getenv("COLLECTION_DROP_GRACE", "300"))
+
+_store: Optional[BaseVectorStore] = None
+_store_lock = threading.Lock()
+# Pointer file version the shared store was opened from, and when it was last checked
+_pointer_seen = {"mtime": None, "checked": 0.0}
+
+_state = {"status": "cold", "stages": {}, "error": None}
+_state_lock = threading.Lock()
+
+
+def _pointer_path(backend: str) -> str:
+    return os.path.join(COLLECTION_POINTER_DIR, f"active_collection.{backend}.json")
+
+
+def collection_pointer(backend: str = VECTOR_BACKEND) -> Dict:
+    """
+    {"active": name, "history": [older names, newest first], "retired": [{"name", "at"}]} for a
+    chroma or numpy backend. Retired collections are waiting out COLLECTION_DROP_GRACE.
+    """
+    try:
+        with open(_pointer_path(backend), "r", encoding="utf-8") as f:
+            pointer = json.load(f)
+    except FileNotFoundError:
+        pointer = {}
+    return {"active": pointer.get("active", COLLECTION_NAME), "history": list(pointer.get("history", [])),
+            "retired": list(pointer.get("retired", []))}
+
+
+def _pointer_mtime(backend: str = VECTOR_BACKEND) -> Optional[int]:
+    try:
+        return os.stat(_pointer_path(backend)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _write_pointer(backend: str, pointer: Dict):
+    path = _pointer_path(backend)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({**pointer, "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S")}, f, indent=2)
+    os.replace(tmp, path)
+
+
+def create_vector_store(backend: str = VECTOR_BACKEND, **kwargs) -> BaseVectorStore:
+    if backend in ("chroma", "numpy"):
+        kwargs.setdefault("collection_name", collection_pointer(backend)["active"])
+    if backend == "chroma":
+        return VectorStore(engine=get_embedding_engine(), **kwargs)
+    if backend == "numpy":
+        from app.services.numpy_store import NumpyVectorStore
+        return NumpyVectorStore(engine=get_embedding_engine(), **kwargs)
+    if backend == "snapshot":
+        from app.services.snapshot import SnapshotVectorStore
+        return SnapshotVectorStore(engine=get_embedding_engine(), **kwargs)
+    raise ValueError(f"Unknown VECTOR_BACKEND {backend!r} (expected 'chroma', 'numpy' or 'snapshot')")
+
+
+def get_vector_store() -> BaseVectorStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _pointer_seen["mtime"] = _pointer_mtime()
+                _store = create_vector_store()
+    elif COLLECTION_POINTER_POLL > 0 and VECTOR_BACKEND in ("chroma", "numpy"):
+        _follow_pointer()
+    return _store
+
+
+def _follow_pointer():
+    """Switch to the collection the pointer names if another process changed it since we looked."""
+    global _store
+    now = time.monotonic()
+    if now - _pointer_seen["checked"] < COLLECTION_POINTER_POLL:
+        return
+    _pointer_seen["checked"] = now
+    mtime = _pointer_mtime()
+    if mtime == _pointer_seen["mtime"]:
+        return
+    with _store_lock:
+        _pointer_seen["mtime"] = mtime
+        active = collection_pointer()["active"]
+        if _store is None or _store.collection_name == active:
+            return
+        old, _store = _store, create_vector_store(collection_name=active)
+    logger.info("Following the pointer file: active %s collection is now %s", VECTOR_BACKEND, active)
+    old.close()
+
+
+def set_vector_store(store: Optional[BaseVectorStore]):
+    """Swap the shared store (tests, benchmarks); None resets to lazy creation."""
+    global _store
+    with _store_lock:
+        _pointer_seen["mtime"] = _pointer_mtime()
+        old, _store = _store, store
+    if old is not None and old is not store:
+        old.close()
+
+
+def activate_collection(store: BaseVectorStore, backend: str = VECTOR_BACKEND) -> Dict:
+    """
+    Make `store` the one every reader in this process uses and record it in the pointer file,
+    which other workers follow within COLLECTION_POINTER_POLL seconds. Requests already holding
+    the previous store finish against it; new ones see only `store`. Returns the new pointer.
+    """
+    global _store
+    with _store_lock:
+        pointer = collection_pointer(backend)
+        if store.collection_name != pointer["active"]:
+            history = [pointer["active"]] + [n for n in pointer["history"] if n != store.collection_name]
+            pointer = {**pointer, "active": store.collection_name, "history": history}
+            _write_pointer(backend, pointer)
+        _pointer_seen["mtime"] = _pointer_mtime(backend)
+        old, _store = _store, store
+    logger.info("Active %s collection is now %s", backend, store.collection_name)
+    if old is not None and old is not store:
+        old.close()
+    return pointer
+
+
+def rollback_collection(backend: str = VECTOR_BACKEND) -> Dict:
+    """Switch readers back to the previously active collection. Raises LookupError if there is none."""
+    global _store
+    with _store_lock:
+        pointer = collection_pointer(backend)
+        if not pointer["history"]:
+            raise LookupError(f"No previous {backend} collection to roll back to")
+        previous, *older = pointer["history"]
+        store = create_vector_store(backend, collection_name=previous)
+        pointer = {**pointer, "active": previous, "history": [pointer["active"]] + older}
+        _write_pointer(backend, pointer)
+        _pointer_seen["mtime"] = _pointer_mtime(backend)
+        old, _store = _store, store
+    logger.warning("Rolled back the %s collection to %s", backend, previous)
+    if old is not None:
+        old.close()
+    return pointer
+
+
+def prune_collections(backend: str = VECTOR_BACKEND, keep: int = COLLECTION_KEEP_PREVIOUS,
+                      grace: float = COLLECTION_DROP_GRACE) -> list:
+    """
+    Retire collections older than the `keep` most recent previous ones, and drop those retired
+    at least `grace` seconds ago: other workers have followed the pointer away from them by then.
+    Returns the dropped names.
+    """
+    now = time.time()
+    with _store_lock:
+        pointer = collection_pointer(backend)
+        retired = pointer["retired"] + [{"name": n, "at": now} for n in pointer["history"][keep:]]
+        dropped = [r["name"] for r in retired if now - r["at"] >= grace]
+        if len(retired) > len(pointer["retired"]) or dropped:
+            _write_pointer(backend, {"active": pointer["active"], "history": pointer["history"][:keep],
+                                     "retired": [r for r in retired if now - r["at"] < grace]})
+    for name in dropped:
+        try:
+            create_vector_store(backend, collection_name=name).drop()
+            logger.info("Dropped old %s collection %s", backend, name)
+        except Exception:
+            logger.exception("Could not drop old %s collection %s", backend, name)
+    return dropped
+
+
+def _timed(stages: Dict[str, float], name: str, fn):
+    t0 = time.perf_counter()
+    result = fn()
+    stages[name] = round((time.perf_counter() - t0) * 1000, 1)
+    logger.info("Startup stage %s took %.1f ms", name, stages[name])
+    return result
+
+
+def warm_up() -> Dict:
+    """
+    Load the embedding model, open the vector store, run one encode and load the
+    generation tokenizer so the first real request does not pay for lazy initialisation. Idempotent.
+    Returns the readiness state including per-stage timings in milliseconds.
+    """
+    with _state_lock:
+        if _state["status"] in ("warming", "ready"):
+            return readiness()
+        _state.update(status="warming", error=None)
+    stages: Dict[str, float] = {}
+    try:
+        engine: EmbeddingEngine = _timed(stages, "load_embedding_model", get_embedding_engine)
+        _timed(stages, "open_vector_store", get_vector_store)
+        _timed(stages, "warm_encode", lambda: engine.encode(["warm-up"]))
+        from app.services.context import approx_token_count, load_generation_token_counter
+        if _timed(stages, "load_generation_tokenizer", load_generation_token_counter) is approx_token_count:
+            logger.warning("Warm-up could not load the generation tokenizer; serving with approximate context budgets")
+        stages["total"] = round(sum(stages.values()), 1)
+        with _state_lock:
+            _state.update(status="ready", stages=stages)
+    except Exception as e:
+        logger.exception("Warm-up failed")
+        with _state_lock:
+            _state.update(status="failed", stages=stages, error=str(e))
+    return readiness()
+
+
+def start_background_warm_up() -> threading.Thread:
+    t = threading.Thread(target=warm_up, name="finbot-warmup", daemon=True)
+    t.start()
+    return t
+
+
+def readiness() -> Dict:
+    with _state_lock:
+        return {"status": _state["status"], "mode": WARMUP_MODE,
+                "stages_ms": dict(_state["stages"]), "error": _state["error"]}
+
+
+def is_ready() -> bool:
+    # In lazy mode there is nothing to wait for: the first request initialises on demand
+    return _state["status"] == "ready" or (WARMUP_MODE == "lazy" and _state["status"] != "failed")
@@ -0,0 +1,122 @@
+# app/services/sessions.py
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.cache import TTLCache, index_generation
+
+# Retrieved chunks (with embeddings) kept per conversation for answering follow-ups
+SESSION_MAX_CHUNKS = int(os.getenv("SESSION_MAX_CHUNKS", "40"))
+# Mean cosine similarity the best cached chunks must reach to skip a new vector query
+SESSION_REUSE_THRESHOLD = float(os.getenv("SESSION_REUSE_THRESHOLD", "0.5"))
+# Earlier questions folded into a follow-up's retrieval text and prompt
+SESSION_HISTORY_TURNS = int(os.getenv("SESSION_HISTORY_TURNS", "2"))
+
+# username -> ConversationSession: LRU beyond SESSION_MAX_SESSIONS, dropped after SESSION_IDLE_TTL
+# seconds without a turn. Worst-case memory is about MAX_SESSIONS * MAX_CHUNKS chunks.
+sessions = TTLCache(
+    "session",
+    maxsize=int(os.getenv("SESSION_MAX_SESSIONS", "500")),
+    ttl=float(os.getenv("SESSION_IDLE_TTL", "1800")),
+)
+
+
+class ConversationSession:
+    """
+    One user's conversation: the last few questions and an LRU working set of the chunks
+    retrieved for them. Chunks come from the user's own retrievals, so they are already
+    restricted to the role's departments; the set is dropped when the index changes.
+    """
+
+    def __init__(self, username: str, role: str, max_chunks: int = SESSION_MAX_CHUNKS,
+                 history_turns: int = SESSION_HISTORY_TURNS):
+        self.username = username
+        self.role = role
+        self.max_chunks = max_chunks
+        self.questions: deque = deque(maxlen=history_turns)
+        self.chunks: "OrderedDict[str, Dict]" = OrderedDict()
+        self.generation = index_generation.value
+        self.turns = 0
+        self.reused = 0
+        self.queried = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_new(self) -> bool:
+        return not self.questions
+
+    def retrieval_text(self, question: str) -> str:
+        # "and what about Q3?" means little on its own; prefix the questions it follows
+        with self._lock:
+            return " ".join([*self.questions, question])
+
+    def prompt_question(self, question: str) -> str:
+        with self._lock:
+            if not self.questions:
+                return question
+            earlier = "\n".join(f"- {q}" for q in self.questions)
+        return f"Earlier questions:\n{earlier}\nFollow-up: {question}"
+
+    def candidates(self, q_emb: np.ndarray, top_k: int) -> Tuple[List[Dict], float]:
+        """Best top_k cached chunks for q_emb (best first) and their mean cosine similarity."""
+        with self._lock:
+            if self.generation != index_generation.value:
+                self.chunks.clear()
+                self.generation = index_generation.value
+            items = list(self.chunks.values())
+        if not items or top_k <= 0:
+            return [], 0.0
+        m = np.stack([r["embedding"] for r in items]).astype(np.float32)
+        m /= np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+        q = np.asarray(q_emb, dtype=np.float32)
+        scores = m @ (q / max(float(np.linalg.norm(q)), 1e-12))
+        order = np.argsort(-scores)[:top_k]
+        picked = [dict(items[i], distance=1.0 - float(scores[i])) for i in order]
+        return picked, float(scores[order].mean())
+
+    def remember(self, results: List[Dict]):
+        """Add (or refresh) chunks in the working set, evicting the least recently used."""
+        with self._lock:
+            for r in results:
+                if r.get("embedding") is None:
+                    continue
+                self.chunks[r["id"]] = r
+                self.chunks.move_to_end(r["id"])
+            while len(self.chunks) > self.max_chunks:
+                self.chunks.popitem(last=False)
+
+    def record_turn(self, question: str, reused: Optional[bool] = None):
+        with self._lock:
+            self.questions.append(question)
+            self.turns += 1
+            if reused is True:
+                self.reused += 1
+            elif reused is False:
+                self.queried += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            approx = sum(len(r.get("document", "")) + np.asarray(r["embedding"]).nbytes for r in self.chunks.values())
+            return {"role": self.role, "turns": self.turns, "chunks": len(self.chunks),
+                    "max_chunks": self.max_chunks, "reused_retrievals": self.reused,
+                    "vector_queries": self.queried, "approx_bytes": int(approx)}
+
+
+def get_session(username: str, role: str) -> ConversationSession:
+    """The user's session, created on first use or after a role change; restarts its idle clock."""
+    session = sessions.get(username)
+    if session is None or session.role != role:
+        session = ConversationSession(username, role)
+    sessions.set(username, session)
+    return session
+
+
+def peek_session(username: str) -> Optional[ConversationSession]:
+    return sessions.get(username)
+
+
+def end_session(username: str) -> bool:
+    return sessions.pop(username) is not None
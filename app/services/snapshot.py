@@ -0,0 +1,267 @@
+# app/services/snapshot.py
+# Immutable, versioned index snapshots: every worker memory-maps the same files read-only,
+# so they share one copy in the page cache and open it in milliseconds. Layout:
+#   <SNAPSHOT_DIR>/CURRENT                  name of the version servers open
+#   <SNAPSHOT_DIR>/<version>/vectors.npy    float32 (n, dim) unit vectors, rows grouped by department
+#   <SNAPSHOT_DIR>/<version>/records.bin    one UTF-8 JSON {"id", "document", "metadata"} per row
+#   <SNAPSHOT_DIR>/<version>/offsets.npy    int64 (n + 1) byte offsets of each row in records.bin
+#   <SNAPSHOT_DIR>/<version>/manifest.json  rows, dim, model, department row ranges, sha256 per file
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import time
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from app.services.embedding import EmbeddingEngine
+from app.services.numpy_store import NumpyVectorStore, Partition, normalize_rows
+from app.services.vectorstore import BaseVectorStore, PERSIST_DIR
+
+load_dotenv()
+
+logger = logging.getLogger("finbot.snapshot")
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(PERSIST_DIR, "snapshots"))
+# Version to open; empty = the one named in <SNAPSHOT_DIR>/CURRENT
+SNAPSHOT_VERSION = os.getenv("SNAPSHOT_VERSION", "")
+# size: check file sizes against the manifest at open (instant); sha256: hash every file (reads it all)
+SNAPSHOT_VERIFY = os.getenv("SNAPSHOT_VERIFY", "size").lower()
+# Decoded records.bin rows kept per open snapshot (a result reads id, document and metadata of a row)
+SNAPSHOT_ROW_CACHE = int(os.getenv("SNAPSHOT_ROW_CACHE", "1024"))
+SNAPSHOT_FORMAT = "finbot-snapshot-v1"
+SNAPSHOT_FILES = ("vectors.npy", "records.bin", "offsets.npy")
+
+
+class SnapshotError(RuntimeError):
+    pass
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+Page = Tuple[List[str], List[str], List[Dict], np.ndarray]
+
+
+def iter_store(store: BaseVectorStore, page_size: int = 1024) -> Iterator[Page]:
+    """
+    (ids, documents, metadatas, embeddings) of a chroma or numpy store, at most page_size rows
+    at a time: Chroma is read with limit/offset, numpy one partition slice at a time.
+    """
+    if isinstance(store, NumpyVectorStore):
+        for part in list(store.partitions.values()):
+            for start in range(0, len(part.ids), page_size):
+                end = start + page_size
+                yield (list(part.ids[start:end]), list(part.documents[start:end]), list(part.metadatas[start:end]),
+                       np.asarray(part.matrix[start:end], dtype=np.float32))
+        return
+    offset = 0
+    while True:
+        page = store.collection.get(include=["documents", "metadatas", "embeddings"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            return
+        yield (list(page["ids"]), list(page["documents"]), list(page["metadatas"]),
+               np.asarray(page["embeddings"], dtype=np.float32))
+        offset += len(page["ids"])
+
+
+def dump_store(store: BaseVectorStore) -> Page:
+    """All (ids, documents, metadatas, embeddings) of a chroma or numpy store."""
+    ids, docs, metas, blocks = [], [], [], []
+    for page_ids, page_docs, page_metas, page_embs in iter_store(store):
+        ids.extend(page_ids)
+        docs.extend(page_docs)
+        metas.extend(page_metas)
+        blocks.append(page_embs)
+    dim = blocks[0].shape[1] if blocks else store.engine.dim
+    return ids, docs, metas, np.vstack(blocks) if blocks else np.empty((0, dim), dtype=np.float32)
+
+
+def export_snapshot(store: BaseVectorStore, root: str = SNAPSHOT_DIR, activate: bool = True) -> Dict:
+    """
+    Write the store's contents as a new snapshot version and, if activate, point CURRENT at it.
+    Files are written to a temporary directory and renamed into place, so a version directory
+    is either complete or absent. Returns the manifest.
+    """
+    ids, docs, metas, embeddings = dump_store(store)
+    if not ids:
+        raise SnapshotError("Nothing to export: the store is empty")
+    order = sorted(range(len(ids)), key=lambda i: (metas[i].get("department", "unknown"), ids[i]))
+    created = time.strftime("%Y%m%d-%H%M%S")
+    tmp = os.path.join(root, f".tmp-{created}-{os.getpid()}")
+    os.makedirs(tmp)
+    try:
+        vectors = np.ascontiguousarray(normalize_rows(embeddings[order]), dtype=np.float32)
+        np.save(os.path.join(tmp, "vectors.npy"), vectors)
+        offsets = np.empty(len(order) + 1, dtype=np.int64)
+        departments: Dict[str, List[int]] = {}
+        with open(os.path.join(tmp, "records.bin"), "wb") as f:
+            pos = 0
+            for row, i in enumerate(order):
+                dept = metas[i].get("department", "unknown")
+                departments.setdefault(dept, [row, row])[1] = row + 1
+                offsets[row] = pos
+                blob = json.dumps({"id": ids[i], "document": docs[i], "metadata": metas[i]},
+                                  ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                f.write(blob)
+                pos += len(blob)
+            offsets[-1] = pos
+        np.save(os.path.join(tmp, "offsets.npy"), offsets)
+        files = {name: {"sha256": file_sha256(os.path.join(tmp, name)), "bytes": os.path.getsize(os.path.join(tmp, name))}
+                 for name in SNAPSHOT_FILES}
+        version = f"{created}-{files['vectors.npy']['sha256'][:8]}"
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "version": version,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "rows": len(order),
+            "dim": int(vectors.shape[1]),
+            "model": store.engine.model_name,
+            "departments": departments,
+            "files": files,
+        }
+        with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, os.path.join(root, version))
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    if activate:
+        activate_snapshot(version, root)
+    logger.info("Exported snapshot %s: %d rows in %d departments", version, len(order), len(departments))
+    return manifest
+
+
+def activate_snapshot(version: str, root: str = SNAPSHOT_DIR):
+    """Point CURRENT at version (atomic rename); servers pick it up when they next start."""
+    if not os.path.exists(os.path.join(root, version, "manifest.json")):
+        raise SnapshotError(f"No snapshot {version!r} in {root}")
+    tmp = os.path.join(root, "CURRENT.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+    os.replace(tmp, os.path.join(root, "CURRENT"))
+
+
+def current_version(root: str = SNAPSHOT_DIR) -> Optional[str]:
+    try:
+        with open(os.path.join(root, "CURRENT"), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def list_snapshots(root: str = SNAPSHOT_DIR) -> List[Dict]:
+    out = []
+    if os.path.isdir(root):
+        for name in sorted(os.listdir(root)):
+            path = os.path.join(root, name, "manifest.json")
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    m = json.load(f)
+                out.append({k: m[k] for k in ("version", "created_at", "rows", "dim", "model")})
+    return out
+
+
+def verify_snapshot(path: str, manifest: Dict, mode: str = "sha256"):
+    """Raise SnapshotError unless every file matches the manifest (sizes, and hashes for sha256)."""
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"Unsupported snapshot format {manifest.get('format')!r}")
+    for name, expected in manifest["files"].items():
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path) or os.path.getsize(file_path) != expected["bytes"]:
+            raise SnapshotError(f"{name} is missing or truncated in {path}")
+        if mode == "sha256" and file_sha256(file_path) != expected["sha256"]:
+            raise SnapshotError(f"{name} checksum mismatch in {path}")
+
+
+class SnapshotRows:
+    """Rows of records.bin, JSON-decoded on access; recent rows stay decoded, shared by every field."""
+
+    def __init__(self, data: mmap.mmap, offsets: np.ndarray, cache_size: int = SNAPSHOT_ROW_CACHE):
+        self.data = data
+        self.offsets = offsets
+        self.get = lru_cache(maxsize=cache_size)(self._decode)
+
+    def _decode(self, i: int) -> Dict:
+        return json.loads(self.data[int(self.offsets[i]):int(self.offsets[i + 1])])
+
+
+class SnapshotRecords:
+    """Read-only sequence over one field of rows [start, end) of a SnapshotRows."""
+
+    def __init__(self, rows: SnapshotRows, start: int, end: int, field: str):
+        self.rows = rows
+        self.start = start
+        self.end = end
+        self.field = field
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __getitem__(self, row: int):
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return self.rows.get(self.start + row)[self.field]
+
+    def __iter__(self):
+        return (self[r] for r in range(len(self)))
+
+
+class SnapshotVectorStore(NumpyVectorStore):
+    """
+    Read-only NumpyVectorStore over a snapshot: one Partition per department whose matrix is
+    a slice of the shared memory-mapped vectors.npy and whose ids/documents/metadatas are
+    decoded from records.bin only for the rows a query returns. Writes raise SnapshotError.
+    """
+    read_only = True
+
+    def __init__(self, root: str = SNAPSHOT_DIR, version: str = SNAPSHOT_VERSION,
+                 engine: Optional[EmbeddingEngine] = None, verify: str = SNAPSHOT_VERIFY, **kwargs):
+        BaseVectorStore.__init__(self, engine)
+        self.version = version or current_version(root)
+        if not self.version:
+            raise SnapshotError(f"No snapshot in {root}; export one with `python -m scripts.snapshot export`")
+        self.root = os.path.join(root, self.version)
+        with open(os.path.join(self.root, "manifest.json"), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if verify in ("size", "sha256"):
+            verify_snapshot(self.root, self.manifest, verify)
+        if self.manifest["model"] != self.engine.model_name:
+            logger.warning("Snapshot %s was built with %s but queries use %s", self.version,
+                           self.manifest["model"], self.engine.model_name)
+        self.quantization = "none"
+        self.rerank_factor = 1
+        self.mmap = True
+        self.manifest_path = ""
+        matrix = np.load(os.path.join(self.root, "vectors.npy"), mmap_mode="r")
+        offsets = np.load(os.path.join(self.root, "offsets.npy"), mmap_mode="r")
+        with open(os.path.join(self.root, "records.bin"), "rb") as f:
+            self._records = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        rows = SnapshotRows(self._records, offsets)
+        self.partitions: Dict[str, Partition] = {}
+        for dept, (start, end) in self.manifest["departments"].items():
+            self.partitions[dept] = Partition(
+                matrix[start:end],
+                *(SnapshotRecords(rows, start, end, field) for field in ("id", "document", "metadata")),
+            )
+        logger.info("Opened snapshot %s: %d rows", self.version, self.manifest["rows"])
+
+    def upsert_embedded(self, docs: List[Dict], embeddings: np.ndarray):
+        raise SnapshotError("Snapshot indexes are read-only; ingest into chroma or numpy and export a new snapshot")
+
+    def delete_ids(self, ids: List[str]):
+        if ids:
+            raise SnapshotError("Snapshot indexes are read-only; ingest into chroma or numpy and export a new snapshot")
+
+    def persist(self):
+        pass
@@ -0,0 +1,256 @@
+# app/services/tabular.py
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from app.services.cache import index_generation
+from app.services.metrics import stage
+from app.utils.loader import BASE_PATH, iter_documents
+
+logger = logging.getLogger("finbot.tabular")
+
+# Route tabular questions (lookups, filters, aggregates over CSV sources) away from RAG
+STRUCTURED_QUERY = os.getenv("STRUCTURED_QUERY", "true").lower() in ("1", "true", "yes")
+# Categorical columns with at most this many distinct values are used as filters
+MAX_FILTER_CARDINALITY = int(os.getenv("STRUCTURED_MAX_FILTER_CARDINALITY", "200"))
+MAX_LISTED_ROWS = 20
+
+AGGREGATES = [
+    ("mean", re.compile(r"\b(average|avg|mean)\b")),
+    ("sum", re.compile(r"\b(total|sum)\b(?!\s+(?:number|count)\b)")),
+    ("max", re.compile(r"\b(max|maximum|highest|most|top)\b")),
+    ("min", re.compile(r"\b(min|minimum|lowest|least)\b")),
+    ("count", re.compile(r"\b(how many|count|headcount|number of)\b")),
+]
+REPORTS_TO_RE = re.compile(r"\b(reports? to|reporting to|direct reports|works? under|team of)\b")
+MANAGER_OF_RE = re.compile(r"\b(manager|boss|supervisor|reports? to whom)\b")
+GROUP_BY_RE = re.compile(r"\b(?:by|per|for each|each)\s+([a-z_ ]+)")
+GENERIC_WORDS = {"id", "pct", "date", "of", "the", "data"}
+# A count is tabular only when what it counts is a table's subject: its name, rows/records, or
+# for tables of people one of these, so "how many employees ..." counts rows of hr_data.csv but
+# "how many sick days ..." or "how many campaigns ..." does not
+PEOPLE_WORDS = {"employee", "employees", "staff", "people", "person", "persons", "headcount", "team", "workers"}
+COUNTED_RE = re.compile(r"\b(?:how many|number of|count of|count)\s+(?:the\s+|all\s+)?([a-z]+)")
+
+
+def _words(text: str) -> set:
+    return set(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+class Table:
+    """One CSV source held column-wise in a DataFrame, with hash indexes on its ID columns."""
+
+    def __init__(self, department: str, source: str, df: pd.DataFrame):
+        self.department = department
+        self.source = source
+        self.df = df
+        self.id_columns = [c for c in df.columns if c.lower() == "id" or c.lower().endswith("_id")]
+        # value -> row positions, for O(1) lookups on any ID column (e.g. employee_id, manager_id)
+        self.indexes: Dict[str, Dict[str, List[int]]] = {
+            c: {k: list(v) for k, v in df.groupby(c, sort=False).indices.items()} for c in self.id_columns
+        }
+        self.numeric_columns = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+        self.name_column = next((c for c in df.columns if "name" in c.lower()), None)
+        self.filter_values: List[Tuple[str, str]] = []  # (value, column), longest first
+        for c in df.columns:
+            if c in self.id_columns or c in self.numeric_columns or c == self.name_column:
+                continue
+            values = df[c].dropna().astype(str).unique()
+            if 0 < len(values) <= MAX_FILTER_CARDINALITY:
+                self.filter_values.extend((v, c) for v in values if len(v) > 2)
+        self.filter_values.sort(key=lambda vc: -len(vc[0]))
+        self.primary_key = self.id_columns[0] if self.id_columns else None
+        self.subjects = (_words(source.rsplit(".", 1)[0].replace("_", " ")) - GENERIC_WORDS) | {"rows", "records"}
+        column_words = set().union(*(_words(c.replace("_", " ")) for c in df.columns))
+        if self.name_column or column_words & PEOPLE_WORDS:
+            self.subjects |= PEOPLE_WORDS
+
+    def label(self, pos: int) -> str:
+        row = self.df.iloc[pos]
+        key = row[self.primary_key] if self.primary_key else pos
+        return f"{row[self.name_column]} ({key})" if self.name_column else str(key)
+
+    def rows_where(self, column: str, value: str) -> List[int]:
+        if column in self.indexes:
+            return self.indexes[column].get(value, [])
+        return list(self.df.index[self.df[column].astype(str) == value])
+
+
+class TabularEngine:
+    """
+    Answers lookups, filters and aggregates over CSV sources directly, in-process.
+    Tables are loaded lazily and reloaded after ingest bumps the index generation.
+    Only tables from the caller's allowed departments are ever consulted.
+    """
+
+    def __init__(self, base_path: str = BASE_PATH):
+        self.base_path = base_path
+        self.tables: List[Table] = []
+        self._generation = -1
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self._generation == index_generation.value:
+            return
+        with self._lock:
+            if self._generation == index_generation.value:
+                return
+            tables = []
+            for doc in iter_documents(self.base_path):
+                if doc["kind"] == "csv":
+                    df = pd.read_csv(doc["path"])
+                    df.columns = [str(c).strip() for c in df.columns]
+                    tables.append(Table(doc["department"], doc["source"], df))
+            self.tables = tables
+            self._generation = index_generation.value
+            logger.info("Loaded %d tabular sources", len(tables))
+
+    def try_answer(self, question: str, allowed: List[str]) -> Optional[Dict]:
+        """
+        Returns {"answer", "sources", "result"} when the question is a tabular intent over a
+        table the caller may see, otherwise None (caller falls back to RAG).
+        """
+        self._ensure_loaded()
+        q = question.lower()
+        for table in self.tables:
+            if table.department not in allowed:
+                continue
+            result = self._answer_lookup(table, question, q) or self._answer_aggregate(table, q)
+            if result is not None:
+                result["sources"] = [table.source]
+                return result
+        return None
+
+    # -------------------------
+    # ID / name lookups
+    # -------------------------
+    def _find_entity(self, table: Table, question: str, q: str) -> Optional[int]:
+        for token in re.findall(r"[A-Za-z0-9_-]+", question):
+            for col in table.id_columns:
+                rows = table.indexes[col].get(token) or table.indexes[col].get(token.upper())
+                if rows:
+                    pk_rows = table.rows_where(table.primary_key, table.df.iloc[rows[0]][col])
+                    return pk_rows[0] if pk_rows else rows[0]
+        if table.name_column:
+            names = table.df[table.name_column].astype(str)
+            hits = [i for i, n in enumerate(names) if n.lower() in q]
+            if hits:
+                return max(hits, key=lambda i: len(names.iloc[i]))
+        return None
+
+    def _answer_lookup(self, table: Table, question: str, q: str) -> Optional[Dict]:
+        if not table.primary_key:
+            return None
+        pos = self._find_entity(table, question, q)
+        if pos is None:
+            return None
+        key = table.df.iloc[pos][table.primary_key]
+        manager_col = next((c for c in table.id_columns if "manager" in c.lower()), None)
+        if manager_col and REPORTS_TO_RE.search(q):
+            reports = table.rows_where(manager_col, key)
+            names = [table.label(r) for r in reports if r != pos]
+            answer = (f"{len(names)} people report to {table.label(pos)}: " + ", ".join(names[:MAX_LISTED_ROWS])
+                      if names else f"Nobody reports to {table.label(pos)}.")
+            return {"answer": answer, "result": {"type": "reports_to", "key": key, "rows": names}}
+        if manager_col and MANAGER_OF_RE.search(q):
+            manager = table.df.iloc[pos][manager_col]
+            mrows = table.rows_where(table.primary_key, manager)
+            label = table.label(mrows[0]) if mrows else manager
+            return {"answer": f"{table.label(pos)} reports to {label}.",
+                    "result": {"type": "manager_of", "key": key, "manager": manager}}
+        record = {c: (v.item() if hasattr(v, "item") else v) for c, v in table.df.iloc[pos].items()}
+        asked = [c for c in table.df.columns if (_words(c.replace("_", " ")) - GENERIC_WORDS) & _words(q)
+                 and c != table.primary_key]
+        shown = {c: record[c] for c in asked} if asked else record
+        answer = f"{table.label(pos)}: " + "; ".join(f"{c}: {v}" for c, v in shown.items())
+        return {"answer": answer, "result": {"type": "lookup", "key": key, "record": record}}
+
+    # -------------------------
+    # Filters and aggregates
+    # -------------------------
+    def _answer_aggregate(self, table: Table, q: str) -> Optional[Dict]:
+        agg = next((name for name, rx in AGGREGATES if rx.search(q)), None)
+        if agg is None:
+            return None
+        words = _words(q)
+        column = None
+        if agg == "count":
+            # Counts are of rows: the question must count the table's subject
+            counted = COUNTED_RE.search(q)
+            if not (counted and counted.group(1) in table.subjects) and "headcount" not in words & table.subjects:
+                return None
+        else:
+            # Other aggregates need a numeric column named in full ("leave" alone is not leave_balance)
+            named = [(len(parts), c) for c in table.numeric_columns
+                     for parts in [_words(c.replace("_", " ")) - GENERIC_WORDS] if parts and parts <= words]
+            if not named:
+                return None
+            column = max(named)[1]
+
+        filters, mask, taken = [], pd.Series(True, index=table.df.index), q
+        for value, col in table.filter_values:
+            if re.search(rf"\b{re.escape(value.lower())}\b", taken):
+                filters.append((col, value))
+                mask &= table.df[col].astype(str) == value
+                taken = taken.replace(value.lower(), " ")
+        frame = table.df[mask]
+
+        group_col = None
+        m = GROUP_BY_RE.search(q)
+        if m:
+            target = _words(m.group(1))
+            group_col = next((c for c in table.df.columns if c not in table.numeric_columns
+                              and _words(c.replace("_", " ")) & target and c != column), None)
+
+        where = " where " + " and ".join(f"{c} = {v}" for c, v in filters) if filters else ""
+        if group_col:
+            grouped = frame.groupby(group_col)
+            series = grouped.size() if column is None else getattr(grouped[column], agg)()
+            series = series.round(2).sort_values(ascending=False)
+            values = {str(k): (v.item() if hasattr(v, "item") else v) for k, v in series.items()}
+            label = "count" if column is None else f"{agg} of {column}"
+            answer = f"{label} by {group_col}{where}: " + ", ".join(f"{k}: {v}" for k, v in values.items())
+            return {"answer": answer, "result": {"type": "aggregate", "agg": agg, "column": column,
+                                                 "group_by": group_col, "filters": filters, "values": values}}
+
+        if column is None or agg == "count":
+            value = int(len(frame))
+            answer = f"Count of rows{where}: {value}."
+        else:
+            raw = getattr(frame[column], agg)() if len(frame) else None
+            value = None if raw is None or pd.isna(raw) else round(float(raw), 2)
+            answer = f"{agg} of {column}{where}: {value} (over {len(frame)} rows)."
+            if agg in ("max", "min") and len(frame) and value is not None:
+                pos = int(table.df.index.get_loc(frame[column].idxmax() if agg == "max" else frame[column].idxmin()))
+                answer += f" Held by {table.label(pos)}."
+        return {"answer": answer, "result": {"type": "aggregate", "agg": agg, "column": column,
+                                             "filters": filters, "rows": int(len(frame)), "value": value}}
+
+
+_engine: Optional[TabularEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_tabular_engine() -> TabularEngine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = TabularEngine()
+    return _engine
+
+
+def try_structured_answer(question: str, allowed: List[str]) -> Optional[Dict]:
+    if not STRUCTURED_QUERY:
+        return None
+    try:
+        with stage("structured"):
+            return get_tabular_engine().try_answer(question, allowed)
+    except Exception:
+        # Never fail a chat because of the fast path; RAG still answers
+        logger.exception("Structured query failed; falling back to RAG")
+        return None
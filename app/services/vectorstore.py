@@ -1,69 +1,215 @@
 # app/services/vectorstore.py
 import os
-from typing import List, Dict
-from langchain.embeddings import HuggingFaceEmbeddings
-from sentence_transformers import SentenceTransformer
-import chromadb
-from chromadb.config import Settings
+import threading
+from typing import List, Dict, Optional, Union
+import numpy as np
+
+from app.services.embedding import EmbeddingEngine, get_embedding_engine
+from app.services.cache import TTLCache, index_generation, normalize_query
+from app.services.batcher import QUERY_BATCH_WINDOW_MS, QueryBatcher
+from app.services.metrics import stage
 
 from dotenv import load_dotenv
 load_dotenv()
 
 PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db")
-EMBED_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
 COLLECTION_NAME = "company_docs"
+# Overrides where the incremental-ingest manifest for the default store lives
+INGEST_MANIFEST_PATH = os.getenv("INGEST_MANIFEST_PATH")
 
-class VectorStore:
-    def __init__(self, persist_directory: str = PERSIST_DIR, collection_name: str = COLLECTION_NAME):
-        os.makedirs(persist_directory, exist_ok=True)
-        self.client = chromadb.Client(Settings(
-            chroma_db_impl="duckdb+parquet",
-            persist_directory=persist_directory
-        ))
-        self.collection = self.client.get_or_create_collection(name=collection_name)
-        # Use langchain HuggingFaceEmbeddings wrapper (under the hood uses sentence-transformers)
-        self.hf_emb = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
+# Query text -> embedding; shared by every VectorStore in the process
+query_embedding_cache = TTLCache(
+    "query_embedding",
+    maxsize=int(os.getenv("QUERY_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("QUERY_CACHE_TTL", "3600")),
+    generation=index_generation,
+)
+
+def manifest_path_for(directory: str, collection_name: str) -> str:
+    """Ingest manifest of one collection (INGEST_MANIFEST_PATH overrides the default collection's)."""
+    if collection_name == COLLECTION_NAME:
+        return INGEST_MANIFEST_PATH or os.path.join(directory, "ingest_manifest.json")
+    if INGEST_MANIFEST_PATH:
+        return f"{INGEST_MANIFEST_PATH}.{collection_name}"
+    return os.path.join(directory, f"ingest_manifest.{collection_name}.json")
+
+
+_chroma_clients: Dict[str, object] = {}
+_chroma_clients_lock = threading.Lock()
+
+
+def get_chroma_client(persist_directory: str = PERSIST_DIR):
+    """
+    One Chroma client per persist directory. duckdb+parquet persist() rewrites the whole
+    directory, so two clients on the same path would overwrite each other's collections.
+    """
+    key = os.path.abspath(persist_directory)
+    with _chroma_clients_lock:
+        client = _chroma_clients.get(key)
+        if client is None:
+            # chromadb is imported lazily so that importing the app stays cheap
+            import chromadb
+            from chromadb.config import Settings
+
+            os.makedirs(persist_directory, exist_ok=True)
+            client = _chroma_clients[key] = chromadb.Client(Settings(
+                chroma_db_impl="duckdb+parquet",
+                persist_directory=persist_directory
+            ))
+        return client
 
-    def embed_texts(self, texts: List[str]) -> List[List[float]]:
-        # LangChain embedding wrapper supports embedding of a single string or list
-        return [self.hf_emb.embed_query(t) for t in texts]
 
-    def add_documents(self, docs: List[Dict]):
+class BaseVectorStore:
+    """
+    Embedding, query caching and batching shared by every retrieval backend.
+    Backends implement upsert_documents, delete_ids, persist and query_embeddings.
+    """
+    manifest_path: str = ""
+    read_only: bool = False
+
+    def __init__(self, engine: Optional[EmbeddingEngine] = None):
+        # Shared batched encoder (one model per process, used by ingest and query alike)
+        self.engine = engine or get_embedding_engine()
+        # Coalesce concurrent queries into batched encodes when a window is configured
+        self.batcher = QueryBatcher(self) if QUERY_BATCH_WINDOW_MS > 0 else None
+
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        # One batched forward pass per EMBED_BATCH_SIZE texts; returns float32 (n, dim)
+        return self.engine.encode(texts)
+
+    def embed_queries(self, query_texts: List[str]) -> np.ndarray:
+        """Embeds query texts, serving repeats from the cache and encoding misses in one batch."""
+        keys = [normalize_query(t) for t in query_texts]
+        vectors = [query_embedding_cache.get(k) for k in keys]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            encoded = self.engine.encode([query_texts[i] for i in missing])
+            for i, vec in zip(missing, encoded):
+                vectors[i] = vec
+                query_embedding_cache.set(keys[i], vec)
+        return np.ascontiguousarray(np.stack(vectors), dtype=np.float32)
+
+    def embed_query(self, query_text: str) -> np.ndarray:
+        return self.embed_queries([query_text])[0]
+
+    def upsert_documents(self, docs: List[Dict]):
         """
         docs: list of {"id": str, "content": str, "metadata": {...}}
-        We'll embed doc contents in batches and add them to Chroma with embeddings.
+        Existing ids are overwritten, so re-ingesting a changed chunk is idempotent.
         """
-        contents = [d["content"] for d in docs]
-        metadatas = [d.get("metadata", {}) for d in docs]
-        ids = [d["id"] for d in docs]
-        # get embeddings
-        embeddings = self.embed_texts(contents)
-        # Add to chroma
-        self.collection.add(documents=contents, metadatas=metadatas, ids=ids, embeddings=embeddings)
-
-    def query(self, query_text: str, n_results: int = 5, where: Dict = None):
+        if docs:
+            with stage("add_embed"):
+                embeddings = self.embed_texts([d["content"] for d in docs])
+            with stage("add_write"):
+                self.upsert_embedded(docs, embeddings)
+
+    def upsert_embedded(self, docs: List[Dict], embeddings: np.ndarray):
+        """upsert_documents with embeddings already computed (lets ingest embed and write in separate stages)."""
+        raise NotImplementedError
+
+    def delete_ids(self, ids: List[str]):
+        raise NotImplementedError
+
+    def persist(self):
+        pass
+
+    def drop(self):
+        """Delete this collection and its manifest (used for abandoned blue/green collections)."""
+        raise NotImplementedError
+
+    def close(self):
+        """Release background threads once the store is no longer shared; queries still work."""
+        if self.batcher is not None:
+            self.batcher.close()
+
+    def query_embeddings(self, q_embs: np.ndarray, n_results: int = 5, where: Dict = None) -> List[List[Dict]]:
+        raise NotImplementedError
+
+    def query(self, query_text: Union[str, List[str]], n_results: int = 5, where: Dict = None):
         """
         Query using embeddings and optional metadata filter (where)
         where should follow chromadb's filter format e.g. {"department": {"$in": ["finance","general"]}}
-        Returns list of dicts: id, document, metadata, distance
+        Returns list of dicts: id, document, metadata, distance, embedding.
+        Given a list of texts, embeds them in one pass, runs one multi-embedding query and
+        returns one such list per text.
+        """
+        if not isinstance(query_text, str):
+            if not query_text:
+                return []
+            with stage("embed_query"):
+                q_embs = self.embed_queries(list(query_text))
+            with stage("vector_query"):
+                return self.query_embeddings(q_embs, n_results, where)
+        if self.batcher is not None:
+            # Embedding and search happen together on the batcher thread
+            with stage("batched_query"):
+                return self.batcher.submit(query_text, n_results, where)
+        with stage("embed_query"):
+            q_embs = self.embed_queries([query_text])
+        with stage("vector_query"):
+            return self.query_embeddings(q_embs, n_results, where)[0]
+
+
+class VectorStore(BaseVectorStore):
+    def __init__(self, persist_directory: str = PERSIST_DIR, collection_name: str = COLLECTION_NAME,
+                 engine: Optional[EmbeddingEngine] = None):
+        self.client = get_chroma_client(persist_directory)
+        self.collection_name = collection_name
+        self.collection = self.client.get_or_create_collection(name=collection_name)
+        self.manifest_path = manifest_path_for(persist_directory, collection_name)
+        super().__init__(engine)
+
+    def upsert_embedded(self, docs: List[Dict], embeddings: np.ndarray):
+        if not docs:
+            return
+        self.collection.upsert(
+            ids=[d["id"] for d in docs],
+            documents=[d["content"] for d in docs],
+            metadatas=[d.get("metadata", {}) for d in docs],
+            embeddings=embeddings.tolist()
+        )
+
+    def delete_ids(self, ids: List[str]):
+        if ids:
+            self.collection.delete(ids=list(ids))
+
+    def persist(self):
+        # duckdb+parquet only flushes to disk on persist() / interpreter exit
+        self.client.persist()
+
+    def drop(self):
+        self.client.delete_collection(self.collection_name)
+        self.client.persist()
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+
+    def query_embeddings(self, q_embs: np.ndarray, n_results: int = 5, where: Dict = None) -> List[List[Dict]]:
+        """
+        One collection.query for several query embeddings sharing n_results/where.
+        Returns one list of {id, document, metadata, distance, embedding} per query embedding.
         """
-        q_emb = self.hf_emb.embed_query(query_text)
         results = self.collection.query(
-            query_embeddings=[q_emb],
+            query_embeddings=q_embs.tolist(),
             n_results=n_results,
-            where=where
+            where=where,
+            include=["documents", "metadatas", "distances", "embeddings"]
         )
-        output = []
-        if results and len(results.get("ids", [])) > 0:
-            ids = results.get("ids")[0]
-            docs = results.get("documents")[0]
-            metadatas = results.get("metadatas")[0]
-            distances = results.get("distances", [[None]])[0]
-            for _id, doc, meta, dist in zip(ids, docs, metadatas, distances):
-                output.append({
-                    "id": _id,
-                    "document": doc,
-                    "metadata": meta,
-                    "distance": dist
-                })
-        return output
+        outputs = []
+        for q in range(len(q_embs)):
+            output = []
+            if results and len(results.get("ids", [])) > q:
+                ids = results.get("ids")[q]
+                docs = results.get("documents")[q]
+                metadatas = results.get("metadatas")[q]
+                distances = results["distances"][q] if results.get("distances") else [None] * len(ids)
+                embeddings = results["embeddings"][q] if results.get("embeddings") else [None] * len(ids)
+                for _id, doc, meta, dist, emb in zip(ids, docs, metadatas, distances, embeddings):
+                    output.append({
+                        "id": _id,
+                        "document": doc,
+                        "metadata": meta,
+                        "distance": dist,
+                        "embedding": None if emb is None else np.asarray(emb, dtype=np.float32)
+                    })
+            outputs.append(output)
+        return outputs
@@ -2,14 +2,19 @@
 import streamlit as st
 import requests
 import base64
-from typing import List
+import itertools
+import json
+import time
+from typing import Dict, Iterator, List
 
 # -------------------------
 # Config
 # -------------------------
 API_BASE = st.secrets.get("API_BASE", "http://127.0.0.1:8000")  # override in HF Space secrets if backend hosted externally
 CHAT_ENDPOINT = f"{API_BASE}/chat"
-LOGIN_ENDPOINT = f"{API_BASE}/"  # reuse Basic Auth via /chat
+CHAT_STREAM_ENDPOINT = f"{API_BASE}/chat/stream"
+LOGIN_ENDPOINT = f"{API_BASE}/login"  # Basic once, then a Bearer token on every call
+SESSION_ENDPOINT = f"{API_BASE}/session"  # server-side conversation: follow-ups reuse earlier retrieval
 
 # -------------------------
 # Utils
@@ -18,13 +23,44 @@ def encode_basic_auth(username: str, password: str) -> str:
     token = f"{username}:{password}"
     return base64.b64encode(token.encode()).decode()
 
-def call_chat(username: str, password: str, message: str, top_k: int=5, max_new_tokens: int=300, temperature: float=0.2, timeout: int=60):
-    headers = {"Authorization": f"Basic {encode_basic_auth(username, password)}", "Content-Type": "application/json"}
-    payload = {"message": message, "top_k": top_k, "max_new_tokens": max_new_tokens, "temperature": temperature}
+def login(username: str, password: str, timeout: int=10) -> Dict:
+    """Exchanges the password for a signed session token: {access_token, role, expires_at, ...}."""
+    resp = requests.post(LOGIN_ENDPOINT, headers={"Authorization": f"Basic {encode_basic_auth(username, password)}"}, timeout=timeout)
+    resp.raise_for_status()
+    return resp.json()
+
+def get_token(force: bool=False) -> str:
+    """Session token for the sidebar credentials, refreshed when missing, expiring or for another user."""
+    auth = st.session_state.get("auth")
+    if force or not auth or auth.get("username") != st.session_state.username or auth["expires_at"] - time.time() < 60:
+        auth = login(st.session_state.username, st.session_state.password)
+        st.session_state.auth = auth
+        st.session_state.role = auth.get("role", "")
+    return auth["access_token"]
+
+def call_chat(token: str, message: str, top_k: int=5, max_new_tokens: int=300, temperature: float=0.2, timeout: int=60):
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    payload = {"message": message, "top_k": top_k, "max_new_tokens": max_new_tokens, "temperature": temperature,
+               "session": True}
     resp = requests.post(CHAT_ENDPOINT, json=payload, headers=headers, timeout=timeout)
     resp.raise_for_status()
     return resp.json()
 
+def call_chat_stream(token: str, message: str, top_k: int=5, max_new_tokens: int=300, temperature: float=0.2, timeout: int=60) -> Iterator[Dict]:
+    """Yields NDJSON events from /chat/stream: sources, then tokens, then done."""
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    payload = {"message": message, "top_k": top_k, "max_new_tokens": max_new_tokens, "temperature": temperature,
+               "session": True}
+    # timeout applies between chunks, not to the whole answer
+    with requests.post(CHAT_STREAM_ENDPOINT, json=payload, headers=headers, stream=True, timeout=(10, timeout)) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines(decode_unicode=True):
+            if line:
+                yield json.loads(line)
+
+def end_session(token: str, timeout: int=10):
+    requests.delete(SESSION_ENDPOINT, headers={"Authorization": f"Bearer {token}"}, timeout=timeout)
+
 # -------------------------
 # Page layout & session state
 # -------------------------
@@ -39,6 +75,8 @@ if "role" not in st.session_state:
     st.session_state.role = ""
 if "history" not in st.session_state:
     st.session_state.history = []
+if "auth" not in st.session_state:
+    st.session_state.auth = None
 
 # -------------------------
 # Sidebar: login / info
@@ -47,11 +85,18 @@ with st.sidebar:
     st.header("👤 Login (Demo)")
     st.session_state.username = st.text_input("Username", value=st.session_state.username)
     st.session_state.password = st.text_input("Password", value=st.session_state.password, type="password")
+    if st.session_state.auth and st.session_state.auth.get("username") == st.session_state.username:
+        st.caption(f"Signed in as {st.session_state.username} ({st.session_state.role})")
 
     st.markdown("---")
     st.write("When deployed, set `API_BASE` in Space secrets to your backend URL.")
     if st.button("Clear history"):
         st.session_state.history = []
+        if st.session_state.auth:
+            try:
+                end_session(st.session_state.auth["access_token"])
+            except requests.RequestException:
+                pass  # the server drops idle sessions on its own
 
 # -------------------------
 # Controls (top)
@@ -71,9 +116,29 @@ if st.button("Send"):
         st.warning("Write a question first.")
     else:
         try:
-            res = call_chat(st.session_state.username, st.session_state.password, query, top_k=top_k, temperature=float(temperature))
-            answer = res.get("answer", "No answer")
-            sources = res.get("sources", [])
+            answer = ""
+            sources = []
+            sources_box = st.empty()
+            answer_box = st.empty()
+            try:
+                events = call_chat_stream(get_token(), query, top_k=top_k, temperature=float(temperature))
+                first = next(events, None)
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code != 401:
+                    raise
+                # Token expired or the server restarted with a new key: log in again once
+                events = call_chat_stream(get_token(force=True), query, top_k=top_k, temperature=float(temperature))
+                first = next(events, None)
+            for event in itertools.chain([first] if first else [], events):
+                if event["event"] == "sources":
+                    sources = event.get("sources", [])
+                    sources_box.caption("Sources: " + ", ".join(sources) if sources else "No sources")
+                elif event["event"] == "token":
+                    answer += event["text"]
+                    answer_box.markdown(f"**Bot:** {answer}▌")
+                elif event["event"] == "error":
+                    raise RuntimeError(event.get("detail", "Generation failed"))
+            answer = answer or "No answer"
             # Append to history
             st.session_state.history.append({"role":"user","text": query})
             st.session_state.history.append({"role":"assistant","text": answer, "sources": sources})
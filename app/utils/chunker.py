@@ -0,0 +1,172 @@
+# app/utils/chunker.py
+import re
+from typing import Callable, Dict, List, Tuple
+
+# Counts tokens for a batch of texts (no special tokens), e.g. embedding.get_token_counter()
+TokenCounter = Callable[[List[str]], List[int]]
+
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+RULE_RE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+class Block:
+    __slots__ = ("kind", "text", "path", "tokens")
+
+    def __init__(self, kind: str, text: str, path: Tuple[str, ...]):
+        self.kind = kind  # heading | table | code | text
+        self.text = text
+        self.path = path
+        self.tokens = 0
+
+
+def parse_blocks(text: str) -> List[Block]:
+    """
+    Split markdown into headings, tables, fenced code and paragraph/list blocks,
+    tagging each with the heading path it sits under. Horizontal rules are dropped.
+    """
+    blocks: List[Block] = []
+    stack: List[Tuple[int, str]] = []
+    buf: List[str] = []
+    kind = "text"
+    in_code = False
+
+    def path() -> Tuple[str, ...]:
+        return tuple(t for _, t in stack)
+
+    def flush():
+        nonlocal buf, kind
+        if buf and any(l.strip() for l in buf):
+            blocks.append(Block(kind, "\n".join(buf).strip("\n"), path()))
+        buf, kind = [], "text"
+
+    for line in text.splitlines():
+        if in_code:
+            buf.append(line)
+            if line.strip().startswith("```"):
+                in_code = False
+                flush()
+            continue
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            flush()
+            kind, in_code = "code", True
+            buf.append(line)
+            continue
+        m = HEADING_RE.match(stripped)
+        if m:
+            flush()
+            level = len(m.group(1))
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+            stack.append((level, m.group(2)))
+            blocks.append(Block("heading", stripped, path()))
+            continue
+        if not stripped or RULE_RE.match(stripped):
+            flush()
+            continue
+        is_table = stripped.startswith("|")
+        if buf and (kind == "table") != is_table:
+            flush()
+        kind = "table" if is_table else "text"
+        buf.append(line)
+    flush()
+    return blocks
+
+
+def _split_oversized(block: Block, max_tokens: int, count: TokenCounter) -> List[Block]:
+    """Break a block that alone exceeds the budget: tables by rows (header repeated), text by lines, sentences, then words."""
+    if block.kind == "table":
+        rows = block.text.split("\n")
+        head_n = 2 if len(rows) > 1 and set(rows[1].replace("|", "").strip()) <= set("-: ") else 1
+        header, body = rows[:head_n], rows[head_n:]
+        pieces = _pack_units(body, max_tokens, count, prefix="\n".join(header), sep="\n")
+    else:
+        units = block.text.split("\n")
+        if len(units) == 1:
+            units = SENTENCE_RE.split(block.text)
+        if len(units) == 1:
+            units = block.text.split(" ")
+            pieces = _pack_units(units, max_tokens, count, sep=" ")
+        else:
+            pieces = []
+            for unit in _pack_units(units, max_tokens, count, sep="\n" if "\n" in block.text else " "):
+                if count([unit])[0] > max_tokens:
+                    pieces.extend(b.text for b in _split_oversized(Block("text", unit, block.path), max_tokens, count))
+                else:
+                    pieces.append(unit)
+    out = []
+    for p in pieces:
+        b = Block(block.kind, p, block.path)
+        out.append(b)
+    for b, n in zip(out, count([b.text for b in out])):
+        b.tokens = n
+    return out
+
+
+def _pack_units(units: List[str], max_tokens: int, count: TokenCounter, prefix: str = "", sep: str = "\n") -> List[str]:
+    units = [u for u in units if u.strip()]
+    if not units:
+        return [prefix] if prefix else []
+    sizes = count(units)
+    base = count([prefix])[0] if prefix else 0
+    pieces, cur, cur_tokens = [], [], base
+    for unit, n in zip(units, sizes):
+        if cur and cur_tokens + n > max_tokens:
+            pieces.append(sep.join(([prefix] if prefix else []) + cur))
+            cur, cur_tokens = [], base
+        cur.append(unit)
+        cur_tokens += n
+    if cur:
+        pieces.append(sep.join(([prefix] if prefix else []) + cur))
+    return pieces
+
+
+def chunk_markdown(text: str, count: TokenCounter, max_tokens: int = 254, min_tokens: int = 64) -> List[Dict]:
+    """
+    Structure-aware chunker. Packs consecutive blocks into chunks of at most `max_tokens`
+    (as measured by `count`, i.e. the embedding tokenizer), never splitting a table or
+    paragraph unless it alone exceeds the budget. A heading starts a new chunk once the
+    current one holds at least `min_tokens`. No overlap between chunks.
+    Returns [{"content": str, "heading": "H1 > H2 > ...", "tokens": int}].
+    """
+    blocks = parse_blocks(text or "")
+    if not blocks:
+        return []
+    for b, n in zip(blocks, count([b.text for b in blocks])):
+        b.tokens = n
+
+    expanded: List[Block] = []
+    for b in blocks:
+        expanded.extend(_split_oversized(b, max_tokens, count) if b.tokens > max_tokens else [b])
+
+    chunks: List[Dict] = []
+    cur: List[Block] = []
+    cur_tokens = 0
+
+    def flush():
+        nonlocal cur, cur_tokens
+        # Trailing headings belong with the content that follows them
+        tail = []
+        while cur and cur[-1].kind == "heading":
+            tail.insert(0, cur.pop())
+        if cur:
+            first = next((b for b in cur if b.kind != "heading"), cur[0])
+            chunks.append({
+                "content": "\n\n".join(b.text for b in cur),
+                "heading": " > ".join(first.path),
+                "tokens": cur_tokens - sum(b.tokens for b in tail),
+            })
+        cur = tail
+        cur_tokens = sum(b.tokens for b in tail)
+
+    for b in expanded:
+        if cur and (cur_tokens + b.tokens > max_tokens or (b.kind == "heading" and cur_tokens >= min_tokens)):
+            flush()
+            if cur and cur_tokens + b.tokens > max_tokens:
+                # carried-over headings plus this block do not fit: drop the carry
+                cur, cur_tokens = [], 0
+        cur.append(b)
+        cur_tokens += b.tokens
+    flush()
+    return chunks
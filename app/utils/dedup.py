@@ -0,0 +1,125 @@
+# app/utils/dedup.py
+import re
+import zlib
+from collections import defaultdict
+from typing import Dict, List
+
+import numpy as np
+
+WORD_RE = re.compile(r"\w+")
+# Mersenne prime modulus for the (a * x + b) % p permutations; 32-bit hashes keep a * x in uint64
+MERSENNE_61 = np.uint64((1 << 61) - 1)
+# Separator of the "sources" metadata string (Chroma metadata values must be scalars)
+SOURCE_REF_SEP = ";"
+
+
+def shingles(text: str, size: int = 3) -> List[str]:
+    """Overlapping word n-grams of the case-folded text (the whole text if it is shorter)."""
+    words = WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return [" ".join(words)] if words else []
+    return [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+class MinHasher:
+    """MinHash signatures over word shingles; seeded, so signatures are stable across processes."""
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 3, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.a = rng.randint(1, 1 << 31, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, 1 << 31, size=num_perm).astype(np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        grams = set(shingles(text, self.shingle_size))
+        if not grams:
+            return np.full(self.num_perm, MERSENNE_61, dtype=np.uint64)
+        x = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+        return ((np.outer(x, self.a) + self.b) % MERSENNE_61).min(axis=0)
+
+
+def estimated_jaccard(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.mean(a == b))
+
+
+class LSHIndex:
+    """
+    Banded LSH over MinHash signatures: two signatures become candidates when all rows of
+    any band agree. With b bands of r rows the candidate curve is 1 - (1 - J^r)^b.
+    """
+
+    def __init__(self, num_perm: int = 128, bands: int = 16):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.buckets: List[Dict[bytes, List[int]]] = [defaultdict(list) for _ in range(bands)]
+        self.signatures: List[np.ndarray] = []
+
+    def _keys(self, sig: np.ndarray) -> List[bytes]:
+        return [sig[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def add(self, sig: np.ndarray) -> int:
+        key = len(self.signatures)
+        self.signatures.append(sig)
+        for band, k in zip(self.buckets, self._keys(sig)):
+            band[k].append(key)
+        return key
+
+    def candidates(self, sig: np.ndarray) -> List[int]:
+        found = set()
+        for band, k in zip(self.buckets, self._keys(sig)):
+            found.update(band.get(k, ()))
+        return sorted(found)
+
+
+def source_ref(metadata: Dict) -> str:
+    return f"{metadata.get('source', 'unknown')}#chunk-{metadata.get('chunk_id', '0')}"
+
+
+def source_refs(metadata: Dict) -> List[str]:
+    """Every "file#chunk-n" a stored chunk stands for: its own, plus collapsed near-duplicates."""
+    refs = metadata.get("sources")
+    return refs.split(SOURCE_REF_SEP) if refs else [source_ref(metadata)]
+
+
+def origin_sources(metadata: Dict) -> List[str]:
+    """Source file names behind a stored chunk, in order, without repeats."""
+    return list(dict.fromkeys(ref.rsplit("#", 1)[0] for ref in source_refs(metadata)))
+
+
+def collapse_near_duplicates(records: List[Dict], threshold: float = 0.85, num_perm: int = 128,
+                             bands: int = 16, shingle_size: int = 3) -> List[Dict]:
+    """
+    Collapse records whose estimated Jaccard similarity (word shingles) reaches threshold.
+    The first record of each group is kept; its metadata gains "sources" (every member's
+    "file#chunk-n", joined by SOURCE_REF_SEP) and "duplicates" (how many were dropped).
+    Members join the group's first record, never each other, so similarity does not chain.
+    Callers pass one department at a time: duplicates never cross an access boundary.
+    """
+    hasher = MinHasher(num_perm, shingle_size)
+    index = LSHIndex(num_perm, bands)
+    kept: List[Dict] = []
+    members: List[List[str]] = []
+    for rec in records:
+        sig = hasher.signature(rec["content"])
+        best, best_score = None, threshold
+        for key in index.candidates(sig):
+            score = estimated_jaccard(sig, index.signatures[key])
+            if score >= best_score:
+                best, best_score = key, score
+        if best is None:
+            index.add(sig)
+            kept.append(rec)
+            members.append([source_ref(rec["metadata"])])
+        else:
+            members[best].append(source_ref(rec["metadata"]))
+
+    out = []
+    for rec, refs in zip(kept, members):
+        if len(refs) > 1:
+            rec = {**rec, "metadata": {**rec["metadata"], "sources": SOURCE_REF_SEP.join(refs),
+                                       "duplicates": len(refs) - 1}}
+        out.append(rec)
+    return out
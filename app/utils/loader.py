@@ -1,53 +1,108 @@
 # app/utils/loader.py
 import os
+from typing import Callable, Dict, Iterator, List
 import pandas as pd
 
 BASE_PATH = "resources/data"
 VALID_MARKDOWN = (".md", ".markdown", ".txt")
 VALID_CSV = (".csv",)
+# Rows pandas reads per block when streaming a CSV
+CSV_READ_ROWS = int(os.getenv("CSV_READ_ROWS", "5000"))
+CSV_SEP = " | "
 
 def load_markdown_file(path: str) -> str:
     with open(path, "r", encoding="utf-8") as f:
         return f.read()
 
+def iter_csv_frames(path: str, rows: int = CSV_READ_ROWS) -> Iterator[pd.DataFrame]:
+    # Everything as text, empty cells as "" rather than NaN
+    yield from pd.read_csv(path, chunksize=rows, dtype=str, keep_default_na=False)
+
+def serialize_rows(frame: pd.DataFrame) -> pd.Series:
+    """One "v1 | v2 | ..." line per row, built column-wise (no per-row Python loop)."""
+    cols = list(frame.columns)
+    first = frame[cols[0]].str.strip()
+    if len(cols) == 1:
+        return first
+    return first.str.cat([frame[c].str.strip() for c in cols[1:]], sep=CSV_SEP)
+
+def csv_header(columns: List[str]) -> str:
+    return "Columns: " + CSV_SEP.join(columns)
+
+def iter_csv_chunks(path: str, count_tokens: Callable[[List[str]], List[int]], max_tokens: int = 254,
+                    rows: int = CSV_READ_ROWS) -> Iterator[Dict]:
+    """
+    Streams a CSV as row-aligned chunks, each starting with the column header line and
+    holding as many whole rows as fit in `max_tokens`. Memory is bounded by `rows`.
+    Yields {"content": str, "heading": str, "row_start": int, "row_end": int} (row_end exclusive).
+    """
+    header = None
+    header_tokens = 0
+    cur: List[str] = []
+    cur_tokens = 0
+    start = 0
+    row_no = 0
+    for frame in iter_csv_frames(path, rows):
+        if header is None:
+            header = csv_header(list(frame.columns))
+            header_tokens = count_tokens([header])[0]
+        lines = serialize_rows(frame).tolist()
+        for line, n in zip(lines, count_tokens(lines)):
+            if cur and header_tokens + cur_tokens + n > max_tokens:
+                yield {"content": header + "\n" + "\n".join(cur), "heading": header, "row_start": start, "row_end": row_no}
+                cur, cur_tokens, start = [], 0, row_no
+            cur.append(line)
+            cur_tokens += n
+            row_no += 1
+    if cur:
+        yield {"content": header + "\n" + "\n".join(cur), "heading": header, "row_start": start, "row_end": row_no}
+
 def load_csv_file(path: str) -> str:
-    df = pd.read_csv(path)
-    # Limit rows to 1000 for safety
-    if len(df) > 1000:
-        df = df.head(1000)
-    rows = []
-    for i, r in df.iterrows():
-        rows.append(", ".join([f"{c}: {str(r[c])}" for c in df.columns]))
-    return "\n".join(rows)
-
-def discover_documents():
+    # Whole file as one string (header line + one line per row); ingest streams via iter_csv_chunks instead
+    parts = []
+    for frame in iter_csv_frames(path):
+        if not parts:
+            parts.append(csv_header(list(frame.columns)))
+        parts.extend(serialize_rows(frame).tolist())
+    return "\n".join(parts)
+
+def read_document(doc: Dict) -> Dict:
+    """Fills in "content" for a markdown descriptor from iter_documents; CSV is left to stream."""
+    if doc["kind"] == "markdown" and "content" not in doc:
+        doc = dict(doc, content=load_markdown_file(doc["path"]))
+    return doc
+
+def iter_documents(base_path: str = BASE_PATH) -> Iterator[Dict]:
     """
-    Returns list of dicts:
-    [
-      {"department": "finance", "source": "file.md", "content": "..."},
-      ...
-    ]
+    Lazily yields file descriptors {"department", "source", "path", "kind"} without
+    reading file contents (see read_document).
     """
-    documents = []
-    if not os.path.isdir(BASE_PATH):
-        raise FileNotFoundError(f"{BASE_PATH} not found. Ensure dataset is present.")
+    if not os.path.isdir(base_path):
+        raise FileNotFoundError(f"{base_path} not found. Ensure dataset is present.")
 
-    for dept in sorted(os.listdir(BASE_PATH)):
-        dept_path = os.path.join(BASE_PATH, dept)
+    for dept in sorted(os.listdir(base_path)):
+        dept_path = os.path.join(base_path, dept)
         if not os.path.isdir(dept_path):
             continue
         for fname in sorted(os.listdir(dept_path)):
-            fpath = os.path.join(dept_path, fname)
-            if fname.lower().endswith(VALID_MARKDOWN):
-                content = load_markdown_file(fpath)
-            elif fname.lower().endswith(VALID_CSV):
-                content = load_csv_file(fpath)
+            lower = fname.lower()
+            if lower.endswith(VALID_MARKDOWN):
+                kind = "markdown"
+            elif lower.endswith(VALID_CSV):
+                kind = "csv"
             else:
                 # skip unknown file types
                 continue
-            documents.append({
-                "department": dept,
-                "source": fname,
-                "content": content
-            })
-    return documents
+            yield {"department": dept, "source": fname, "path": os.path.join(dept_path, fname), "kind": kind}
+
+def discover_documents(base_path: str = BASE_PATH):
+    """
+    Returns list of dicts:
+    [
+      {"department": "finance", "source": "file.md", "path": "...", "kind": "markdown", "content": "..."},
+      {"department": "hr", "source": "data.csv", "path": "...", "kind": "csv"},
+      ...
+    ]
+    CSV files are not read here; ingest streams them with iter_csv_chunks.
+    """
+    return [read_document(d) for d in iter_documents(base_path)]
@@ -0,0 +1,250 @@
+# scripts/benchmark.py
+# Offline, in-process benchmark: ingest throughput, retrieval and end-to-end latency per role,
+# peak RSS and cache hit rates, with a deterministic stub LLM. Usage:
+#   python -m scripts.benchmark --scale 5 --output bench.json
+#   python -m scripts.benchmark --scale 5 --baseline bench.json   # exit 1 on regression
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_QUESTIONS = [
+    "What was the total revenue in Q4 2024?",
+    "Summarize the quarterly financial performance and major expenses.",
+    "Which marketing campaigns had the best return on investment?",
+    "How did customer acquisition change across 2024?",
+    "What is the leave policy for employees?",
+    "What are the working hours and remote work rules?",
+    "Describe the system architecture and technology stack.",
+    "How are deployments and incident response handled?",
+    "What is the average attendance of employees in Finance?",
+    "Who reports to FINEMP1006?",
+]
+
+
+# -------------------------
+# Synthetic corpus
+# -------------------------
+def scale_corpus(src: str, dest: str, factor: int) -> Dict[str, int]:
+    """
+    Write `factor` copies of every file under src/<department>/ into dest/<department>/.
+    Copy 0 is the original; later copies get a distinct title line (markdown) or suffixed
+    ID columns (CSV) so chunk ids and contents stay unique. Deterministic.
+    Returns {"files": n, "bytes": total}.
+    """
+    from app.utils.loader import iter_documents
+
+    files, size = 0, 0
+    for doc in iter_documents(src):
+        out_dir = os.path.join(dest, doc["department"])
+        os.makedirs(out_dir, exist_ok=True)
+        stem, ext = os.path.splitext(doc["source"])
+        for i in range(factor):
+            out = os.path.join(out_dir, doc["source"] if i == 0 else f"{stem}__copy{i}{ext}")
+            if i == 0:
+                shutil.copyfile(doc["path"], out)
+            elif doc["kind"] == "csv":
+                df = pd.read_csv(doc["path"], dtype=str, keep_default_na=False)
+                for col in df.columns:
+                    if col.lower() == "id" or col.lower().endswith("_id"):
+                        df[col] = df[col].where(df[col] == "", df[col] + f"-C{i}")
+                df.to_csv(out, index=False)
+            else:
+                with open(doc["path"], "r", encoding="utf-8") as f:
+                    text = f.read()
+                with open(out, "w", encoding="utf-8") as f:
+                    f.write(f"# {stem} (synthetic copy {i})\n\n{text}")
+            files += 1
+            size += os.path.getsize(out)
+    return {"files": files, "bytes": size}
+
+
+# -------------------------
+# Measurement helpers
+# -------------------------
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {"n": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None}
+    ms = np.asarray(samples) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"n": len(samples), "p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3),
+            "p99_ms": round(float(p99), 3), "mean_ms": round(float(ms.mean()), 3)}
+
+
+def bench_queries(questions: List[str], repeats: int, top_k: int, concurrency: int) -> Dict:
+    from app.services.rag import ROLE_ACCESS, aanswer_query_with_rag, retrieval_cache, retrieve_for_role, answer_cache
+
+    per_role = {}
+    for role in ROLE_ACCESS:
+        # Retrieval alone, sequential; the first repeat is cold, later ones may hit the caches
+        retrieval = []
+        for _ in range(repeats):
+            for q in questions:
+                t0 = time.perf_counter()
+                retrieve_for_role(q, role, top_k=top_k)
+                retrieval.append(time.perf_counter() - t0)
+
+        # End to end through the async path the API uses, `concurrency` requests in flight
+        retrieval_cache.clear()
+        answer_cache.clear()
+        e2e: List[float] = []
+
+        async def run_all():
+            sem = asyncio.Semaphore(concurrency)
+
+            async def one(q):
+                async with sem:
+                    t0 = time.perf_counter()
+                    await aanswer_query_with_rag(q, role, top_k=top_k)
+                    e2e.append(time.perf_counter() - t0)
+
+            started = time.perf_counter()
+            for _ in range(repeats):
+                await asyncio.gather(*(one(q) for q in questions))
+            return time.perf_counter() - started
+
+        wall = asyncio.run(run_all())
+        per_role[role] = {
+            "retrieval": percentiles(retrieval),
+            "end_to_end": percentiles(e2e),
+            "requests_per_second": round(len(e2e) / wall, 2) if wall else None,
+        }
+    return per_role
+
+
+# -------------------------
+# Baseline comparison
+# -------------------------
+def _comparable(result: Dict) -> Dict[str, float]:
+    """Flatten the metrics worth gating on: name -> value (higher_is_better encoded in the name)."""
+    out = {"ingest.chunks_per_second": result["ingest"]["chunks_per_second"]}
+    for role, r in result["queries"].items():
+        for kind in ("retrieval", "end_to_end"):
+            for p in ("p50_ms", "p95_ms", "p99_ms"):
+                out[f"queries.{role}.{kind}.{p}"] = r[kind][p]
+    out["peak_rss_mb"] = result["peak_rss_mb"]
+    return {k: v for k, v in out.items() if v is not None}
+
+
+def compare(result: Dict, baseline: Dict, tolerance: float, min_delta_ms: float = 1.0) -> List[Dict]:
+    """
+    Metrics that got worse by more than `tolerance` (relative). Latencies must also move by
+    at least min_delta_ms, so sub-millisecond jitter is not reported as a regression.
+    """
+    current, base = _comparable(result), _comparable(baseline)
+    regressions = []
+    for name, value in current.items():
+        before = base.get(name)
+        if before is None or before == 0:
+            continue
+        higher_is_better = name.endswith("per_second")
+        change = (value - before) / before
+        worse = -change if higher_is_better else change
+        if worse > tolerance and (not name.endswith("_ms") or abs(value - before) >= min_delta_ms):
+            regressions.append({"metric": name, "baseline": before, "current": value,
+                                "change_pct": round(change * 100, 1)})
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline FinSolve RAG benchmark (stub LLM)")
+    parser.add_argument("--scale", type=int, default=1, help="copies of resources/data to index")
+    parser.add_argument("--data", default=None, help="source corpus (default: resources/data)")
+    parser.add_argument("--backend", default=os.getenv("VECTOR_BACKEND", "chroma"), choices=["chroma", "numpy"])
+    parser.add_argument("--repeats", type=int, default=3, help="passes over the question set per role")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=4, help="end-to-end requests in flight")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated stub generation time")
+    parser.add_argument("--questions", default=None, help="file with one question per line")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None, help="earlier --output file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary corpus and index")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="finbot-bench-")
+    # Configure before any app module reads its settings
+    os.environ.update({
+        "LLM_BACKEND": "stub",
+        "LLM_STUB_LATENCY_MS": str(args.llm_latency_ms),
+        "VECTOR_BACKEND": args.backend,
+        "CHROMA_PERSIST_DIR": os.path.join(workdir, "index"),
+        "NUMPY_INDEX_DIR": os.path.join(workdir, "index", "numpy_index"),
+        "WARMUP_MODE": "lazy",
+        # Scaled copies are near-duplicates by construction; collapsing them would undo --scale
+        "CHUNK_DEDUP_THRESHOLD": "0",
+    })
+    from app.services.cache import cache_stats
+    from app.services.ingest import run_incremental_ingest
+    from app.services.pipeline import peak_rss_mb
+    from app.services.registry import warm_up
+    from app.utils.loader import BASE_PATH, iter_documents
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [l.strip() for l in f if l.strip()]
+
+    try:
+        corpus_dir = os.path.join(workdir, "data")
+        corpus = scale_corpus(args.data or BASE_PATH, corpus_dir, args.scale)
+        print(f"Corpus: {corpus['files']} files, {corpus['bytes'] / 1e6:.1f} MB (x{args.scale})")
+
+        startup = warm_up()
+        report = run_incremental_ingest(documents=iter_documents(corpus_dir))
+        print(f"Ingest: {report['chunks_embedded']} chunks in {report['seconds']}s "
+              f"({report['chunks_per_second']} chunks/s)")
+
+        queries = bench_queries(questions, args.repeats, args.top_k, args.concurrency)
+        for role, r in queries.items():
+            print(f"  {role:<12} retrieval p50/p95/p99 = {r['retrieval']['p50_ms']}/{r['retrieval']['p95_ms']}/"
+                  f"{r['retrieval']['p99_ms']} ms   end-to-end = {r['end_to_end']['p50_ms']}/"
+                  f"{r['end_to_end']['p95_ms']}/{r['end_to_end']['p99_ms']} ms   {r['requests_per_second']} req/s")
+
+        caches = cache_stats()
+        result = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {**vars(args), "questions": len(questions)},
+            "environment": {"python": sys.version.split()[0], "platform": platform.platform(),
+                            "cpu_count": os.cpu_count()},
+            "corpus": corpus,
+            "startup_ms": startup.get("stages_ms", {}),
+            "ingest": {k: report[k] for k in ("chunks_embedded", "seconds", "chunks_per_second")},
+            "ingest_stages": report["stages"],
+            "queries": queries,
+            "cache_hit_rates": {name: s["hit_rate"] for name, s in caches.items()},
+            "caches": caches,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        print(f"Peak RSS: {result['peak_rss_mb']} MB   cache hit rates: {result['cache_hit_rates']}")
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print("Results written to", args.output)
+
+        if args.baseline:
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                regressions = compare(result, json.load(f), args.tolerance)
+            for r in regressions:
+                print(f"REGRESSION {r['metric']}: {r['baseline']} -> {r['current']} ({r['change_pct']:+}%)")
+            if regressions:
+                return 1
+            print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+        return 0
+    finally:
+        if args.keep:
+            print("Kept", workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
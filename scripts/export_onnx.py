@@ -0,0 +1,192 @@
+# scripts/export_onnx.py
+# Export EMBEDDING_MODEL to ONNX (optionally plus a dynamically int8-quantized copy), then check
+# cosine agreement with the PyTorch sentence-transformers outputs and time both. Usage:
+#   python -m scripts.export_onnx --quantize                 # export + verify + benchmark
+#   python -m scripts.export_onnx --skip-export --quantize   # re-verify an existing export
+# Serve with EMBEDDING_BACKEND=onnx (and EMBED_ONNX_QUANTIZED=true for the int8 graph).
+# Needs torch and sentence-transformers to export, onnx + onnxruntime to quantize and run.
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.embedding import (EMBED_BATCH_SIZE, EMBED_MODEL, EMBED_ONNX_DIR, ONNX_EXPORT_CONFIG,
+                                    EmbeddingEngine, OnnxEmbeddingEngine)
+
+
+def pipeline_config(model) -> Tuple[str, bool]:
+    """(pooling mode, normalize) of a SentenceTransformer, which the ONNX engine re-does in numpy."""
+    from sentence_transformers.models import Normalize, Pooling, Transformer
+
+    pooling, normalize = None, False
+    for module in model:
+        if isinstance(module, Pooling):
+            cfg = module.get_config_dict()
+            modes = [k for k, v in cfg.items() if k.startswith("pooling_mode_") and v is True]
+            supported = {"pooling_mode_cls_token": "cls", "pooling_mode_max_tokens": "max",
+                         "pooling_mode_mean_tokens": "mean"}
+            if len(modes) != 1 or modes[0] not in supported:
+                raise ValueError(f"Unsupported pooling configuration: {cfg}")
+            pooling = supported[modes[0]]
+        elif isinstance(module, Normalize):
+            normalize = True
+        elif not isinstance(module, Transformer):
+            raise ValueError(f"Unsupported module in the pipeline: {type(module).__name__}")
+    if pooling is None:
+        raise ValueError("Model has no Pooling module")
+    return pooling, normalize
+
+
+def export(model_name: str, out_dir: str, quantize: bool, opset: int = 14) -> Dict:
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(out_dir, exist_ok=True)
+    st = SentenceTransformer(model_name, device="cpu")
+    pooling, normalize = pipeline_config(st)
+    transformer = st[0]
+    hf_model, tokenizer = transformer.auto_model.eval(), transformer.tokenizer
+    sample = tokenizer(["An export sample sentence."], return_tensors="pt")
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = hf_model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(names, inputs))).last_hidden_state
+
+    axes = {0: "batch", 1: "sequence"}
+    path = os.path.join(out_dir, "model.onnx")
+    t0 = time.perf_counter()
+    with torch.no_grad():
+        torch.onnx.export(LastHiddenState(), tuple(sample[n] for n in names), path,
+                          input_names=names, output_names=["last_hidden_state"],
+                          dynamic_axes={**{n: axes for n in names}, "last_hidden_state": axes},
+                          opset_version=opset, do_constant_folding=True)
+    tokenizer.save_pretrained(out_dir)  # tokenizer.json is all the runtime needs
+    print(f"Exported {model_name} -> {path} in {time.perf_counter() - t0:.1f}s")
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(path, os.path.join(out_dir, "model.int8.onnx"), weight_type=QuantType.QInt8)
+        print("Quantized ->", os.path.join(out_dir, "model.int8.onnx"))
+
+    config = {
+        "model": model_name,
+        "dim": st.get_sentence_embedding_dimension(),
+        "pooling": pooling,
+        "normalize": normalize,
+        "max_seq_length": transformer.max_seq_length,
+        "pad_token_id": tokenizer.pad_token_id,
+        "pad_token": tokenizer.pad_token,
+        "inputs": names,
+        "opset": opset,
+        "quantized": quantize,
+        "exported_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(os.path.join(out_dir, ONNX_EXPORT_CONFIG), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    return config
+
+
+def sample_texts(n: int) -> List[str]:
+    """Real chunks from the corpus, so the check covers the lengths and vocabulary we embed."""
+    from app.utils.loader import BASE_PATH, iter_documents
+    from scripts.ingest import iter_docs_for_vectorstore
+
+    texts = []
+    for doc in iter_docs_for_vectorstore(iter_documents(BASE_PATH)):
+        texts.append(doc["content"])
+        if len(texts) >= n:
+            break
+    return texts
+
+
+def cosine_agreement(a: np.ndarray, b: np.ndarray) -> Dict[str, float]:
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    cos = (a * b).sum(axis=1)
+    return {"min": round(float(cos.min()), 6), "p1": round(float(np.percentile(cos, 1)), 6),
+            "mean": round(float(cos.mean()), 6)}
+
+
+def time_engine(engine, texts: List[str], repeats: int, queries: int) -> Dict[str, float]:
+    engine.encode(texts[:8])  # warm-up: first call allocates and optimises
+    batch = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        engine.encode(texts)
+        batch.append(time.perf_counter() - t0)
+    single = []
+    for text in texts[:queries]:
+        t0 = time.perf_counter()
+        engine.encode([text])
+        single.append(time.perf_counter() - t0)
+    best = min(batch)
+    return {"batch_seconds": round(best, 4), "texts_per_second": round(len(texts) / best, 1),
+            "query_p50_ms": round(float(np.percentile(single, 50)) * 1000, 3),
+            "query_p95_ms": round(float(np.percentile(single, 95)) * 1000, 3)}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX and verify it")
+    parser.add_argument("--model", default=EMBED_MODEL)
+    parser.add_argument("--output-dir", default=EMBED_ONNX_DIR)
+    parser.add_argument("--quantize", action="store_true", help="also write and verify model.int8.onnx")
+    parser.add_argument("--skip-export", action="store_true", help="verify an existing export only")
+    parser.add_argument("--opset", type=int, default=14)
+    parser.add_argument("--samples", type=int, default=256, help="corpus chunks to compare and time")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=50, help="single-text encodes timed for query latency")
+    parser.add_argument("--min-cosine", type=float, default=0.999, help="worst allowed cosine, float32 graph")
+    parser.add_argument("--min-cosine-int8", type=float, default=0.98, help="worst allowed cosine, int8 graph")
+    parser.add_argument("--report", default=None, help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    if not args.skip_export:
+        export(args.model, args.output_dir, args.quantize, args.opset)
+
+    texts = sample_texts(args.samples)
+    print(f"Comparing on {len(texts)} corpus chunks")
+    reference = EmbeddingEngine(args.model, batch_size=EMBED_BATCH_SIZE, pool_workers=0)
+    expected = reference.encode(texts)
+    report = {"model": args.model, "export_dir": args.output_dir, "samples": len(texts),
+              "sentence-transformers": time_engine(reference, texts, args.repeats, args.queries)}
+
+    failed = False
+    for quantized in ([False, True] if args.quantize else [False]):
+        name = "onnx-int8" if quantized else "onnx"
+        engine = OnnxEmbeddingEngine(args.output_dir, quantized=quantized, batch_size=EMBED_BATCH_SIZE)
+        agreement = cosine_agreement(expected, engine.encode(texts))
+        timing = time_engine(engine, texts, args.repeats, args.queries)
+        threshold = args.min_cosine_int8 if quantized else args.min_cosine
+        ok = agreement["min"] >= threshold
+        failed |= not ok
+        base = report["sentence-transformers"]
+        report[name] = {**timing, "cosine": agreement, "min_cosine_required": threshold, "ok": ok,
+                        "batch_speedup": round(base["batch_seconds"] / timing["batch_seconds"], 2),
+                        "query_speedup": round(base["query_p50_ms"] / timing["query_p50_ms"], 2)}
+
+    base = report["sentence-transformers"]
+    print(f"  {'sentence-transformers':<22} {base['texts_per_second']:>8} texts/s   query p50 {base['query_p50_ms']} ms")
+    for name in ("onnx", "onnx-int8"):
+        if name in report:
+            r = report[name]
+            print(f"  {name:<22} {r['texts_per_second']:>8} texts/s   query p50 {r['query_p50_ms']} ms   "
+                  f"x{r['batch_speedup']} batch / x{r['query_speedup']} query   "
+                  f"cosine min {r['cosine']['min']} mean {r['cosine']['mean']}  {'OK' if r['ok'] else 'FAIL'}")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print("Report written to", args.report)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
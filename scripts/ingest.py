@@ -1,10 +1,26 @@
 # scripts/ingest.py
-import math
 import os
-from app.utils.loader import discover_documents
-from app.services.vectorstore import VectorStore
+from app.utils.chunker import chunk_markdown
+from app.utils.dedup import collapse_near_duplicates
+from app.utils.loader import iter_csv_chunks
 
-# Sliding-window chunker
+# Markdown chunks of one department at least this similar (MinHash-estimated Jaccard over word
+# 3-grams) are stored once, listing every source; 0 disables the collapse
+CHUNK_DEDUP_THRESHOLD = float(os.getenv("CHUNK_DEDUP_THRESHOLD", "0.85"))
+# MinHash permutations and LSH bands (candidate pairs share all num_perm/bands rows of some band)
+CHUNK_DEDUP_PERMUTATIONS = int(os.getenv("CHUNK_DEDUP_PERMUTATIONS", "128"))
+CHUNK_DEDUP_BANDS = int(os.getenv("CHUNK_DEDUP_BANDS", "16"))
+
+# Recorded in the ingest manifest; change it whenever chunking output changes
+CHUNKER_VERSION = "markdown-tokens-v1+csv-rows-v1" + (
+    f"+minhash-dedup-v1@{CHUNK_DEDUP_THRESHOLD}/{CHUNK_DEDUP_PERMUTATIONS}/{CHUNK_DEDUP_BANDS}"
+    if CHUNK_DEDUP_THRESHOLD > 0 else "")
+# Token budget per chunk: the encoder window minus [CLS]/[SEP]
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", str(int(os.getenv("EMBED_MAX_SEQ_LENGTH", "256")) - 2)))
+# A heading starts a new chunk once the current one has at least this many tokens
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "64"))
+
+# Sliding-window chunker (legacy; build_docs_for_vectorstore uses chunk_markdown)
 def chunk_text(text: str, chunk_size: int = 800, overlap: int = 200):
     if not text:
         return []
@@ -23,33 +39,71 @@ def chunk_text(text: str, chunk_size: int = 800, overlap: int = 200):
         start = end - overlap
     return chunks
 
-def build_docs_for_vectorstore(documents):
-    out = []
+def iter_docs_for_vectorstore(documents, count_tokens=None):
+    """
+    Yields vector-store records one chunk at a time: markdown along its structure,
+    CSV as streamed row-aligned chunks, all within the embedding token budget.
+    count_tokens defaults to the embedding model's tokenizer.
+    """
+    if count_tokens is None:
+        from app.services.embedding import get_token_counter
+        count_tokens = get_token_counter()
     for d in documents:
         dept = d["department"]
         src = d["source"]
-        content = d["content"]
-        chunks = chunk_text(content, chunk_size=800, overlap=200)
+        if d.get("kind") == "csv":
+            chunks = iter_csv_chunks(d["path"], count_tokens, max_tokens=CHUNK_MAX_TOKENS)
+        else:
+            chunks = chunk_markdown(d["content"], count_tokens, max_tokens=CHUNK_MAX_TOKENS, min_tokens=CHUNK_MIN_TOKENS)
         for idx, c in enumerate(chunks):
             doc_id = f"{dept}::{src}::chunk-{idx}"
             metadata = {
                 "department": dept,
                 "source": src,
-                "chunk_id": idx
+                "chunk_id": idx,
+                "heading": c["heading"]
             }
-            out.append({"id": doc_id, "content": c, "metadata": metadata})
-    return out
+            if "row_start" in c:
+                metadata["row_start"] = c["row_start"]
+                metadata["row_end"] = c["row_end"]
+            yield {"id": doc_id, "content": c["content"], "metadata": metadata}
+
+def collapse_department_duplicates(records, threshold=CHUNK_DEDUP_THRESHOLD):
+    """
+    Collapse near-duplicate markdown chunks within each department (see collapse_near_duplicates).
+    CSV row chunks are kept as they are. Order is preserved otherwise.
+    """
+    if threshold <= 0:
+        return list(records)
+    by_dept = {}
+    for r in records:
+        if "row_start" not in r["metadata"]:
+            by_dept.setdefault(r["metadata"]["department"], []).append(r)
+    kept = {r["id"]: r for dept_records in by_dept.values()
+            for r in collapse_near_duplicates(dept_records, threshold, CHUNK_DEDUP_PERMUTATIONS, CHUNK_DEDUP_BANDS)}
+    return [r if "row_start" in r["metadata"] else kept[r["id"]]
+            for r in records if "row_start" in r["metadata"] or r["id"] in kept]
+
+def build_docs_for_vectorstore(documents, count_tokens=None, dedup_threshold=CHUNK_DEDUP_THRESHOLD):
+    return collapse_department_duplicates(list(iter_docs_for_vectorstore(documents, count_tokens)), dedup_threshold)
 
 if __name__ == "__main__":
-    print("Starting ingestion process (LangChain + Chroma) ...")
-    docs = discover_documents()
-    print(f"Discovered {len(docs)} source files.")
-    vs = VectorStore()
-    prepared = build_docs_for_vectorstore(docs)
-    print(f"Prepared {len(prepared)} chunks to index.")
-    BATCH = 64
-    for i in range(0, len(prepared), BATCH):
-        batch = prepared[i:i+BATCH]
-        vs.add_documents(batch)
-        print(f"Indexed batch {i//BATCH + 1} / {math.ceil(len(prepared)/BATCH)}")
+    import argparse
+    from app.services.ingest import run_incremental_ingest
+
+    parser = argparse.ArgumentParser(description="Incrementally index resources/data into Chroma")
+    parser.add_argument("--full", action="store_true", help="re-embed every chunk, ignoring the manifest")
+    args = parser.parse_args()
+
+    print("Starting ingestion process (incremental, Chroma) ...")
+    report = run_incremental_ingest(full=args.full)
+    print(f"Files: {report['files_total']} total, {report['files_new']} new, {report['files_changed']} changed, "
+          f"{report['files_unchanged']} unchanged, {report['files_removed']} removed.")
+    print(f"Chunks: {report['chunks_embedded']} embedded, {report['chunks_skipped']} skipped, "
+          f"{report['chunks_deleted']} deleted in {report['seconds']}s; "
+          f"{report['chunks_collapsed']} near-duplicates stored as references.")
+    for name, st in report["stages"].items():
+        print(f"  stage {name:<8} items={st['items']:<6} units={st['units']:<7} busy={st['busy_seconds']}s "
+              f"blocked={st['blocked_seconds']}s rate={st['units_per_busy_second']}/s util={st['utilization']}")
+    print(f"Peak RSS: {report['peak_rss_mb']} MB")
     print("Ingestion complete. Persistence in", os.getenv("CHROMA_PERSIST_DIR", "./chroma_db"))
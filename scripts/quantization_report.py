@@ -0,0 +1,119 @@
+# scripts/quantization_report.py
+# Recall and memory of the quantized numpy index (float16 / int8 scan + float32 re-rank)
+# against the current Chroma VectorStore results, on a copy of the ingested chunks. Usage:
+#   python -m scripts.quantization_report --top-k 5 --rerank-factor 4 --output quant.json
+import argparse
+import json
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from scripts.benchmark import DEFAULT_QUESTIONS, percentiles
+
+MODES = ("none", "float16", "int8")
+
+
+def recall(results: List[List[Dict]], reference: List[List[Dict]]) -> Optional[float]:
+    """Mean fraction of each reference top-k (by id) that the results also return."""
+    scores = []
+    for got, want in zip(results, reference):
+        want_ids = {r["id"] for r in want}
+        if want_ids:
+            scores.append(len(want_ids & {r["id"] for r in got}) / len(want_ids))
+    return round(float(np.mean(scores)), 4) if scores else None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Quantized numpy index vs VectorStore: recall@k and memory")
+    parser.add_argument("--persist-dir", default=None, help="Chroma index to compare against (default: CHROMA_PERSIST_DIR)")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--rerank-factor", type=int, default=None, help="default: NUMPY_RERANK_FACTOR")
+    parser.add_argument("--samples", type=int, default=200, help="extra queries drawn from indexed chunk text")
+    parser.add_argument("--questions", default=None, help="file with one question per line")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    from app.services.numpy_store import NUMPY_RERANK_FACTOR, NumpyVectorStore
+    from app.services.rag import ROLE_ACCESS
+    from app.services.vectorstore import PERSIST_DIR, VectorStore
+
+    rerank_factor = args.rerank_factor or NUMPY_RERANK_FACTOR
+
+    reference = VectorStore(persist_directory=args.persist_dir or PERSIST_DIR)
+    stored = reference.collection.get(include=["documents", "metadatas", "embeddings"])
+    if not stored.get("ids"):
+        print("The VectorStore is empty; run the ingest first.")
+        return 1
+    docs = [{"id": i, "content": d, "metadata": m}
+            for i, d, m in zip(stored["ids"], stored["documents"], stored["metadatas"])]
+    embeddings = np.asarray(stored["embeddings"], dtype=np.float32)
+    print(f"VectorStore: {len(docs)} chunks, dim {embeddings.shape[1]}")
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [l.strip() for l in f if l.strip()]
+    rng = random.Random(args.seed)
+    sampled = rng.sample(docs, min(args.samples, len(docs)))
+    query_texts = questions + [d["content"][:200] for d in sampled]
+    q_embs = reference.embed_queries(query_texts)
+    wheres = {role: {"department": {"$in": allowed}} for role, allowed in ROLE_ACCESS.items()}
+
+    expected = {role: reference.query_embeddings(q_embs, args.top_k, where) for role, where in wheres.items()}
+
+    workdir = tempfile.mkdtemp(prefix="finbot-quant-")
+    report = {"config": {**vars(args), "rerank_factor": rerank_factor, "queries": len(query_texts),
+                         "chunks": len(docs), "dim": int(embeddings.shape[1])}, "modes": {}}
+    exact: Dict[str, List[List[Dict]]] = {}
+    try:
+        for mode in MODES:
+            built = NumpyVectorStore(index_dir=workdir, collection_name=mode, engine=reference.engine,
+                                     quantization=mode, rerank_factor=rerank_factor)
+            built.upsert_embedded(docs, embeddings)
+            built.persist()
+            # Reopen from disk: what a freshly started worker process holds
+            store = NumpyVectorStore(index_dir=workdir, collection_name=mode, engine=reference.engine,
+                                     quantization=mode, rerank_factor=rerank_factor)
+            memory = store.memory_stats()
+            memory.pop("partitions")
+
+            got, latencies = {}, []
+            for role, where in wheres.items():
+                got[role] = []
+                for q in q_embs:
+                    t0 = time.perf_counter()
+                    got[role].extend(store.query_embeddings(q[None, :], args.top_k, where))
+                    latencies.append(time.perf_counter() - t0)
+            if mode == "none":
+                exact = got
+            report["modes"][mode] = {
+                "recall_vs_vectorstore": {role: recall(got[role], expected[role]) for role in wheres},
+                "recall_vs_exact": {role: recall(got[role], exact[role]) for role in wheres},
+                "memory": memory,
+                "scan_bytes_vs_float32": round(memory["scan_bytes"] / max(memory["full_precision_bytes"], 1), 3),
+                "query": percentiles(latencies),
+            }
+
+        for mode, r in report["modes"].items():
+            vs = np.mean([v for v in r["recall_vs_vectorstore"].values() if v is not None])
+            ex = np.mean([v for v in r["recall_vs_exact"].values() if v is not None])
+            print(f"  {mode:<8} recall@{args.top_k} vs VectorStore {vs:.4f}  vs exact float32 {ex:.4f}   "
+                  f"scanned {r['memory']['scan_bytes'] / 1e6:.2f} MB ({r['scan_bytes_vs_float32']:.0%} of float32)   "
+                  f"query p50/p95 {r['query']['p50_ms']}/{r['query']['p95_ms']} ms")
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print("Report written to", args.output)
+        return 0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+# scripts/snapshot.py
+# Export, list, verify and activate read-only index snapshots (VECTOR_BACKEND=snapshot). Usage:
+#   python -m scripts.snapshot export --source chroma      # new version from the ingested index, made CURRENT
+#   python -m scripts.snapshot list
+#   python -m scripts.snapshot verify [--version V]        # full sha256 check
+#   python -m scripts.snapshot activate --version V        # roll CURRENT forward or back
+import argparse
+import json
+import os
+import sys
+from typing import List, Optional
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Manage memory-mapped index snapshots")
+    parser.add_argument("command", choices=["export", "list", "verify", "activate"])
+    parser.add_argument("--dir", default=None, help="snapshot root (default: SNAPSHOT_DIR)")
+    parser.add_argument("--source", default=None, choices=["chroma", "numpy"],
+                        help="store to export (default: VECTOR_BACKEND, or chroma when that is snapshot)")
+    parser.add_argument("--version", default=None, help="snapshot version (default: CURRENT)")
+    parser.add_argument("--no-activate", action="store_true", help="export without pointing CURRENT at it")
+    args = parser.parse_args(argv)
+
+    from app.services.snapshot import (SNAPSHOT_DIR, SnapshotError, activate_snapshot, current_version,
+                                       export_snapshot, list_snapshots, verify_snapshot)
+
+    root = args.dir or SNAPSHOT_DIR
+    try:
+        if args.command == "export":
+            from app.services.registry import VECTOR_BACKEND, create_vector_store
+
+            source = args.source or (VECTOR_BACKEND if VECTOR_BACKEND != "snapshot" else "chroma")
+            os.makedirs(root, exist_ok=True)
+            manifest = export_snapshot(create_vector_store(source), root, activate=not args.no_activate)
+            print(f"Exported {manifest['version']}: {manifest['rows']} rows, dim {manifest['dim']}, "
+                  f"departments {sorted(manifest['departments'])}" + ("" if args.no_activate else " (CURRENT)"))
+        elif args.command == "list":
+            current = current_version(root)
+            for snap in list_snapshots(root):
+                mark = "*" if snap["version"] == current else " "
+                print(f"{mark} {snap['version']}  {snap['rows']:>8} rows  dim {snap['dim']}  {snap['model']}")
+        elif args.command == "verify":
+            version = args.version or current_version(root)
+            if not version:
+                raise SnapshotError(f"No snapshot in {root}")
+            path = os.path.join(root, version)
+            with open(os.path.join(path, "manifest.json"), "r", encoding="utf-8") as f:
+                verify_snapshot(path, json.load(f), "sha256")
+            print(f"{version}: all checksums match")
+        elif args.command == "activate":
+            if not args.version:
+                parser.error("activate needs --version")
+            activate_snapshot(args.version, root)
+            print(f"CURRENT -> {args.version}; restart the API workers to serve it")
+    except (SnapshotError, OSError) as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,4 @@
+# tests/conftest.py
+# test_day*.py are scripts run by hand against a live server (uvicorn on 127.0.0.1:8000);
+# keep them out of `pytest` so the unit tests run offline.
+collect_ignore_glob = ["test_day*.py"]
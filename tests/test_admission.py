@@ -0,0 +1,133 @@
+# tests/test_admission.py
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.services.admission import AdmissionController, DeadlineExceeded, QueueFull, RateLimited
+
+
+def controller(**kwargs):
+    kwargs = {"user_rate": 0, "role_rate": 0, "role_limits": {}, "slots": 1, "queue_size": 8,
+              "max_wait": 0.2, **kwargs}
+    return AdmissionController(**kwargs)
+
+
+async def generate(ctl, hold: float):
+    async with ctl.slot():
+        await asyncio.sleep(hold)
+
+
+async def run_batch(ctl, n: int, hold: float, deadline=None):
+    """n generations under one batch ticket, like abatch_answer_queries with parallelism n."""
+    with ctl.ticket("sam", "finance", "batch", deadline):
+        tasks = [asyncio.create_task(generate(ctl, hold)) for _ in range(n)]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def test_batch_items_get_their_own_deadline():
+    # 4 questions at 0.1s each on one slot, two at a time: the last starts 0.3s after the batch
+    # arrived, past max_wait, but only 0.1s after it asked for the slot
+    ctl = controller(max_wait=0.25)
+
+    async def main():
+        results = []
+        with ctl.ticket("sam", "finance", "batch"):
+            for _ in range(2):
+                results += await asyncio.gather(*(generate(ctl, 0.1) for _ in range(2)), return_exceptions=True)
+        return results
+
+    assert asyncio.run(main()) == [None] * 4
+    assert ctl.counters["deadline_exceeded"] == 0
+
+
+def test_explicit_deadline_bounds_the_whole_batch():
+    ctl = controller(max_wait=10)
+    results = asyncio.run(run_batch(ctl, 4, 0.1, deadline=time.monotonic() + 0.15))
+    assert results[:2] == [None, None]
+    assert all(isinstance(r, DeadlineExceeded) for r in results[2:])
+
+
+def test_deadline_passed_before_asking():
+    ctl = controller()
+
+    async def main():
+        with ctl.ticket("sam", "finance", "interactive", time.monotonic() - 1):
+            await generate(ctl, 0)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(main())
+
+
+def test_batch_cannot_fill_the_queue():
+    ctl = controller(queue_size=4, batch_queue_share=0.5)
+
+    async def main():
+        batch = asyncio.create_task(run_batch(ctl, 6, 0.05))
+        await asyncio.sleep(0.01)
+        # One batch question holds the slot and two wait; the other three were turned away
+        assert ctl.stats()["queued_by_priority"]["batch"] == 2
+        with ctl.ticket("tony", "engineering"):
+            chats = [asyncio.create_task(generate(ctl, 0.01)) for _ in range(2)]
+        return await batch, await asyncio.gather(*chats)
+
+    batch, chats = asyncio.run(main())
+    assert sum(isinstance(r, QueueFull) for r in batch) == 3
+    assert chats == [None, None]
+
+
+def test_interactive_served_before_batch():
+    ctl = controller()
+    order = []
+
+    async def tagged(kind, role, name):
+        with ctl.ticket(name, role, kind):
+            async with ctl.slot():
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+    async def main():
+        first = asyncio.create_task(tagged("batch", "finance", "b0"))
+        await asyncio.sleep(0)
+        rest = [asyncio.create_task(tagged(k, r, n)) for k, r, n in
+                (("batch", "finance", "b1"), ("interactive", "engineering", "i1"), ("interactive", "c_level", "c1"))]
+        await asyncio.gather(first, *rest)
+
+    asyncio.run(main())
+    assert order == ["b0", "c1", "i1", "b1"]
+
+
+def test_rate_limited_role_does_not_charge_the_user():
+    ctl = controller(user_rate=0.001, user_burst=3, role_limits={"finance": (0.001, 1)})
+    ctl.check("sam", "finance")
+    for _ in range(3):
+        with pytest.raises(RateLimited, match="role finance"):
+            ctl.check("sam", "finance")
+    # The three refused requests left the user's remaining two tokens alone
+    ctl.check("sam", "engineering")
+    ctl.check("sam", "engineering")
+    with pytest.raises(RateLimited, match="user sam"):
+        ctl.check("sam", "engineering")
+
+
+def test_slots_move_between_loops_only_while_idle():
+    ctl = controller()
+    held, release = threading.Event(), threading.Event()
+
+    async def hold():
+        async with ctl.slot():
+            held.set()
+            await asyncio.get_running_loop().run_in_executor(None, release.wait)
+
+    other = threading.Thread(target=asyncio.run, args=(hold(),))
+    other.start()
+    held.wait(1)
+    try:
+        with pytest.raises(RuntimeError):
+            asyncio.run(generate(ctl, 0))
+    finally:
+        release.set()
+        other.join(1)
+    asyncio.run(generate(ctl, 0))
+    assert ctl.stats()["in_use"] == 0
@@ -0,0 +1,68 @@
+# tests/test_answer_cache.py
+import numpy as np
+import pytest
+
+from app.services.cache import IndexGeneration, SemanticCache
+
+QUESTION = np.array([1.0, 0.0, 0.0, 0.0], dtype=np.float32)
+PARAPHRASE = np.array([0.99, 0.1, 0.0, 0.0], dtype=np.float32)
+
+FINANCE = (("finance", "general"), 5, 300, 0.2)
+EMPLOYEE = (("general",), 5, 300, 0.2)
+
+
+def make_cache(**kwargs):
+    return SemanticCache("test_answer", **{"maxsize": 16, "ttl": 60, "threshold": 0.9, **kwargs})
+
+
+def test_hit_within_partition():
+    cache = make_cache()
+    cache.set(FINANCE, QUESTION, "Q3 revenue was 4.2M")
+    value, similarity = cache.get(FINANCE, PARAPHRASE)
+    assert value == "Q3 revenue was 4.2M"
+    assert similarity > 0.9
+
+
+def test_partitions_never_share_answers():
+    cache = make_cache()
+    cache.set(FINANCE, QUESTION, "Q3 revenue was 4.2M")
+    assert cache.get(EMPLOYEE, QUESTION) is None
+    # Same departments but other generation parameters is another partition too
+    assert cache.get((("finance", "general"), 5, 300, 0.7), QUESTION) is None
+
+
+def test_partitions_keep_their_own_answers():
+    cache = make_cache()
+    cache.set(FINANCE, QUESTION, "finance answer")
+    cache.set(EMPLOYEE, QUESTION, "general answer")
+    assert cache.get(FINANCE, QUESTION)[0] == "finance answer"
+    assert cache.get(EMPLOYEE, QUESTION)[0] == "general answer"
+
+
+def test_changed_source_invalidates_entry():
+    generation = IndexGeneration()
+    cache = make_cache(generation=generation)
+    cache.set(FINANCE, QUESTION, "stale", sources={"finance/report.md"})
+    generation.bump({"marketing/plan.md"})
+    assert cache.get(FINANCE, QUESTION)[0] == "stale"
+    generation.bump({"finance/report.md"})
+    assert cache.get(FINANCE, QUESTION) is None
+    assert cache.invalidations == 1
+
+
+def test_roles_with_different_access_use_different_partitions(monkeypatch):
+    pytest.importorskip("langchain")
+    from app.services import rag
+
+    class Store:
+        def embed_query(self, text):
+            return QUESTION
+
+    monkeypatch.setattr(rag, "get_vector_store", lambda: Store())
+    monkeypatch.setattr(rag, "answer_cache", make_cache())
+    probe = rag.lookup_answer("What was Q3 revenue?", "finance", 5, 300, 0.2)
+    rag.remember_answer(probe, [], "Q3 revenue was 4.2M", ["finance/report.md#chunk-0"])
+
+    assert rag.lookup_answer("What was Q3 revenue?", "finance", 5, 300, 0.2)["hit"] is not None
+    assert rag.lookup_answer("What was Q3 revenue?", "c_level", 5, 300, 0.2)["hit"] is None
+    assert rag.lookup_answer("What was Q3 revenue?", "employee", 5, 300, 0.2)["hit"] is None
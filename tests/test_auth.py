@@ -0,0 +1,53 @@
+# tests/test_auth.py
+import time
+
+import pytest
+
+from app.services import auth
+from app.services.auth import InvalidToken, hash_password, issue_token, verify_basic, verify_token
+
+
+def test_valid_token_round_trip():
+    token = issue_token("Sam", "finance", ttl=60)
+    assert token["token_type"] == "bearer"
+    assert verify_token(token["access_token"]) == {"username": "Sam", "role": "finance"}
+
+
+def test_expired_token_rejected():
+    token = issue_token("Sam", "finance", ttl=-1)["access_token"]
+    with pytest.raises(InvalidToken, match="expired"):
+        verify_token(token)
+
+
+def test_tampered_payload_rejected():
+    payload, signature = issue_token("Sam", "finance", ttl=60)["access_token"].split(".")
+    forged = auth._b64encode(b'{"sub":"Sam","role":"c_level","exp":%d}' % (time.time() + 60))
+    with pytest.raises(InvalidToken, match="signature"):
+        verify_token(f"{forged}.{signature}")
+
+
+def test_tampered_signature_rejected():
+    token = issue_token("Sam", "finance", ttl=60)["access_token"]
+    flipped = token[:-1] + ("A" if token[-1] != "A" else "B")
+    with pytest.raises(InvalidToken):
+        verify_token(flipped)
+
+
+def test_token_signed_with_another_key_rejected(monkeypatch):
+    token = issue_token("Sam", "finance", ttl=60)["access_token"]
+    monkeypatch.setattr(auth, "AUTH_SECRET", "rotated-secret")
+    with pytest.raises(InvalidToken):
+        verify_token(token)
+
+
+@pytest.mark.parametrize("token", ["", "no-dot", ".", "abc."])
+def test_malformed_token_rejected(token):
+    with pytest.raises(InvalidToken):
+        verify_token(token)
+
+
+def test_basic_auth():
+    users = {"Sam": {"password_hash": hash_password("financepass", iterations=1000), "role": "finance"}}
+    assert verify_basic("Sam", "financepass", users) == {"username": "Sam", "role": "finance"}
+    assert verify_basic("Sam", "wrong", users) is None
+    assert verify_basic("Nobody", "financepass", users) is None
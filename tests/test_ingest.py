@@ -0,0 +1,110 @@
+# tests/test_ingest.py
+import time
+
+import numpy as np
+import pytest
+
+from app.services import embedding
+from app.services.ingest import run_incremental_ingest
+
+
+class MemoryStore:
+    """Just enough of BaseVectorStore for run_incremental_ingest."""
+    read_only = False
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self.rows = {}
+        self.deleted = []
+
+    def embed_texts(self, texts):
+        return np.zeros((len(texts), 4), dtype=np.float32)
+
+    def upsert_embedded(self, docs, embeddings):
+        for d in docs:
+            self.rows[d["id"]] = d["content"]
+
+    def delete_ids(self, ids):
+        self.deleted.extend(ids)
+        for i in ids:
+            self.rows.pop(i, None)
+
+    def persist(self):
+        pass
+
+
+def paragraphs(*words):
+    # One heading per paragraph, each big enough to close a chunk (min_tokens=64 by default)
+    return "\n\n".join(f"# {w}\n\n" + " ".join(f"{w}{i}" for i in range(80)) for w in words)
+
+
+def md(dept, source, *words):
+    return {"department": dept, "source": source, "kind": "markdown", "content": paragraphs(*words)}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(embedding, "get_token_counter", lambda *a, **k: lambda texts: [len(t.split()) for t in texts])
+    return MemoryStore(str(tmp_path / "manifest.json"))
+
+
+def ingest(store, docs):
+    return run_incremental_ingest(vs=store, documents=docs, invalidate=False, dedup_threshold=0)
+
+
+def test_new_changed_shrunk_and_removed_files(store):
+    report = ingest(store, [md("finance", "a.md", "alpha", "beta", "gamma"), md("hr", "b.md", "delta")])
+    assert (report["files_new"], report["chunks_embedded"]) == (2, 4)
+    assert set(store.rows) == {"finance::a.md::chunk-0", "finance::a.md::chunk-1", "finance::a.md::chunk-2",
+                               "hr::b.md::chunk-0"}
+
+    # Nothing changed: nothing embedded or deleted
+    report = ingest(store, [md("finance", "a.md", "alpha", "beta", "gamma"), md("hr", "b.md", "delta")])
+    assert (report["files_unchanged"], report["chunks_embedded"], report["chunks_deleted"]) == (2, 0, 0)
+    assert report["chunks_skipped"] == 4
+
+    # a.md: second chunk edited, third dropped; b.md removed; c.md added
+    report = ingest(store, [md("finance", "a.md", "alpha", "BETA"), md("finance", "c.md", "epsilon")])
+    assert (report["files_changed"], report["files_new"], report["files_removed"]) == (1, 1, 1)
+    assert report["chunks_embedded"] == 2  # a.md chunk-1 and c.md chunk-0; a.md chunk-0 is skipped
+    assert sorted(store.deleted) == ["finance::a.md::chunk-2", "hr::b.md::chunk-0"]
+    assert set(store.rows) == {"finance::a.md::chunk-0", "finance::a.md::chunk-1", "finance::c.md::chunk-0"}
+    assert store.rows["finance::a.md::chunk-1"].startswith("# BETA")
+    assert report["changed_sources"] == ["finance/a.md", "finance/c.md", "hr/b.md"]
+
+
+def test_full_reembeds_everything(store):
+    docs = [md("finance", "a.md", "alpha", "beta")]
+    ingest(store, docs)
+    report = run_incremental_ingest(vs=store, documents=docs, full=True, invalidate=False, dedup_threshold=0)
+    assert (report["files_changed"], report["chunks_embedded"], report["chunks_skipped"]) == (1, 2, 0)
+
+
+def test_dedup_bundles_count_each_file_once(store):
+    docs = [md("finance", "a.md", "alpha"), md("finance", "copy.md", "alpha"), md("hr", "b.md", "delta")]
+    report = run_incremental_ingest(vs=store, documents=docs, invalidate=False, dedup_threshold=0.85)
+    assert (report["files_total"], report["files_new"], report["chunks_collapsed"]) == (3, 3, 1)
+    assert set(store.rows) == {"finance::a.md::chunk-0", "hr::b.md::chunk-0"}
+
+    # Editing hr/b.md re-chunks the hr bundle only; finance files stay unchanged
+    report = run_incremental_ingest(vs=store, documents=docs[:2] + [md("hr", "b.md", "DELTA")],
+                                    invalidate=False, dedup_threshold=0.85)
+    assert (report["files_total"], report["files_changed"], report["files_unchanged"]) == (3, 1, 2)
+    assert report["chunks_embedded"] == 1
+
+
+def test_dedup_bundles_stream_per_department(store):
+    def source():
+        yield md("finance", "a.md", "alpha")
+        yield md("finance", "copy.md", "alpha")
+        # The finance bundle is written before the next department is even listed
+        yield md("hr", "b.md", "delta")
+        deadline = time.monotonic() + 5
+        while "finance::a.md::chunk-0" not in store.rows and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert "finance::a.md::chunk-0" in store.rows
+        yield md("marketing", "c.md", "epsilon")
+
+    report = run_incremental_ingest(vs=store, documents=source(), batch_size=1, invalidate=False,
+                                    dedup_threshold=0.85)
+    assert (report["files_new"], report["chunks_embedded"]) == (4, 3)
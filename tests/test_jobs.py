@@ -0,0 +1,82 @@
+# tests/test_jobs.py
+import numpy as np
+import pytest
+
+from app.services import jobs
+from app.services.jobs import IngestJob, _seed
+from app.services.numpy_store import NumpyVectorStore
+from app.services.pipeline import PipelineCancelled
+from app.services.snapshot import iter_store
+
+
+class Engine:
+    model_name = "test-model"
+    dim = 4
+
+    def encode(self, texts):
+        return np.ones((len(texts), self.dim), dtype=np.float32)
+
+
+class Collection:
+    """Chroma collection.get with limit/offset over in-memory rows."""
+
+    def __init__(self, n):
+        self.rows = [(f"id{i}", f"doc {i}", {"department": "general"}, [float(i), 1.0, 0.0, 0.0]) for i in range(n)]
+        self.calls = []
+
+    def get(self, include, limit, offset):
+        self.calls.append((limit, offset))
+        page = self.rows[offset:offset + limit]
+        return {"ids": [r[0] for r in page], "documents": [r[1] for r in page],
+                "metadatas": [r[2] for r in page], "embeddings": [r[3] for r in page]}
+
+
+class ChromaLike:
+    def __init__(self, n):
+        self.collection = Collection(n)
+
+
+def numpy_store(tmp_path, name, rows=0):
+    store = NumpyVectorStore(index_dir=str(tmp_path), collection_name=name, engine=Engine())
+    if rows:
+        rng = np.random.default_rng(0)
+        store.upsert_embedded([{"id": f"{d}-{i}", "content": f"{d} {i}", "metadata": {"department": d}}
+                               for d in ("finance", "hr") for i in range(rows)],
+                              rng.normal(size=(2 * rows, 4)).astype(np.float32))
+    return store
+
+
+def test_iter_store_pages_chroma():
+    store = ChromaLike(25)
+    pages = list(iter_store(store, page_size=10))
+    assert [len(p[0]) for p in pages] == [10, 10, 5]
+    assert store.collection.calls == [(10, 0), (10, 10), (10, 20), (10, 25)]
+    assert pages[2][3].shape == (5, 4)
+
+
+def test_iter_store_pages_numpy_partitions(tmp_path):
+    pages = list(iter_store(numpy_store(tmp_path, "src", rows=7), page_size=3))
+    assert [len(p[0]) for p in pages] == [3, 3, 1, 3, 3, 1]
+    assert all({m["department"] for m in p[2]} in ({"finance"}, {"hr"}) for p in pages)
+
+
+def test_seed_copies_page_by_page(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "INGEST_SEED_BATCH", 4)
+    current, target = numpy_store(tmp_path, "src", rows=9), numpy_store(tmp_path, "dst")
+    writes = []
+    upsert = target.upsert_embedded
+    monkeypatch.setattr(target, "upsert_embedded", lambda docs, embs: (writes.append(len(docs)), upsert(docs, embs)))
+    job = IngestJob(full=False, requested_by="test")
+    _seed(job, current, target)
+    assert max(writes) <= 4 and sum(writes) == 18
+    assert job.progress["chunks_seeded"] == 18
+    for dept in ("finance", "hr"):
+        assert target.partitions[dept].ids == current.partitions[dept].ids
+        np.testing.assert_allclose(target.partitions[dept].matrix, current.partitions[dept].matrix, rtol=1e-6)
+
+
+def test_seed_stops_when_cancelled(tmp_path):
+    job = IngestJob(full=False, requested_by="test")
+    job.cancel_event.set()
+    with pytest.raises(PipelineCancelled):
+        _seed(job, numpy_store(tmp_path, "src", rows=3), numpy_store(tmp_path, "dst"))
@@ -0,0 +1,38 @@
+# tests/test_numpy_store.py
+import numpy as np
+import pytest
+
+from app.services.numpy_store import Partition, normalize_rows, quantize
+
+
+def unit(rng, n, dim=8):
+    return normalize_rows(rng.normal(size=(n, dim)))
+
+
+@pytest.mark.parametrize("mode", ["int8", "float16"])
+def test_upsert_requantizes_new_overwritten_and_repeated_rows(mode):
+    rng = np.random.default_rng(0)
+    base = unit(rng, 6)
+    part = Partition.empty(8, mode).upsert([f"c{i}" for i in range(6)], ["old"] * 6, [{}] * 6, base)
+
+    overwrite, new, repeated_first, repeated_last = unit(rng, 4)
+    part = part.upsert(
+        ["c2", "n1", "n2", "n2"], ["c2 new", "n1", "n2 first", "n2 last"], [{}] * 4,
+        np.stack([overwrite, new, repeated_first, repeated_last]),
+    )
+
+    assert part.ids == [f"c{i}" for i in range(6)] + ["n1", "n2"]
+    assert part.documents[2] == "c2 new" and part.documents[7] == "n2 last"
+    np.testing.assert_array_equal(part.matrix[2], overwrite)
+    np.testing.assert_array_equal(part.matrix[7], repeated_last)
+    compact, scales = quantize(part.matrix, mode)
+    np.testing.assert_array_equal(part.compact, compact)
+    if mode == "int8":
+        np.testing.assert_array_equal(part.scales, scales)
+    else:
+        assert part.scales is None
+
+    for row, vec in ((2, overwrite), (7, repeated_last)):
+        (score, hit), = part.top_k(vec[None, :], k=1)[0]
+        assert hit == row
+        assert score == pytest.approx(1.0, abs=1e-5)
@@ -0,0 +1,95 @@
+# tests/test_registry.py
+import os
+
+import pytest
+
+from app.services import registry
+from app.services.vectorstore import COLLECTION_NAME
+
+
+class Store:
+    def __init__(self, collection_name):
+        self.collection_name = collection_name
+        self.closed = self.dropped = False
+
+    def close(self):
+        self.closed = True
+
+    def drop(self):
+        self.dropped = True
+
+
+@pytest.fixture
+def created(tmp_path, monkeypatch):
+    """Stores the registry opened, in order; the pointer file lives in tmp_path."""
+    stores = []
+
+    def create_vector_store(backend=None, collection_name=None, **kwargs):
+        stores.append(Store(collection_name or registry.collection_pointer()["active"]))
+        return stores[-1]
+
+    monkeypatch.setattr(registry, "COLLECTION_POINTER_DIR", str(tmp_path))
+    monkeypatch.setattr(registry, "VECTOR_BACKEND", "chroma")
+    monkeypatch.setattr(registry, "create_vector_store", create_vector_store)
+    monkeypatch.setattr(registry, "_store", None)
+    monkeypatch.setattr(registry, "_pointer_seen", {"mtime": None, "checked": 0.0})
+    return stores
+
+
+def test_activate_then_rollback_restores_previous(created):
+    a, b = Store("blue"), Store("green")
+    registry.activate_collection(a, "chroma")
+    pointer = registry.activate_collection(b, "chroma")
+    assert pointer["active"] == "green" and pointer["history"] == ["blue", COLLECTION_NAME]
+    assert a.closed and registry._store is b
+
+    pointer = registry.rollback_collection("chroma")
+    assert pointer["active"] == "blue" and pointer["history"] == ["green", COLLECTION_NAME]
+    assert registry.collection_pointer("chroma") == {**pointer, "retired": []}
+    assert registry._store is created[-1] and created[-1].collection_name == "blue"
+    assert b.closed
+
+
+def test_rollback_without_history_raises(created):
+    with pytest.raises(LookupError):
+        registry.rollback_collection("chroma")
+
+
+def test_prune_retires_then_drops_after_grace(created, monkeypatch):
+    registry._write_pointer("chroma", {"active": "d", "history": ["c", "b", "a"], "retired": []})
+    now = registry.time.time()
+    monkeypatch.setattr(registry.time, "time", lambda: now)
+    assert registry.prune_collections("chroma", keep=1, grace=60) == []
+    pointer = registry.collection_pointer("chroma")
+    assert pointer["history"] == ["c"]
+    assert [r["name"] for r in pointer["retired"]] == ["b", "a"]
+    assert not created
+
+    monkeypatch.setattr(registry.time, "time", lambda: now + 30)
+    assert registry.prune_collections("chroma", keep=1, grace=60) == []
+
+    monkeypatch.setattr(registry.time, "time", lambda: now + 61)
+    assert registry.prune_collections("chroma", keep=1, grace=60) == ["b", "a"]
+    assert [(s.collection_name, s.dropped) for s in created] == [("b", True), ("a", True)]
+    assert registry.collection_pointer("chroma") == {"active": "d", "history": ["c"], "retired": []}
+
+
+def test_follows_pointer_written_by_another_process(created, monkeypatch):
+    monkeypatch.setattr(registry, "COLLECTION_POINTER_POLL", 0.001)
+    registry.activate_collection(Store("blue"))
+    first = registry.get_vector_store()
+    assert first.collection_name == "blue"
+
+    # Another worker activates green: only the pointer file changes
+    pointer = registry.collection_pointer()
+    registry._write_pointer(registry.VECTOR_BACKEND, {**pointer, "active": "green", "history": ["blue"]})
+    path = registry._pointer_path(registry.VECTOR_BACKEND)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    registry._pointer_seen["checked"] = 0.0
+
+    store = registry.get_vector_store()
+    assert store.collection_name == "green" and store is created[-1]
+    assert first.closed
+    registry._pointer_seen["checked"] = 0.0
+    assert registry.get_vector_store() is store
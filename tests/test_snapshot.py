@@ -0,0 +1,49 @@
+# tests/test_snapshot.py
+import os
+
+import numpy as np
+import pytest
+
+from app.services.numpy_store import NumpyVectorStore
+from app.services.snapshot import SnapshotError, SnapshotVectorStore, export_snapshot, verify_snapshot
+
+
+class Engine:
+    model_name = "test-model"
+    dim = 4
+
+    def encode(self, texts):
+        return np.ones((len(texts), self.dim), dtype=np.float32)
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    source = NumpyVectorStore(index_dir=str(tmp_path / "index"), collection_name="src", engine=Engine())
+    rng = np.random.default_rng(0)
+    source.upsert_embedded([{"id": f"c{i}", "content": f"chunk {i}", "metadata": {"department": "finance"}}
+                            for i in range(5)], rng.normal(size=(5, 4)).astype(np.float32))
+    root = str(tmp_path / "snapshots")
+    manifest = export_snapshot(source, root)
+    return root, manifest
+
+
+def test_default_open_writes_nothing_into_the_version(snapshot):
+    root, manifest = snapshot
+    version_dir = os.path.join(root, manifest["version"])
+    before = sorted(os.listdir(version_dir))
+    store = SnapshotVectorStore(root=root, engine=Engine())
+    assert store.count() == 5
+    store.close()
+    assert sorted(os.listdir(version_dir)) == before
+
+
+def test_sha256_catches_same_size_corruption(snapshot):
+    root, manifest = snapshot
+    version_dir = os.path.join(root, manifest["version"])
+    with open(os.path.join(version_dir, "records.bin"), "r+b") as f:
+        f.write(b"X")
+    verify_snapshot(version_dir, manifest, "size")
+    with pytest.raises(SnapshotError):
+        verify_snapshot(version_dir, manifest, "sha256")
+    with pytest.raises(SnapshotError):
+        SnapshotVectorStore(root=root, engine=Engine(), verify="sha256")
@@ -0,0 +1,77 @@
+# tests/test_tabular.py
+import pytest
+
+from app.services.tabular import TabularEngine
+
+HR_CSV = """employee_id,full_name,role,department,location,manager_id,leave_balance,leaves_taken,attendance_pct
+FINEMP1000,Aadhya Patel,Sales Manager,Sales,Pune,FINEMP1002,22,11,99.31
+FINEMP1001,Isha Chowdhury,Credit Officer,Finance,Pune,FINEMP1002,8,3,85.15
+FINEMP1002,Rohan Mehta,Finance Director,Finance,Mumbai,,15,6,91.40
+FINEMP1003,Kavya Rao,Brand Lead,Marketing,Mumbai,FINEMP1002,12,4,93.10
+"""
+BUDGET_CSV = """line_item,quarter,amount
+Cloud,Q1,120000
+Cloud,Q2,135000
+Travel,Q1,40000
+"""
+
+
+@pytest.fixture
+def engine(tmp_path):
+    for dept, name, text in (("hr", "hr_data.csv", HR_CSV), ("finance", "budget.csv", BUDGET_CSV)):
+        (tmp_path / dept).mkdir()
+        (tmp_path / dept / name).write_text(text)
+    (tmp_path / "general").mkdir()
+    (tmp_path / "general" / "handbook.md").write_text("# Handbook\nBe kind.\n")
+    return TabularEngine(base_path=str(tmp_path))
+
+
+def test_allowed_role_gets_structured_answer(engine):
+    res = engine.try_answer("How many employees are in the Finance department?", ["hr", "general"])
+    assert res["sources"] == ["hr_data.csv"]
+    assert res["answer"].endswith("department = Finance: 2.")
+
+
+def test_lookup_blocked_without_department_access(engine):
+    for allowed in (["finance", "general"], ["general"], []):
+        assert engine.try_answer("What is the attendance_pct of FINEMP1001?", allowed) is None
+        assert engine.try_answer("How many employees are in the Finance department?", allowed) is None
+
+
+def test_lookup_allowed_with_department_access(engine):
+    res = engine.try_answer("What is the attendance_pct of FINEMP1001?", ["hr", "general"])
+    assert res["sources"] == ["hr_data.csv"]
+    assert "85.15" in res["answer"]
+
+
+def test_only_permitted_tables_are_consulted(engine):
+    res = engine.try_answer("Total amount by line_item", ["finance", "general"])
+    assert res["sources"] == ["budget.csv"]
+    assert "Cloud: 255000" in res["answer"]
+    assert engine.try_answer("Total amount by line_item", ["hr", "general"]) is None
+
+
+@pytest.mark.parametrize("question", [
+    "How many sick days do employees get per year?",
+    "How many leaves do employees get?",
+    "How many days of sick leave can employees take?",
+    "What is the total number of leave days employees get?",
+    "How many vacation days do employees in Finance get per year?",
+])
+def test_policy_question_falls_back_to_rag(engine, question):
+    assert engine.try_answer(question, ["hr", "general"]) is None
+
+
+def test_department_name_alone_is_not_tabular_intent(engine):
+    allowed = ["finance", "marketing", "hr", "engineering", "general"]
+    assert engine.try_answer("How many marketing campaigns ran in Q4 2024?", allowed) is None
+
+
+@pytest.mark.parametrize("question, answer", [
+    ("What is the total number of employees?", "Count of rows: 4."),
+    ("What is the headcount in Marketing?", "Count of rows where department = Marketing: 1."),
+    ("What is the average leave balance in Finance?", "mean of leave_balance where department = Finance: 11.5"),
+    ("How many employees per department?", "count by department: Finance: 2"),
+])
+def test_explicit_tabular_questions(engine, question, answer):
+    assert engine.try_answer(question, ["hr", "general"])["answer"].startswith(answer)